@@ -21,6 +21,7 @@ _builtin_plugins = [
     'debug_console',
     'generate_config',
     'license_key',
+    'local_aggregator',
     'local_config',
     'network_config',
     'record_deploy',
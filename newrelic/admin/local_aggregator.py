@@ -0,0 +1,75 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import print_function
+
+from newrelic.admin import command, usage
+
+
+@command('local-aggregator', 'config_file',
+"""Runs a local aggregator process after having loaded the settings from
+<config_file>. Processes on the same host which have local_daemon.enabled
+set forward the data they collect to the aggregator over the UNIX domain
+socket given by local_daemon.socket_path. The aggregator merges the data
+and reports it to the data collector, so only one connection and harvest
+is made for the host. The process runs until it is terminated.""",
+log_intercept=False)
+def local_aggregator(args):
+    import os
+    import signal
+    import sys
+    import threading
+
+    if len(args) == 0:
+        usage('local-aggregator')
+        sys.exit(1)
+
+    from newrelic.config import initialize
+    from newrelic.core.agent import agent_instance
+    from newrelic.core.config import global_settings
+    from newrelic.core.local_aggregator import LocalAggregator
+
+    config_file = args[0]
+    environment = os.environ.get('NEW_RELIC_ENVIRONMENT')
+
+    if config_file == '-':
+        config_file = os.environ.get('NEW_RELIC_CONFIG_FILE')
+
+    initialize(config_file, environment, ignore_errors=False)
+
+    # The aggregator reports data directly to the data collector even
+    # though the shared configuration file enables the local aggregator.
+
+    settings = global_settings()
+    settings.local_daemon.enabled = False
+
+    agent = agent_instance()
+
+    aggregator = LocalAggregator(settings.local_daemon.socket_path, agent,
+            startup_timeout=settings.local_daemon.startup_timeout)
+    aggregator.start()
+
+    terminated = threading.Event()
+
+    def _terminate(signum, frame):
+        terminated.set()
+
+    signal.signal(signal.SIGTERM, _terminate)
+    signal.signal(signal.SIGINT, _terminate)
+
+    while not terminated.is_set():
+        terminated.wait(1.0)
+
+    aggregator.stop()
+    agent.shutdown_agent()
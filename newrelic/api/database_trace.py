@@ -48,6 +48,10 @@ def enable_datastore_instance_feature(dbapi2_module):
 
 class DatabaseTrace(TimeTrace):
 
+    __slots__ = ('sql', 'dbapi2_module', 'connect_params', 'cursor_params',
+            'sql_parameters', 'execute_params', 'host', 'port_path_or_id',
+            'database_name', 'stack_trace', 'sql_format')
+
     __async_explain_plan_logged = False
 
     def __init__(self, sql, dbapi2_module=None,
@@ -203,7 +207,7 @@ class DatabaseTrace(TimeTrace):
         return DatabaseNode(
                 dbapi2_module=self.dbapi2_module,
                 sql=self.sql,
-                children=self.children,
+                children=self._node_children(),
                 start_time=self.start_time,
                 end_time=self.end_time,
                 duration=self.duration,
@@ -217,9 +221,9 @@ class DatabaseTrace(TimeTrace):
                 host=self.host,
                 port_path_or_id=self.port_path_or_id,
                 database_name=self.database_name,
-                guid=self.guid,
+                guid=self._guid,
                 agent_attributes=self.agent_attributes,
-                user_attributes=self.user_attributes)
+                user_attributes=self._node_user_attributes())
 
 
 def DatabaseTraceWrapper(wrapped, sql, dbapi2_module=None):
@@ -21,6 +21,10 @@ from newrelic.core.datastore_node import DatastoreNode
 
 
 class DatastoreTrace(TimeTrace):
+
+    __slots__ = ('instance_reporting_enabled', 'database_name_enabled',
+            'product', 'target', 'operation', 'host', 'port_path_or_id',
+            'database_name')
     """Context manager for timing datastore queries.
 
     :param product: The name of the vendor.
@@ -112,7 +116,7 @@ class DatastoreTrace(TimeTrace):
                 product=self.product,
                 target=self.target,
                 operation=self.operation,
-                children=self.children,
+                children=self._node_children(),
                 start_time=self.start_time,
                 end_time=self.end_time,
                 duration=self.duration,
@@ -120,9 +124,9 @@ class DatastoreTrace(TimeTrace):
                 host=self.host,
                 port_path_or_id=self.port_path_or_id,
                 database_name=self.database_name,
-                guid=self.guid,
+                guid=self._guid,
                 agent_attributes=self.agent_attributes,
-                user_attributes=self.user_attributes,)
+                user_attributes=self._node_user_attributes(),)
 
 
 def DatastoreTraceWrapper(wrapped, product, target, operation):
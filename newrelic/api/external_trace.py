@@ -23,6 +23,8 @@ from newrelic.common.object_wrapper import FunctionWrapper, wrap_object
 
 class ExternalTrace(CatHeaderMixin, TimeTrace):
 
+    __slots__ = ('library', 'url', 'method', 'params', 'settings')
+
     def __init__(self, library, url, method=None, **kwargs):
         parent = None
         if kwargs:
@@ -35,6 +37,7 @@ class ExternalTrace(CatHeaderMixin, TimeTrace):
         self.url = url
         self.method = method
         self.params = {}
+        self.settings = None
 
     def __repr__(self):
         return '<%s %s>' % (self.__class__.__name__, dict(
@@ -52,15 +55,15 @@ class ExternalTrace(CatHeaderMixin, TimeTrace):
                 library=self.library,
                 url=self.url,
                 method=self.method,
-                children=self.children,
+                children=self._node_children(),
                 start_time=self.start_time,
                 end_time=self.end_time,
                 duration=self.duration,
                 exclusive=self.exclusive,
                 params=self.params,
-                guid=self.guid,
+                guid=self._guid,
                 agent_attributes=self.agent_attributes,
-                user_attributes=self.user_attributes)
+                user_attributes=self._node_user_attributes())
 
 
 def ExternalTraceWrapper(wrapped, library, url, method=None):
@@ -23,6 +23,8 @@ from newrelic.core.function_node import FunctionNode
 
 class FunctionTrace(TimeTrace):
 
+    __slots__ = ('name', 'group', 'label', 'params', 'terminal', 'rollup')
+
     def __init__(self, name, group=None, label=None,
             params=None, terminal=False, rollup=None, **kwargs):
         parent = None
@@ -69,7 +71,7 @@ class FunctionTrace(TimeTrace):
         return FunctionNode(
                 group=self.group,
                 name=self.name,
-                children=self.children,
+                children=self._node_children(),
                 start_time=self.start_time,
                 end_time=self.end_time,
                 duration=self.duration,
@@ -77,9 +79,9 @@ class FunctionTrace(TimeTrace):
                 label=self.label,
                 params=self.params,
                 rollup=self.rollup,
-                guid=self.guid,
+                guid=self._guid,
                 agent_attributes=self.agent_attributes,
-                user_attributes=self.user_attributes)
+                user_attributes=self._node_user_attributes())
 
 
 def FunctionTraceWrapper(wrapped, name=None, group=None, label=None,
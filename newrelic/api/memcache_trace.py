@@ -22,6 +22,8 @@ from newrelic.common.object_wrapper import FunctionWrapper, wrap_object
 
 class MemcacheTrace(TimeTrace):
 
+    __slots__ = ('command',)
+
     def __init__(self, command, **kwargs):
         parent = None
         if kwargs:
@@ -42,14 +44,14 @@ class MemcacheTrace(TimeTrace):
     def create_node(self):
         return MemcacheNode(
                 command=self.command,
-                children=self.children,
+                children=self._node_children(),
                 start_time=self.start_time,
                 end_time=self.end_time,
                 duration=self.duration,
                 exclusive=self.exclusive,
-                guid=self.guid,
+                guid=self._guid,
                 agent_attributes=self.agent_attributes,
-                user_attributes=self.user_attributes)
+                user_attributes=self._node_user_attributes())
 
 
 def MemcacheTraceWrapper(wrapped, command):
@@ -23,6 +23,9 @@ from newrelic.core.message_node import MessageNode
 
 class MessageTrace(CatHeaderMixin, TimeTrace):
 
+    __slots__ = ('library', 'operation', 'params', 'destination_type',
+            'destination_name', 'settings')
+
     cat_id_key = 'NewRelicID'
     cat_transaction_key = 'NewRelicTransaction'
     cat_appdata_key = 'NewRelicAppData'
@@ -47,6 +50,8 @@ class MessageTrace(CatHeaderMixin, TimeTrace):
         self.destination_type = destination_type
         self.destination_name = destination_name
 
+        self.settings = None
+
     def __enter__(self):
         result = super(MessageTrace, self).__enter__()
 
@@ -72,7 +77,7 @@ class MessageTrace(CatHeaderMixin, TimeTrace):
         return MessageNode(
                 library=self.library,
                 operation=self.operation,
-                children=self.children,
+                children=self._node_children(),
                 start_time=self.start_time,
                 end_time=self.end_time,
                 duration=self.duration,
@@ -80,9 +85,9 @@ class MessageTrace(CatHeaderMixin, TimeTrace):
                 destination_name=self.destination_name,
                 destination_type=self.destination_type,
                 params=self.params,
-                guid=self.guid,
+                guid=self._guid,
                 agent_attributes=self.agent_attributes,
-                user_attributes=self.user_attributes)
+                user_attributes=self._node_user_attributes())
 
 
 def MessageTraceWrapper(wrapped, library, operation, destination_type,
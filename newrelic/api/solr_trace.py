@@ -20,6 +20,8 @@ import newrelic.api.object_wrapper
 
 class SolrTrace(newrelic.api.time_trace.TimeTrace):
 
+    __slots__ = ('library', 'command')
+
     def __init__(self, library, command, **kwargs):
         parent = None
         if kwargs:
@@ -42,14 +44,14 @@ class SolrTrace(newrelic.api.time_trace.TimeTrace):
         return newrelic.core.solr_node.SolrNode(
                 library=self.library,
                 command=self.command,
-                children=self.children,
+                children=self._node_children(),
                 start_time=self.start_time,
                 end_time=self.end_time,
                 duration=self.duration,
                 exclusive=self.exclusive,
-                guid=self.guid,
+                guid=self._guid,
                 agent_attributes=self.agent_attributes,
-                user_attributes=self.user_attributes,)
+                user_attributes=self._node_user_attributes(),)
 
 
 class SolrTraceWrapper(object):
@@ -13,11 +13,11 @@
 # limitations under the License.
 
 import logging
-import random
 import time
 import sys
 import newrelic.packages.six as six
 import traceback
+from newrelic.common.encoding_utils import generate_guid
 from newrelic.core.trace_cache import trace_cache
 from newrelic.core.attribute import (
         process_user_attribute, MAX_NUM_USER_ATTRIBUTES)
@@ -25,14 +25,34 @@ from newrelic.api.settings import STRIP_EXCEPTION_MESSAGE
 
 _logger = logging.getLogger(__name__)
 
+_NO_USER_ATTRIBUTES = {}
+
+_INFINITY = float('inf')
+
 
 class TimeTrace(object):
 
+    # A trace is created for every segment of a transaction, so the
+    # attributes are held in slots rather than an instance dictionary.
+    # Subclasses declare slots for any attributes of their own. The
+    # children list and attribute dictionaries are likewise only
+    # created when first needed, as most traces are leaf nodes without
+    # any attributes. Similarly the guid is only generated when first
+    # requested, as most segments are never reported as span events.
+
+    __slots__ = ('parent', 'root', 'child_count', '_children', 'start_time',
+            'end_time', 'duration', 'exclusive', 'thread_id', 'activated',
+            'exited', 'is_async', 'has_async_children',
+            'min_child_start_time', 'exc_data',
+            'should_record_segment_params', 'folded', '_guid',
+            '_agent_attributes', '_user_attributes', '_greenlet', '_task',
+            '__weakref__')
+
     def __init__(self, parent=None):
         self.parent = parent
         self.root = None
         self.child_count = 0
-        self.children = []
+        self._children = None
         self.start_time = 0.0
         self.end_time = 0.0
         self.duration = 0.0
@@ -42,13 +62,56 @@ class TimeTrace(object):
         self.exited = False
         self.is_async = False
         self.has_async_children = False
-        self.min_child_start_time = float('inf')
+        self.min_child_start_time = _INFINITY
         self.exc_data = (None, None, None)
         self.should_record_segment_params = False
+        self.folded = False
+        self._guid = None
+        self._agent_attributes = None
+        self._user_attributes = None
+
+    @property
+    def guid(self):
         # 16-digit random hex. Padded with zeros in the front.
-        self.guid = '%016x' % random.getrandbits(64)
-        self.agent_attributes = {}
-        self.user_attributes = {}
+        guid = self._guid
+        if guid is None:
+            guid = self._guid = generate_guid()
+        return guid
+
+    @guid.setter
+    def guid(self, value):
+        self._guid = value
+
+    @property
+    def children(self):
+        children = self._children
+        if children is None:
+            children = self._children = []
+        return children
+
+    @property
+    def agent_attributes(self):
+        agent_attributes = self._agent_attributes
+        if agent_attributes is None:
+            agent_attributes = self._agent_attributes = {}
+        return agent_attributes
+
+    @property
+    def user_attributes(self):
+        user_attributes = self._user_attributes
+        if user_attributes is None:
+            user_attributes = self._user_attributes = {}
+        return user_attributes
+
+    def _node_children(self):
+        # Nodes only iterate over their children, so an empty tuple can
+        # stand in for a trace which never had any.
+        return self._children or ()
+
+    def _node_user_attributes(self):
+        # Nodes never modify their user attributes, so a shared empty
+        # dictionary can stand in for a trace which never had any.
+        return self._user_attributes or _NO_USER_ATTRIBUTES
 
     @property
     def transaction(self):
@@ -60,7 +123,7 @@ class TimeTrace(object):
         return transaction and transaction.settings
 
     def _is_leaf(self):
-        return self.child_count == len(self.children)
+        return self.child_count == len(self._children or ())
 
     def __enter__(self):
         self.parent = parent = self.parent or current_trace()
@@ -88,6 +151,17 @@ class TimeTrace(object):
 
         parent.increment_child_count()
 
+        # Once the segment budget of the transaction has been used up,
+        # further segments are folded into aggregated metrics when they
+        # complete, rather than being kept in the transaction trace until
+        # the transaction completes. This keeps memory use constant for
+        # transactions which perform an unbounded number of operations.
+
+        transaction._segment_count += 1
+        budget = transaction._segment_budget
+        if budget and transaction._segment_count > budget:
+            self.folded = True
+
         self.root = parent.root
         self.should_record_segment_params = (
                 transaction.should_record_segment_params)
@@ -299,7 +373,7 @@ class TimeTrace(object):
 
         # Record a supportability metric if error attributes are being
         # overiden.
-        if 'error.class' in self.agent_attributes:
+        if self._agent_attributes and 'error.class' in self._agent_attributes:
             transaction._record_supportability(
                     'Supportability/'
                     'SpanEvent/Errors/Dropped')
@@ -344,7 +418,7 @@ class TimeTrace(object):
         self.agent_attributes[key] = value
 
     def has_outstanding_children(self):
-        return len(self.children) != self.child_count
+        return len(self._children or ()) != self.child_count
 
     def _ready_to_complete(self):
         # we shouldn't continue if we're still running
@@ -395,7 +469,8 @@ class TimeTrace(object):
 
         # Observe errors on the span only if record_exception hasn't been
         # called already
-        if exc_data[0] and 'error.class' not in self.agent_attributes:
+        if exc_data[0] and not (self._agent_attributes and
+                'error.class' in self._agent_attributes):
             self._observe_exception(exc_data)
 
         # Wipe out root reference as well
@@ -419,7 +494,20 @@ class TimeTrace(object):
 
         if node:
             transaction._process_node(node)
-            parent.process_child(node, self.is_async)
+
+            # A node identical to the node of the preceding sibling is
+            # merged into that node instead of being kept. Only its time
+            # metrics are kept, as for a segment over the budget.
+
+            folded = self.folded
+            if folded:
+                transaction._fold_node(node)
+            elif (transaction._aggregate_segments and not self.is_async and
+                    parent.aggregate_child(node)):
+                transaction._fold_node(node, aggregated=True)
+                folded = True
+
+            parent.process_child(node, self.is_async, folded)
 
         # ----------------------------------------------------------------------
         # SYNC  | The parent will not have exited yet, so no node will be
@@ -470,8 +558,37 @@ class TimeTrace(object):
             self.parent.update_async_exclusive_time(min_child_start_time,
                     exclusive_duration_remaining)
 
-    def process_child(self, node, is_async):
-        self.children.append(node)
+    def aggregate_child(self, node):
+        """Merges the node into the node of the last child to complete,
+        if the two are for identical segments. Returns whether the node
+        was merged.
+
+        """
+
+        children = self._children
+        if not children:
+            return False
+
+        last = children[-1]
+        aggregate = getattr(last, 'aggregate', None)
+        if aggregate is None or not last.can_aggregate(node):
+            return False
+
+        aggregate(node)
+        return True
+
+    def process_child(self, node, is_async, folded=False):
+        # A folded child is not kept, so is no longer counted as a child
+        # once complete. Its time is still deducted from our own.
+
+        if folded:
+            self.child_count -= 1
+        else:
+            children = self._children
+            if children is None:
+                children = self._children = []
+            children.append(node)
+
         if is_async:
 
             # record the lowest start time
@@ -479,7 +596,7 @@ class TimeTrace(object):
                     node.start_time)
 
             # if there are no children running, finalize exclusive time
-            if self.child_count == len(self.children):
+            if self.child_count == len(self._children or ()):
 
                 exclusive_duration = node.end_time - self.min_child_start_time
 
@@ -487,7 +604,7 @@ class TimeTrace(object):
                         exclusive_duration)
 
                 # reset time range tracking
-                self.min_child_start_time = float('inf')
+                self.min_child_start_time = _INFINITY
         else:
             self.exclusive -= node.duration
 
@@ -496,7 +613,7 @@ class TimeTrace(object):
 
         # if there's more than 1 child node outstanding
         # then the children are async w.r.t each other
-        if (self.child_count - len(self.children)) > 1:
+        if (self.child_count - len(self._children or ())) > 1:
             self.has_async_children = True
         # else, the current trace that's being scheduled is not going to be
         # async. note that this implies that all previous traces have
@@ -32,7 +32,8 @@ import newrelic.core.root_node
 import newrelic.core.database_node
 import newrelic.core.error_node
 
-from newrelic.core.stats_engine import CustomMetrics, SampledDataSet
+from newrelic.core.stats_engine import (CustomMetrics, SampledDataSet,
+        TimeStats)
 from newrelic.core.trace_cache import (trace_cache,
         TraceCacheNoActiveTraceError,
         TraceCacheActiveTraceError)
@@ -67,11 +68,30 @@ PARENT_TYPE = {
     '1': 'Browser',
     '2': 'Mobile',
 }
+FOLDED_SEGMENT_SCOPE = object()
+
+
+class FoldedSegmentRoot(object):
+
+    # Stands in for both the transaction node and the stats engine when
+    # generating the time metrics for a folded segment. The transaction
+    # may yet be renamed, so scoped metrics are recorded against a
+    # placeholder scope which is replaced when the transaction completes.
+
+    path = FOLDED_SEGMENT_SCOPE
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.type = None
 
 
 class Sentinel(TimeTrace):
+
+    __slots__ = ('_transaction',)
+
     def __init__(self, transaction):
         super(Sentinel, self).__init__(None)
+        self._transaction = None
         self.transaction = transaction
 
         # Set the thread id to the same as the transaction
@@ -185,6 +205,16 @@ class Transaction(object):
 
         self._trace_node_count = 0
 
+        self._segment_count = 0
+        self._segment_budget = 0
+        self._folded_segment_count = 0
+        self._aggregated_segment_count = 0
+        self._aggregate_segments = False
+        self._lightweight_unsampled = False
+        self._lightweight_segment_count = 0
+        self._folded_segment_root = None
+        self._folded_metrics = None
+
         self._errors = []
         self._slow_sql = []
         self._custom_events = SampledDataSet(capacity=DEFAULT_RESERVOIR_SIZE)
@@ -302,6 +332,13 @@ class Transaction(object):
 
                 if self._settings:
                     self.enabled = True
+                    self._segment_budget = (self._settings.agent_limits.
+                            max_transaction_segments)
+                    self._aggregate_segments = (self._settings.
+                            transaction_segments.aggregate_repeated)
+                    self._lightweight_unsampled = (self._settings.
+                            transaction_segments.lightweight_unsampled and
+                            not self._settings.infinite_tracing.enabled)
 
     def __del__(self):
         self._dead = True
@@ -473,9 +510,25 @@ class Transaction(object):
 
         exclusive = duration + root.exclusive
 
+        if self._settings.distributed_tracing.enabled:
+            # Sampled and priority need to be computed at the end of the
+            # transaction when distributed tracing or span events are enabled.
+            self._compute_sampled_and_priority()
+
+        # For an unsampled transaction which will not record a transaction
+        # trace, the nodes of the segments are folded into the aggregated
+        # time metrics for the transaction rather than being kept.
+
+        children = tuple(root.children)
+
+        if self._lightweight_unsampled and self._can_fold_unsampled(duration):
+            for child in children:
+                self._fold_node(child, unsampled=True)
+            children = ()
+
         root_node = newrelic.core.root_node.RootNode(
                 name=self.name_for_metric,
-                children=tuple(root.children),
+                children=children,
                 start_time=self.start_time,
                 end_time=self.end_time,
                 exclusive=exclusive,
@@ -486,6 +539,7 @@ class Transaction(object):
                 path=self.path,
                 trusted_parent_span=self.trusted_parent_span,
                 tracing_vendors=self.tracing_vendors,
+                folded_segment_count=self._folded_segment_count,
         )
 
         # Add transaction exclusive time to total exclusive time
@@ -502,16 +556,43 @@ class Transaction(object):
         for key, value in six.iteritems(self._transaction_metrics):
             self.record_custom_metric(key, {'count': value})
 
+        # Resolve the scope of the time metrics for any folded segments
+        # now that the name of the transaction is final.
+
+        folded_metrics = ()
+
+        if self._folded_metrics:
+            path = self.path
+            folded_metrics = tuple(
+                    ((name, path if scope is FOLDED_SEGMENT_SCOPE else scope),
+                    stats) for (name, scope), stats in
+                    six.iteritems(self._folded_metrics))
+
+            if self._folded_segment_count:
+                self.record_custom_metric(
+                        'Supportability/Python/Transaction/FoldedSegments',
+                        {'count': self._folded_segment_count})
+
+            if self._lightweight_segment_count:
+                self.record_custom_metric(
+                        'Supportability/Python/Transaction/'
+                        'LightweightSegments',
+                        {'count': self._lightweight_segment_count})
+
+            if self._aggregated_segment_count:
+                self.record_custom_metric(
+                        'Supportability/Python/Transaction/'
+                        'AggregatedSegments',
+                        {'count': self._aggregated_segment_count})
+
+            self._folded_metrics = None
+            self._folded_segment_root = None
+
         if self._frameworks:
             for framework, version in self._frameworks:
                 self.record_custom_metric('Python/Framework/%s/%s' %
                     (framework, version), 1)
 
-        if self._settings.distributed_tracing.enabled:
-            # Sampled and priority need to be computed at the end of the
-            # transaction when distributed tracing or span events are enabled.
-            self._compute_sampled_and_priority()
-
         self._cached_path._name = self.path
         agent_attributes = self.agent_attributes
         agent_attributes.extend(self.filter_request_parameters(request_params))
@@ -538,6 +619,7 @@ class Transaction(object):
                 apdex_t=self.apdex,
                 suppress_apdex=self.suppress_apdex,
                 custom_metrics=self._custom_metrics,
+                folded_metrics=folded_metrics,
                 guid=self.guid,
                 cpu_time=self._cpu_user_time_value,
                 suppress_transaction_trace=self.suppress_transaction_trace,
@@ -1583,6 +1665,74 @@ class Transaction(object):
                 return
             self._slow_sql.append(node)
 
+    def _can_fold_unsampled(self, duration):
+        # Returns whether the nodes of the segments of the completed
+        # transaction are not needed, because it will neither record a
+        # transaction trace nor be sampled for span events. Only the time
+        # metrics of such nodes need be kept. This can only be known once
+        # the transaction completes, when its name and duration are final
+        # and sampling has been decided. Synthetics transactions and those
+        # for which a trace was requested always record a trace.
+
+        if self.synthetics_resource_id or self.record_tt:
+            return False
+
+        settings = self._settings
+
+        if (settings.distributed_tracing.enabled and
+                settings.span_events.enabled and
+                settings.collect_span_events and self._sampled):
+            return False
+
+        transaction_tracer = settings.transaction_tracer
+
+        if (self.suppress_transaction_trace or
+                not transaction_tracer.enabled or
+                not settings.collect_traces):
+            return True
+
+        threshold = transaction_tracer.transaction_threshold
+
+        if threshold is None:
+            threshold = self.apdex * 4
+
+        return duration < threshold
+
+    def _fold_node(self, node, aggregated=False, unsampled=False):
+        # Merge the time metrics for the node of a segment over the
+        # segment budget, which was aggregated with an identical preceding
+        # segment, or which is not needed as the transaction is unsampled,
+        # into the aggregated time metrics for the transaction, instead of
+        # keeping the node.
+
+        if aggregated:
+            self._aggregated_segment_count += 1
+        elif unsampled:
+            # The node of an unsampled transaction is folded along with
+            # all of its descendants.
+
+            nodes = [node]
+            while nodes:
+                self._lightweight_segment_count += 1
+                nodes.extend(nodes.pop().children)
+        else:
+            self._folded_segment_count += 1
+
+        folded_metrics = self._folded_metrics
+        if folded_metrics is None:
+            folded_metrics = self._folded_metrics = {}
+            self._folded_segment_root = FoldedSegmentRoot(self._settings)
+
+        root = self._folded_segment_root
+        root.type = self.type
+
+        for metric in node.time_metrics(root, root, None):
+            key = (metric.name, metric.scope)
+            stats = folded_metrics.get(key)
+            if stats is None:
+                stats = folded_metrics[key] = TimeStats()
+            stats.merge_time_metric(metric)
+
     def stop_recording(self):
         if not self.enabled:
             return
@@ -16,6 +16,7 @@ from __future__ import print_function
 
 import os
 import sys
+import threading
 import time
 import zlib
 from pprint import pprint
@@ -92,6 +93,8 @@ class BaseClient(object):
         compression_method="gzip",
         max_payload_size_in_bytes=1000000,
         audit_log_fp=None,
+        max_connections=1,
+        compression_time_budget=None,
     ):
         self._audit_log_fp = audit_log_fp
 
@@ -108,14 +111,42 @@ class BaseClient(object):
         pass
 
     @staticmethod
-    def _supportability_request(params, payload, body, compression_time):
+    def _payload_bytes(payload):
+        # The payload may be supplied as an iterable over chunks of the
+        # encoded payload rather than as a single byte string, in which
+        # case the chunks are joined together.
+
+        if payload is None or isinstance(payload, bytes):
+            return payload
+
+        return b"".join(payload)
+
+    @staticmethod
+    def _supportability_request(
+        params, payload, body, compression_time, payload_length=None
+    ):
+        pass
+
+    @staticmethod
+    def _supportability_compression(params, payload_length, body):
         pass
 
     @classmethod
     def log_request(
-        cls, fp, method, url, params, payload, headers, body=None, compression_time=None
+        cls,
+        fp,
+        method,
+        url,
+        params,
+        payload,
+        headers,
+        body=None,
+        compression_time=None,
+        payload_length=None,
     ):
-        cls._supportability_request(params, payload, body, compression_time)
+        cls._supportability_request(
+            params, payload, body, compression_time, payload_length
+        )
 
         if not fp:
             return
@@ -223,6 +254,11 @@ class HttpClient(BaseClient):
         keep_alive=True, accept_encoding=True, user_agent=USER_AGENT
     )
 
+    # Compression levels tried in turn, from best compression to fastest,
+    # when the level is chosen adaptively to keep within the time budget.
+
+    ADAPTIVE_COMPRESSION_LEVELS = (6, 3, 1)
+
     def __init__(
         self,
         host,
@@ -240,12 +276,18 @@ class HttpClient(BaseClient):
         compression_method="gzip",
         max_payload_size_in_bytes=1000000,
         audit_log_fp=None,
+        max_connections=1,
+        compression_time_budget=None,
     ):
         self._host = host
         port = self._port = port
         self._compression_threshold = compression_threshold
         self._compression_level = compression_level
         self._compression_method = compression_method
+        self._compression_time_budget = compression_time_budget
+        self._compression_throughput = {}
+        self._compression_lock = threading.Lock()
+        self._payload_lengths = {}
         self._max_payload_size_in_bytes = max_payload_size_in_bytes
         self._audit_log_fp = audit_log_fp
 
@@ -255,6 +297,12 @@ class HttpClient(BaseClient):
         self._connection_kwargs = connection_kwargs = {
             "timeout": timeout,
         }
+
+        # Harvest requests may be sent concurrently from several threads,
+        # in which case the connection pool is sized to hold a connection
+        # for each of them so they can be reused across harvests.
+        if max_connections and max_connections > 1:
+            connection_kwargs["maxsize"] = max_connections
         self._urlopen_kwargs = urlopen_kwargs = {}
 
         if self.CONNECTION_CLS.scheme == "https":
@@ -301,6 +349,7 @@ class HttpClient(BaseClient):
         self._proxy = proxy
 
         self._connection_attr = None
+        self._connection_lock = threading.Lock()
 
     @staticmethod
     def _parse_proxy(scheme, host, port, username, password):
@@ -343,17 +392,23 @@ class HttpClient(BaseClient):
         if self._connection_attr:
             return self._connection_attr
 
+        with self._connection_lock:
+            if not self._connection_attr:
+                self._connection_attr = self._create_connection()
+
+        return self._connection_attr
+
+    def _create_connection(self):
         retries = urllib3.Retry(
             total=False, connect=None, read=None, redirect=0, status=None
         )
-        self._connection_attr = self.CONNECTION_CLS(
+        return self.CONNECTION_CLS(
             self._host,
             self._port,
             strict=True,
             retries=retries,
             **self._connection_kwargs
         )
-        return self._connection_attr
 
     def close_connection(self):
         if self._connection_attr:
@@ -370,12 +425,21 @@ class HttpClient(BaseClient):
         headers,
         body=None,
         compression_time=None,
+        payload_length=None,
     ):
         if not self._prefix:
             url = self.CONNECTION_CLS.scheme + "://" + self._host + url
 
         return super(HttpClient, self).log_request(
-            fp, method, url, params, payload, headers, body, compression_time
+            fp,
+            method,
+            url,
+            params,
+            payload,
+            headers,
+            body,
+            compression_time,
+            payload_length,
         )
 
     @staticmethod
@@ -392,6 +456,100 @@ class HttpClient(BaseClient):
 
         return data, compression_time
 
+    @staticmethod
+    def _compress_chunks(chunks, threshold, method="gzip", level=None):
+        """Joins the chunks of a payload, compressing them as they are
+        consumed once the total size exceeds the threshold. This avoids
+        ever holding the complete uncompressed payload in memory when
+        it is large. Returns the body, the time spent compressing (or
+        None if not compressed) and the size of the uncompressed
+        payload.
+
+        """
+
+        level = level or zlib.Z_DEFAULT_COMPRESSION
+        wbits = 31 if method == "gzip" else 15
+
+        buffered = []
+        output = []
+        length = 0
+        compressor = None
+        compression_time = 0.0
+
+        for chunk in chunks:
+            length += len(chunk)
+
+            if compressor is None:
+                buffered.append(chunk)
+
+                if length <= threshold:
+                    continue
+
+                compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+                pending, buffered = buffered, None
+            else:
+                pending = (chunk,)
+
+            compression_start = time.time()
+
+            for data in pending:
+                data = compressor.compress(data)
+                if data:
+                    output.append(data)
+
+            compression_time += max(time.time(), compression_start) - compression_start
+
+        if compressor is None:
+            return b"".join(buffered), None, length
+
+        compression_start = time.time()
+        output.append(compressor.flush())
+        compression_time += max(time.time(), compression_start) - compression_start
+
+        return b"".join(output), compression_time, length
+
+    def _select_compression_level(self, payload_length):
+        """Returns the compression level to use for a payload of the given
+        size. When a level has been configured it is always used. Otherwise
+        the best level which is expected to compress the payload within the
+        time budget is chosen, based on the throughput measured for each
+        level on previous payloads. A level for which there is no
+        measurement yet is assumed to be within the budget, so that it can
+        be measured.
+
+        """
+
+        if self._compression_level is not None or not self._compression_time_budget:
+            return self._compression_level
+
+        budget = self._compression_time_budget
+
+        with self._compression_lock:
+            for level in self.ADAPTIVE_COMPRESSION_LEVELS:
+                throughput = self._compression_throughput.get(level)
+                if throughput is None or payload_length <= throughput * budget:
+                    return level
+
+        return level
+
+    def _record_compression(self, level, payload_length, compression_time):
+        # Updates the moving average of the throughput measured for the
+        # level. Requests may be sent from several harvest threads at once,
+        # so the measurements are updated while holding the lock.
+
+        if level is None or not compression_time:
+            return
+
+        throughput = payload_length / compression_time
+
+        with self._compression_lock:
+            previous = self._compression_throughput.get(level)
+
+            if previous is not None:
+                throughput = (previous + throughput) / 2.0
+
+            self._compression_throughput[level] = throughput
+
     def send_request(
         self,
         method="POST",
@@ -410,15 +568,54 @@ class HttpClient(BaseClient):
         if headers:
             merged_headers.update(headers)
         path = self._prefix + path
+
+        # When auditing, the complete payload is required in order to log
+        # it, so any payload supplied as chunks is joined up front.
+
+        if self._audit_log_fp:
+            payload = self._payload_bytes(payload)
+
         body = payload
         compression_time = None
-        if payload is not None:
+        payload_length = None
+        agent_method = params and params.get("method")
+        if payload is not None and not isinstance(payload, bytes):
+            # The size of a payload supplied as chunks is only known once
+            # it has been consumed, so the level is chosen based on the
+            # size of the last payload sent to the same endpoint, as these
+            # tend to be similar from one harvest to the next.
+
+            level = self._select_compression_level(
+                self._payload_lengths.get(agent_method, 0)
+            )
+            body, compression_time, payload_length = self._compress_chunks(
+                payload,
+                self._compression_threshold,
+                method=self._compression_method,
+                level=level,
+            )
+            payload = None
+            self._payload_lengths[agent_method] = payload_length
+
+            if compression_time is not None:
+                self._record_compression(level, payload_length, compression_time)
+                if level is not None and self._compression_level is None:
+                    self._supportability_compression(params, payload_length, body)
+                content_encoding = self._compression_method
+            else:
+                content_encoding = "Identity"
+
+            merged_headers["Content-Encoding"] = content_encoding
+
+        elif payload is not None:
             if len(payload) > self._compression_threshold:
+                level = self._select_compression_level(len(payload))
                 body, compression_time = self._compress(
-                    payload,
-                    method=self._compression_method,
-                    level=self._compression_level,
+                    payload, method=self._compression_method, level=level,
                 )
+                self._record_compression(level, len(payload), compression_time)
+                if level is not None and self._compression_level is None:
+                    self._supportability_compression(params, len(payload), body)
                 content_encoding = self._compression_method
             else:
                 content_encoding = "Identity"
@@ -434,6 +631,7 @@ class HttpClient(BaseClient):
             merged_headers,
             body,
             compression_time,
+            payload_length,
         )
 
         if body and len(body) > self._max_payload_size_in_bytes:
@@ -489,6 +687,8 @@ class InsecureHttpClient(HttpClient):
         compression_method="gzip",
         max_payload_size_in_bytes=1000000,
         audit_log_fp=None,
+        max_connections=1,
+        compression_time_budget=None,
     ):
         proxy = self._parse_proxy(proxy_scheme, proxy_host, None, None, None)
         if proxy and proxy.scheme == "https":
@@ -515,12 +715,16 @@ class InsecureHttpClient(HttpClient):
             compression_method,
             max_payload_size_in_bytes,
             audit_log_fp,
+            max_connections,
+            compression_time_budget,
         )
 
 
 class SupportabilityMixin(object):
     @staticmethod
-    def _supportability_request(params, payload, body, compression_time):
+    def _supportability_request(
+        params, payload, body, compression_time, payload_length=None
+    ):
         # *********
         # Used only for supportability metrics. Do not use to drive business
         # logic!
@@ -530,9 +734,12 @@ class SupportabilityMixin(object):
         if agent_method and body:
             # Compression was applied
             if compression_time is not None:
+                if payload_length is None:
+                    payload_length = len(payload)
+
                 internal_metric(
                     "Supportability/Python/Collector/ZLIB/Bytes/%s" % agent_method,
-                    len(payload),
+                    payload_length,
                 )
                 internal_metric(
                     "Supportability/Python/Collector/ZLIB/Compress/%s" % agent_method,
@@ -544,6 +751,20 @@ class SupportabilityMixin(object):
                 len(body),
             )
 
+    @staticmethod
+    def _supportability_compression(params, payload_length, body):
+        # Records the ratio achieved for a payload compressed at a level
+        # chosen adaptively, so that the effect of the time budget on the
+        # size of payloads can be seen.
+
+        agent_method = params and params.get("method")
+
+        if agent_method and body:
+            internal_metric(
+                "Supportability/Python/Collector/ZLIB/Ratio/%s" % agent_method,
+                float(payload_length) / len(body),
+            )
+
     @staticmethod
     def _supportability_response(status, exc, connection="direct"):
         if exc or not 200 <= status < 300:
@@ -620,6 +841,8 @@ class DeveloperModeClient(SupportabilityMixin, BaseClient):
         headers=None,
         payload=None,
     ):
+        payload = self._payload_bytes(payload)
+
         request_id = self.log_request(
             self._audit_log_fp,
             "POST",
@@ -657,6 +880,8 @@ class ServerlessModeClient(DeveloperModeClient):
         headers=None,
         payload=None,
     ):
+        payload = self._payload_bytes(payload)
+
         result = super(ServerlessModeClient, self).send_request(
             method=method, path=path, params=params, headers=headers, payload=payload
         )
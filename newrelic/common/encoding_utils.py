@@ -18,17 +18,20 @@ of data.
 """
 
 import base64
+import binascii
 import gzip
 import hashlib
 import io
 import itertools
 import json
+import os
 import random
 import re
 import types
 import zlib
 from collections import OrderedDict
 
+from newrelic.common.overlay_dict import OverlayDict
 from newrelic.packages import six
 
 HEXDIGLC_RE = re.compile('^[0-9a-f]+$')
@@ -48,7 +51,7 @@ BASE64_DECODE_STR = getattr(base64, 'decodestring', None)
 # be supplied as key word arguments to allow the wrappers to supply
 # defaults.
 
-def json_encode(obj, **kwargs):
+def _json_encode_kwargs(**kwargs):
     _kwargs = {}
 
     # This wrapper function needs to deal with a few issues.
@@ -73,8 +76,9 @@ def json_encode(obj, **kwargs):
     #
     # The second issue we want to deal with is allowing generators or
     # iterables to be supplied and for them to be automatically expanded
-    # and treated as lists. This also entails overriding the fallback
-    # encoder.
+    # and treated as lists, and overlay dictionaries, such as used for
+    # the intrinsics of span events, to be expanded into dictionaries.
+    # This also entails overriding the fallback encoder.
     #
     # The third is eliminate white space after separators to trim the
     # size of the data being sent.
@@ -87,6 +91,8 @@ def json_encode(obj, **kwargs):
             return o.decode('latin-1')
         elif isinstance(o, types.GeneratorType):
             return list(o)
+        elif isinstance(o, OverlayDict):
+            return o.expand()
         elif hasattr(o, '__iter__'):
             return list(iter(o))
         raise TypeError(repr(o) + ' is not JSON serializable')
@@ -102,7 +108,47 @@ def json_encode(obj, **kwargs):
 
     _kwargs.update(kwargs)
 
-    return json.dumps(obj, **_kwargs)
+    return _kwargs
+
+
+def json_encode(obj, **kwargs):
+    return json.dumps(obj, **_json_encode_kwargs(**kwargs))
+
+
+def json_encode_chunks(obj, depth=2, **kwargs):
+    """Encodes the object as JSON, returning an iterator over the
+    encoded string in chunks rather than the complete string. Lists,
+    tuples and generators nested up to the given depth are streamed
+    item by item, with each item below that depth being encoded in one
+    go. Joining the chunks yields the same result as json_encode().
+
+    """
+
+    # The iterencode() method of the JSON encoder can only make use of
+    # the C accelerated encoder when encoding the complete object in
+    # one go. We therefore only break apart the outer containers, which
+    # for the data collector payloads will be the list of events or
+    # samples, and encode each of the items within with the C encoder.
+
+    encode = json.JSONEncoder(**_json_encode_kwargs(**kwargs)).encode
+
+    def _iterencode(o, level):
+        if level < depth and isinstance(o, (list, tuple,
+                types.GeneratorType)):
+            yield '['
+            first = True
+            for item in o:
+                if first:
+                    first = False
+                else:
+                    yield ','
+                for chunk in _iterencode(item, level + 1):
+                    yield chunk
+            yield ']'
+        else:
+            yield encode(o)
+
+    return _iterencode(obj, 0)
 
 
 def json_decode(s, **kwargs):
@@ -269,6 +315,60 @@ def generate_path_hash(name, seed):
     return '%08x' % path_hash
 
 
+# Span GUIDs are taken from a pool which is refilled from os.urandom() once
+# every _GUID_POOL_SIZE GUIDs, rather than calling into the random number
+# generator and formatting a string for every GUID. Popping from and
+# extending a list are atomic operations, so threads can share the pool
+# without a lock. A child process must not hand out the same GUIDs as its
+# parent, so the pool is emptied on fork. Where fork hooks are not available
+# the process ID is instead checked each time a GUID is generated.
+
+_GUID_POOL_SIZE = 256
+
+_guid_pool = []
+_guid_pool_pop = _guid_pool.pop
+_guid_pool_pid = [os.getpid()]
+_guid_pool_check_pid = not hasattr(os, 'register_at_fork')
+
+
+def _refill_guid_pool():
+    digits = binascii.hexlify(os.urandom(8 * _GUID_POOL_SIZE))
+
+    if not isinstance(digits, str):
+        digits = digits.decode('Latin-1')
+
+    _guid_pool.extend([digits[offset:offset + 16]
+            for offset in range(0, len(digits), 16)])
+
+
+def _discard_guid_pool():
+    del _guid_pool[:]
+
+
+if not _guid_pool_check_pid:
+    os.register_at_fork(after_in_child=_discard_guid_pool)
+
+
+def generate_guid():
+    """Returns a random 64 bit identifier formatted as 16 lower case hex
+    digits, as used for span and trace identifiers.
+
+    """
+
+    if _guid_pool_check_pid and _guid_pool_pid[0] != os.getpid():
+        _guid_pool_pid[0] = os.getpid()
+        _discard_guid_pool()
+
+    # Other threads may empty the pool again between it being refilled
+    # and this thread taking a GUID from it, so retry until successful.
+
+    while True:
+        try:
+            return _guid_pool_pop()
+        except IndexError:
+            _refill_guid_pool()
+
+
 def base64_encode(text):
     """Base 64 encodes the UTF-8 encoded representation of the text. In Python
     2 either a byte string or Unicode string can be provided for the text
@@ -442,7 +542,7 @@ class W3CTraceParent(dict):
         if 'id' in self:
             guid = self['id']
         else:
-            guid = '{:016x}'.format(random.getrandbits(64))
+            guid = generate_guid()
 
         return '00-{}-{}-{:02x}'.format(
             self['tr'].lower().zfill(32),
@@ -0,0 +1,91 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module implements a thread safe, size bounded cache which evicts
+the least recently used entry when full. It is used to memoize the results
+of computations performed repeatedly on the same inputs, such as parsing
+the SQL statements issued by an application.
+
+"""
+
+import threading
+
+from collections import OrderedDict
+
+
+class LRUCache(object):
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        # Popping and reinserting the entry moves it to the end of
+        # the ordered dictionary, marking it as most recently used.
+        # This works on all Python versions, unlike move_to_end().
+
+        with self._lock:
+            value = self._data.pop(key, self)
+
+            if value is self:
+                self.misses += 1
+                return default
+
+            self._data[key] = value
+            self.hits += 1
+
+            return value
+
+    def put(self, key, value):
+        maxsize = self.maxsize
+
+        if maxsize is not None and maxsize <= 0:
+            return
+
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+
+            if maxsize is not None:
+                while len(self._data) > maxsize:
+                    self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def reset_counts(self):
+        """Returns the number of hits and misses since the counts were
+        last reset, and resets them.
+
+        """
+
+        with self._lock:
+            counts = (self.hits, self.misses)
+            self.hits = 0
+            self.misses = 0
+
+        return counts
@@ -0,0 +1,86 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module implements a mapping which overlays a dictionary of its own
+values on a base dictionary shared with other mappings. It is used where
+many small dictionaries would otherwise each hold a copy of the same
+values, such as the intrinsics common to all the span events of a
+transaction.
+
+"""
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
+
+class OverlayDict(MutableMapping):
+
+    # Lookups check the values of the overlay before those of the base.
+    # Values are only ever set in the overlay, so the base is never
+    # modified and can be shared. Deleting a key from the base is the one
+    # case where the base cannot be left as is, so the overlay then takes
+    # a copy of the base and stops sharing it.
+
+    __slots__ = ('_base', '_data')
+
+    def __init__(self, base, data=None):
+        self._base = base
+        self._data = data if data is not None else {}
+
+    def __getitem__(self, key):
+        data = self._data
+        if key in data:
+            return data[key]
+        return self._base[key]
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+
+    def __delitem__(self, key):
+        if key in self._base:
+            self._data = self.expand()
+            self._base = {}
+        del self._data[key]
+
+    def __contains__(self, key):
+        return key in self._data or key in self._base
+
+    def __iter__(self):
+        data = self._data
+        for key in self._base:
+            if key not in data:
+                yield key
+        for key in data:
+            yield key
+
+    def __len__(self):
+        return len(self.expand())
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self.expand())
+
+    def copy(self):
+        return type(self)(self._base, self._data.copy())
+
+    def expand(self):
+        """Returns a new dictionary, of the same type as the base, holding
+        the combined values of the base and the overlay.
+
+        """
+
+        expanded = self._base.copy()
+        expanded.update(self._data)
+        return expanded
@@ -14,21 +14,45 @@
 
 import collections
 import threading
+import time
 
 try:
-    from newrelic.core.infinite_tracing_pb2 import AttributeValue
+    from newrelic.core.infinite_tracing_pb2 import AttributeValue, SpanBatch
 except:
-    AttributeValue = None
+    AttributeValue, SpanBatch = None, None
 
 
 class StreamBuffer(object):
 
-    def __init__(self, maxlen):
+    """Buffer of spans waiting to be sent over the span stream. Spans are
+    appended by the threads recording transactions and consumed by
+    iterating over the buffer from the thread running the gRPC call.
+
+    The condition variable is only used to wake the consumer when it is
+    waiting for spans, so adding a span is normally just a matter of
+    updating the counts and appending it under a plain lock. Removing
+    spans is done under the same lock, which ensures that a span is only
+    counted as dropped when the buffer was actually full.
+
+    When batching is enabled, iterating yields SpanBatch messages holding
+    up to batch_size spans. A batch which isn't full is sent once
+    batch_timeout seconds have passed since its first span was taken.
+
+    """
+
+    def __init__(self, maxlen, batching=False, batch_size=100,
+            batch_timeout=0.1):
         self._queue = collections.deque(maxlen=maxlen)
+        self._lock = threading.Lock()
         self._notify = self.condition()
         self._shutdown = False
         self._seen = 0
         self._dropped = 0
+        self._waiting_for = 0
+
+        self.batching = batching
+        self.batch_size = max(batch_size, 1)
+        self.batch_timeout = batch_timeout
 
     @staticmethod
     def condition(*args, **kwargs):
@@ -40,43 +64,98 @@ class StreamBuffer(object):
             self._notify.notify_all()
 
     def put(self, item):
-        with self._notify:
-            if self._shutdown:
-                return
+        if self._shutdown:
+            return
 
+        queue = self._queue
+
+        with self._lock:
             self._seen += 1
 
-            # NOTE: dropped can be over-counted as the queue approaches
-            # capacity while data is still being transmitted.
-            #
-            # This is because the length of the queue can be changing as it's
-            # being measured.
-            if len(self._queue) >= self._queue.maxlen:
+            if len(queue) >= queue.maxlen:
                 self._dropped += 1
 
-            self._queue.append(item)
-            self._notify.notify_all()
+            queue.append(item)
+
+        # Only wake the consumer if it is waiting and enough spans are
+        # now available. The consumer sets the number of spans it is
+        # waiting for before checking the queue, so a span appended
+        # here can't be missed by it.
+
+        waiting_for = self._waiting_for
+
+        if waiting_for and len(queue) >= waiting_for:
+            with self._notify:
+                self._notify.notify_all()
 
     def stats(self):
-        with self._notify:
+        with self._lock:
             seen, dropped = self._seen, self._dropped
             self._seen, self._dropped = 0, 0
 
         return seen, dropped
 
+    def _take(self, count):
+        queue = self._queue
+
+        with self._lock:
+            count = min(count, len(queue))
+            return [queue.popleft() for _ in range(count)]
+
+    def _wait(self, count, timeout=None):
+        with self._notify:
+            self._waiting_for = count
+            try:
+                if not self._shutdown and len(self._queue) < count:
+                    self._notify.wait(timeout)
+            finally:
+                self._waiting_for = 0
+
+    def _next_batch(self):
+        spans = []
+        deadline = None
+
+        while not self._shutdown:
+            spans.extend(self._take(self.batch_size - len(spans)))
+
+            if len(spans) >= self.batch_size:
+                return SpanBatch(spans=spans)
+
+            if not spans:
+                self._wait(1)
+                continue
+
+            now = time.time()
+
+            if deadline is None:
+                deadline = now + self.batch_timeout
+
+            if now >= deadline:
+                return SpanBatch(spans=spans)
+
+            self._wait(self.batch_size - len(spans), deadline - now)
+
+        # Spans already taken from the queue when shutdown occurs are
+        # still sent, rather than being lost without being counted.
+
+        if spans:
+            return SpanBatch(spans=spans)
+
+        raise StopIteration
+
     def __next__(self):
+        if self.batching:
+            return self._next_batch()
+
         while True:
             if self._shutdown:
                 raise StopIteration
 
-            try:
-                return self._queue.popleft()
-            except IndexError:
-                pass
+            with self._lock:
+                if self._queue:
+                    return self._queue.popleft()
 
-            with self._notify:
-                if not self._shutdown and not self._queue:
-                    self._notify.wait()
+            self._wait(1)
 
     next = __next__
 
@@ -147,6 +147,16 @@ _COMPRESSED_CONTENT_ENCODING = {
     "gzip": newrelic.api.settings.COMPRESSED_CONTENT_ENCODING_GZIP,
 }
 
+_TRANSACTION_RECORDING_OVERFLOW_POLICY = {
+    "drop": "drop",
+    "inline": "inline",
+}
+
+_SQL_OBFUSCATION_ENGINE = {
+    "regex": "regex",
+    "tokenizer": "tokenizer",
+}
+
 
 def _map_log_level(s):
     return _LOG_LEVEL[s.upper()]
@@ -174,6 +184,14 @@ def _map_compressed_content_encoding(s):
     return _COMPRESSED_CONTENT_ENCODING[s]
 
 
+def _map_transaction_recording_overflow_policy(s):
+    return _TRANSACTION_RECORDING_OVERFLOW_POLICY[s]
+
+
+def _map_sql_obfuscation_engine(s):
+    return _SQL_OBFUSCATION_ENGINE[s]
+
+
 def _map_split_strings(s):
     return s.split()
 
@@ -374,6 +392,8 @@ def _process_configuration(section):
                      'get', _map_transaction_threshold)
     _process_setting(section, 'transaction_tracer.record_sql',
                      'get', _map_record_sql)
+    _process_setting(section, 'transaction_tracer.sql_obfuscation_engine',
+                     'get', _map_sql_obfuscation_engine)
     _process_setting(section, 'transaction_tracer.stack_trace_threshold',
                      'getfloat', None)
     _process_setting(section, 'transaction_tracer.explain_enabled',
@@ -466,14 +486,32 @@ def _process_configuration(section):
                      'get', _map_inc_excl_attributes)
     _process_setting(section, 'transaction_segments.attributes.include',
                      'get', _map_inc_excl_attributes)
+    _process_setting(section, 'transaction_segments.aggregate_repeated',
+                     'getboolean', None)
+    _process_setting(section, 'transaction_segments.lightweight_unsampled',
+                     'getboolean', None)
+    _process_setting(section, 'local_daemon.enabled',
+                     'getboolean', None)
     _process_setting(section, 'local_daemon.socket_path',
                      'get', None)
     _process_setting(section, 'local_daemon.synchronous_startup',
                      'getboolean', None)
+    _process_setting(section, 'local_daemon.startup_timeout',
+                     'getfloat', None)
+    _process_setting(section, 'local_daemon.timeout',
+                     'getfloat', None)
     _process_setting(section, 'agent_limits.transaction_traces_nodes',
                      'getint', None)
+    _process_setting(section, 'agent_limits.max_transaction_segments',
+                     'getint', None)
     _process_setting(section, 'agent_limits.sql_query_length_maximum',
                      'getint', None)
+    _process_setting(section, 'agent_limits.sql_statement_cache_size',
+                     'getint', None)
+    _process_setting(section, 'agent_limits.normalization_cache_size',
+                     'getint', None)
+    _process_setting(section, 'agent_limits.attribute_filter_cache_size',
+                     'getint', None)
     _process_setting(section, 'agent_limits.slow_sql_stack_trace',
                      'getint', None)
     _process_setting(section, 'agent_limits.max_sql_connections',
@@ -502,6 +540,12 @@ def _process_configuration(section):
                      'getint', None)
     _process_setting(section, 'agent_limits.data_compression_level',
                      'getint', None)
+    _process_setting(section, 'agent_limits.data_compression_streaming',
+                     'getboolean', None)
+    _process_setting(section, 'agent_limits.data_compression_time_budget',
+                     'getfloat', None)
+    _process_setting(section, 'agent_limits.max_parallel_harvest_requests',
+                     'getint', None)
     _process_setting(section, 'console.listener_socket',
                      'get', _map_console_listener_socket)
     _process_setting(section, 'console.allow_interpreter_cmd',
@@ -608,6 +652,52 @@ def _process_configuration(section):
     _process_setting(section,
                      'infinite_tracing.span_queue_size',
                      'getint', None)
+    _process_setting(section,
+                     'infinite_tracing.batching',
+                     'getboolean', None)
+    _process_setting(section,
+                     'infinite_tracing.batch_size',
+                     'getint', None)
+    _process_setting(section,
+                     'infinite_tracing.batch_timeout',
+                     'getfloat', None)
+    _process_setting(section,
+                     'transaction_recording.background_enabled',
+                     'getboolean', None)
+    _process_setting(section,
+                     'transaction_recording.queue_size',
+                     'getint', None)
+    _process_setting(section,
+                     'transaction_recording.worker_threads',
+                     'getint', None)
+    _process_setting(section,
+                     'transaction_recording.overflow_policy',
+                     'get', _map_transaction_recording_overflow_policy)
+    _process_setting(section,
+                     'transaction_recording.flush_timeout',
+                     'getfloat', None)
+    _process_setting(section,
+                     'transaction_recording.stats_shards',
+                     'getint', None)
+    _process_setting(section,
+                     'transaction_recording.compact_stats_table',
+                     'getboolean', None)
+    _process_setting(section, 'payload_spool.enabled',
+                     'getboolean', None)
+    _process_setting(section, 'payload_spool.directory',
+                     'get', None)
+    _process_setting(section, 'payload_spool.max_size',
+                     'getint', None)
+    _process_setting(section, 'payload_spool.max_age',
+                     'getfloat', None)
+    _process_setting(section, 'payload_spool.segment_size',
+                     'getint', None)
+    _process_setting(section, 'payload_spool.replay_limit',
+                     'getint', None)
+    _process_setting(section, 'harvest_schedule.staggered',
+                     'getboolean', None)
+    _process_setting(section, 'harvest_schedule.jitter',
+                     'getfloat', None)
 
 
 # Loading of configuration from specified file and for specified
@@ -34,6 +34,7 @@ import newrelic.core.application
 import newrelic.packages.six as six
 
 from newrelic.common.log_file import initialize_logging
+from newrelic.core.harvest_schedule import HarvestSchedule, process_offset
 from newrelic.samplers.cpu_usage import cpu_usage_data_source
 from newrelic.samplers.memory_usage import memory_usage_data_source
 from newrelic.samplers.gc_data import garbage_collector_data_source
@@ -217,6 +218,8 @@ class Agent(object):
         self._last_flexible_harvest = 0.0
         self._default_harvest_duration = 0.0
         self._flexible_harvest_duration = 0.0
+        self._default_harvest_schedule = None
+        self._flexible_harvest_schedule = None
         self._scheduler = sched.scheduler(
                 self._harvest_timer,
                 self._harvest_shutdown.wait)
@@ -579,8 +582,10 @@ class Agent(object):
         if not self._harvest_shutdown.isSet():
             event_harvest_config = self.global_settings().event_harvest_config
 
-            self._scheduler.enter(
-                    event_harvest_config.report_period_ms / 1000.0,
+            self._scheduler.enterabs(
+                    self._flexible_harvest_schedule.next_time(
+                        event_harvest_config.report_period_ms / 1000.0,
+                        time.time()),
                     1,
                     self._harvest_flexible,
                     ())
@@ -608,7 +613,12 @@ class Agent(object):
 
     def _harvest_default(self, shutdown=False):
         if not self._harvest_shutdown.isSet():
-            self._scheduler.enter(60.0, 2, self._harvest_default, ())
+            self._scheduler.enterabs(
+                    self._default_harvest_schedule.next_time(
+                        60.0, time.time()),
+                    2,
+                    self._harvest_default,
+                    ())
             _logger.debug('Commencing harvest[default] of application data.')
         elif not shutdown:
             return
@@ -641,14 +651,30 @@ class Agent(object):
 
         settings = newrelic.core.config.global_settings()
         event_harvest_config = settings.event_harvest_config
+        harvest_schedule = settings.harvest_schedule
 
-        self._scheduler.enter(
-                event_harvest_config.report_period_ms / 1000.0,
+        # The offset of the harvests within each period is derived when
+        # the harvest thread is started rather than when the agent is
+        # created, as the agent may have been created in a parent process
+        # prior to it being forked.
+
+        offset = process_offset()
+
+        self._flexible_harvest_schedule = HarvestSchedule(
+                harvest_schedule.staggered, harvest_schedule.jitter, offset)
+        self._default_harvest_schedule = HarvestSchedule(
+                harvest_schedule.staggered, harvest_schedule.jitter, offset)
+
+        now = time.time()
+
+        self._scheduler.enterabs(
+                self._flexible_harvest_schedule.next_time(
+                    event_harvest_config.report_period_ms / 1000.0, now),
                 1,
                 self._harvest_flexible,
                 ())
-        self._scheduler.enter(
-                60.0,
+        self._scheduler.enterabs(
+                self._default_harvest_schedule.next_time(60.0, now),
                 2,
                 self._harvest_default,
                 ())
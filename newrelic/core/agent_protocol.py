@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import copy
 import logging
 import os
 
@@ -22,6 +23,7 @@ from newrelic.core.internal_metrics import internal_count_metric
 from newrelic.common.encoding_utils import (
     json_decode,
     json_encode,
+    json_encode_chunks,
     serverless_payload_encode,
 )
 from newrelic.common.utilization import (
@@ -43,6 +45,7 @@ from newrelic.network.exceptions import (
     ForceAgentDisconnect,
     ForceAgentRestart,
     NetworkInterfaceException,
+    PayloadTooLarge,
     RetryDataForRequest,
 )
 
@@ -52,6 +55,13 @@ _logger = logging.getLogger(__name__)
 class AgentProtocol(object):
     VERSION = 17
 
+    # The configuration for the application returned by the data
+    # collector when it was registered, before being applied to the
+    # local settings. This is passed to processes which report via a
+    # local aggregator so they can construct the same settings.
+
+    server_configuration = None
+
     STATUS_CODE_RESPONSE = {
         400: DiscardDataForRequest,
         401: ForceAgentRestart,
@@ -63,7 +73,7 @@ class AgentProtocol(object):
         409: ForceAgentRestart,
         410: ForceAgentDisconnect,
         411: DiscardDataForRequest,
-        413: DiscardDataForRequest,
+        413: PayloadTooLarge,
         414: DiscardDataForRequest,
         415: DiscardDataForRequest,
         417: DiscardDataForRequest,
@@ -176,6 +186,8 @@ class AgentProtocol(object):
             compression_method=settings.compressed_content_encoding,
             max_payload_size_in_bytes=settings.max_payload_size_in_bytes,
             audit_log_fp=audit_log_fp,
+            max_connections=settings.agent_limits.max_parallel_harvest_requests,
+            compression_time_budget=settings.agent_limits.data_compression_time_budget,
         )
 
         self._params = {
@@ -197,6 +209,9 @@ class AgentProtocol(object):
 
         self._headers["Content-Type"] = "application/json"
         self._run_token = settings.agent_run_id
+        self._streaming_payloads = (
+            settings.agent_limits.data_compression_streaming
+        )
 
         # Logging
         self._proxy_host = settings.proxy_host
@@ -249,7 +264,7 @@ class AgentProtocol(object):
                     "params": {
                         k: v for k, v in params.items() if k in self.PARAMS_ALLOWLIST
                     },
-                    "content": payload,
+                    "content": payload if isinstance(payload, bytes) else None,
                     "agent_run_id": self._run_token,
                 },
             )
@@ -263,7 +278,19 @@ class AgentProtocol(object):
         params["method"] = method
         if self._run_token:
             params["run_id"] = self._run_token
-        return params, self._headers, json_encode(payload).encode("utf-8")
+
+        # When streaming, the payload is passed to the client as an
+        # iterator over the encoded chunks, allowing the client to
+        # compress it without the full JSON string being created.
+
+        if self._streaming_payloads:
+            payload = (
+                chunk.encode("utf-8") for chunk in json_encode_chunks(payload)
+            )
+        else:
+            payload = json_encode(payload).encode("utf-8")
+
+        return params, self._headers, payload
 
     @staticmethod
     def _connect_payload(app_name, linked_applications, environment, settings):
@@ -457,6 +484,8 @@ class AgentProtocol(object):
                 ),
             )
 
+        server_configuration = copy.deepcopy(configuration)
+
         # Apply High Security Mode to server_config, so the local
         # security settings won't get overwritten when we overlay
         # the server settings on top of them.
@@ -480,6 +509,8 @@ class AgentProtocol(object):
                 if logger_func:
                     logger_func("%s", message)
 
+        protocol.server_configuration = server_configuration
+
         return protocol
 
     def finalize(self):
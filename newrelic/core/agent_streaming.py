@@ -17,7 +17,7 @@ import threading
 
 try:
     import grpc
-    from newrelic.core.infinite_tracing_pb2 import Span, RecordStatus
+    from newrelic.core.infinite_tracing_pb2 import Span, SpanBatch, RecordStatus
 except ImportError:
     grpc = None
 
@@ -30,9 +30,13 @@ class StreamingRpc(object):
     This class keeps a stream_stream RPC alive, retrying after a timeout when
     errors are encountered. If grpc.StatusCode.UNIMPLEMENTED is encountered, a
     retry will not occur.
+
+    When the stream buffer batches spans, the SpanBatch messages it yields
+    are sent using the RecordSpanBatch method instead of RecordSpan.
     """
 
     PATH = "/com.newrelic.trace.v1.IngestService/RecordSpan"
+    BATCH_PATH = "/com.newrelic.trace.v1.IngestService/RecordSpanBatch"
 
     def __init__(self, endpoint, stream_buffer, metadata, record_metric, ssl=True):
         if ssl:
@@ -48,9 +52,14 @@ class StreamingRpc(object):
         )
         self.response_processing_thread.daemon = True
         self.notify = self.condition()
-        self.rpc = self.channel.stream_stream(
-            self.PATH, Span.SerializeToString, RecordStatus.FromString
-        )
+        if getattr(stream_buffer, "batching", False):
+            self.rpc = self.channel.stream_stream(
+                self.BATCH_PATH, SpanBatch.SerializeToString, RecordStatus.FromString
+            )
+        else:
+            self.rpc = self.channel.stream_stream(
+                self.PATH, Span.SerializeToString, RecordStatus.FromString
+            )
         self.record_metric = record_metric
 
     @staticmethod
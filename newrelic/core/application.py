@@ -24,6 +24,7 @@ import time
 import os
 import traceback
 import imp
+import itertools
 
 from functools import partial
 
@@ -40,6 +41,7 @@ from newrelic.core.stats_engine import StatsEngine, CustomMetrics
 from newrelic.core.internal_metrics import (InternalTrace,
         InternalTraceContext, internal_metric, internal_count_metric)
 from newrelic.core.profile_sessions import profile_session_manager
+from newrelic.core.recording_queue import RecordingQueue
 
 from newrelic.core.database_utils import SQLConnections
 from newrelic.common.object_names import callable_name
@@ -48,6 +50,19 @@ from newrelic.core.adaptive_sampler import AdaptiveSampler
 _logger = logging.getLogger(__name__)
 
 
+class StatsShard(object):
+
+    """Holds the stats engine for one aggregation shard along with the
+    lock protecting it and a count of the transactions merged into it.
+
+    """
+
+    def __init__(self, stats_engine):
+        self.lock = threading.Lock()
+        self.stats_engine = stats_engine
+        self.transaction_count = 0
+
+
 class Application(object):
 
     """Class which maintains recorded data for a single application.
@@ -96,6 +111,24 @@ class Application(object):
         self._stats_custom_lock = threading.RLock()
         self._stats_custom_engine = StatsEngine()
 
+        # When sharded aggregation is enabled, transactions are merged
+        # into one of a number of shards rather than directly into the
+        # main stats engine, so that threads recording transactions do
+        # not contend on the one lock. Each thread is assigned a shard
+        # on first use. Shards are merged into the main stats engine
+        # at the start of each harvest.
+
+        self._stats_shards = ()
+        self._stats_shard_local = threading.local()
+        self._stats_shard_counter = itertools.count()
+
+        # Queue used to record transactions on background threads when
+        # enabled. This is created on demand the first time a
+        # transaction is recorded with background recording enabled.
+
+        self._recording_queue = None
+        self._recording_queue_lock = threading.Lock()
+
         self._agent_commands_lock = threading.Lock()
         self._data_samplers_lock = threading.Lock()
         self._data_samplers_started = False
@@ -134,6 +167,11 @@ class Application(object):
     def configuration(self):
         return self._active_session and self._active_session.configuration
 
+    @property
+    def server_configuration(self):
+        return (self._active_session and
+                self._active_session.server_configuration)
+
     @property
     def active(self):
         return self.configuration is not None
@@ -398,14 +436,18 @@ class Application(object):
                                 'rules for %r are %r.', self._app_name,
                                     configuration.transaction_name_rules)
 
+                    cache_size = (configuration.agent_limits.
+                            normalization_cache_size)
+
                     self._rules_engine['url'] = RulesEngine(
-                            configuration.url_rules)
+                            configuration.url_rules, cache_size)
                     self._rules_engine['metric'] = RulesEngine(
-                            configuration.metric_name_rules)
+                            configuration.metric_name_rules, cache_size)
                     self._rules_engine['transaction'] = RulesEngine(
-                            configuration.transaction_name_rules)
+                            configuration.transaction_name_rules, cache_size)
                     self._rules_engine['segment'] = SegmentCollapseEngine(
-                            configuration.transaction_segment_terms)
+                            configuration.transaction_segment_terms,
+                            cache_size)
 
                 except Exception:
                     _logger.exception('The agent normalization rules '
@@ -474,6 +516,15 @@ class Application(object):
                     configuration,
                     reset_stream=True)
 
+            number_of_shards = configuration.transaction_recording.stats_shards
+
+            if number_of_shards > 1:
+                self._stats_shards = tuple(
+                        StatsShard(self._stats_engine.create_workarea())
+                        for _ in range(number_of_shards))
+            else:
+                self._stats_shards = ()
+
             if configuration.serverless_mode.enabled:
                 sampling_target_period = 60.0
             else:
@@ -794,6 +845,19 @@ class Application(object):
                 self._global_events_account += 1
                 self._stats_engine.record_custom_event(event)
 
+    def _get_recording_queue(self, settings):
+        if self._recording_queue is None:
+            with self._recording_queue_lock:
+                if self._recording_queue is None:
+                    recording = settings.transaction_recording
+                    self._recording_queue = RecordingQueue(
+                            self._record_transaction,
+                            maxsize=recording.queue_size,
+                            workers=recording.worker_threads,
+                            overflow_policy=recording.overflow_policy)
+
+        return self._recording_queue
+
     def record_transaction(self, data):
         """Record a single transaction against this application."""
 
@@ -802,6 +866,26 @@ class Application(object):
 
         settings = self._stats_engine.settings
 
+        if settings is None:
+            return
+
+        # When background recording is enabled the generation of the
+        # metrics, events and traces for the transaction is handed off
+        # to worker threads so that the thread which executed the
+        # transaction only needs to pay the cost of queueing it.
+
+        if settings.transaction_recording.background_enabled:
+            self._get_recording_queue(settings).put(data)
+            return
+
+        self._record_transaction(data)
+
+    def _record_transaction(self, data):
+        if not self._active_session:
+            return
+
+        settings = self._stats_engine.settings
+
         if settings is None:
             return
 
@@ -823,6 +907,17 @@ class Application(object):
 
         self.validate_process()
 
+        shards = self._stats_shards
+
+        if shards:
+            shard = shards[self._stats_shard_index() % len(shards)]
+            lock = shard.lock
+            stats_engine = shard.stats_engine
+        else:
+            shard = None
+            lock = self._stats_lock
+            stats_engine = self._stats_engine
+
         internal_metrics = CustomMetrics()
 
         with InternalTraceContext(internal_metrics):
@@ -833,7 +928,7 @@ class Application(object):
                     # that the process of generating the metrics into the stats
                     # don't unnecessarily lock out another thread.
 
-                    stats = self._stats_engine.create_workarea()
+                    stats = stats_engine.create_workarea()
                     stats.record_transaction(data)
 
                 except Exception:
@@ -846,12 +941,20 @@ class Application(object):
                     if settings.debug.record_transaction_failure:
                         raise
 
-            with self._stats_lock:
+            with lock:
                 try:
-                    self._transaction_count += 1
+                    # The stats engine for a shard is replaced at each
+                    # harvest, so look it up again now the lock is held.
+
+                    if shard is not None:
+                        stats_engine = shard.stats_engine
+                        shard.transaction_count += 1
+                    else:
+                        self._transaction_count += 1
+
                     self._last_transaction = data.end_time
 
-                    self._stats_engine.merge(stats)
+                    stats_engine.merge(stats)
 
                     # We merge the internal statistics here as well even
                     # though have popped out of the context where we are
@@ -859,7 +962,7 @@ class Application(object):
                     # anything else after this point. If we do then that
                     # data will not be recorded.
 
-                    self._stats_engine.merge_custom_metrics(
+                    stats_engine.merge_custom_metrics(
                             internal_metrics.metrics())
 
                 except Exception:
@@ -872,6 +975,297 @@ class Application(object):
                     if settings.debug.record_transaction_failure:
                         raise
 
+    def _stats_shard_index(self):
+        index = getattr(self._stats_shard_local, 'index', None)
+
+        if index is None:
+            index = next(self._stats_shard_counter)
+            self._stats_shard_local.index = index
+
+        return index
+
+    def _merge_stats_shards(self):
+        """Merges the data accumulated in each aggregation shard into the
+        main stats engine, replacing each with an empty stats engine. The
+        caller must hold the main stats lock.
+
+        """
+
+        for shard in self._stats_shards:
+            with shard.lock:
+                stats_engine = shard.stats_engine
+                transaction_count = shard.transaction_count
+
+                shard.stats_engine = self._stats_engine.create_workarea()
+                shard.transaction_count = 0
+
+            self._transaction_count += transaction_count
+            self._stats_engine.merge_shard(stats_engine)
+
+    @staticmethod
+    def _record_events_sent(seen_metric, sent_metric, num_seen, num_sent):
+        internal_count_metric(seen_metric, num_seen)
+        internal_count_metric(sent_metric, num_sent)
+
+    def _record_harvest_metrics(self, stats):
+        """Records the metrics from the data samplers associated with this
+        application, and the supportability metrics recorded at each
+        harvest, in the stats engine snapshot for the harvest.
+
+        """
+
+        # Merge in any metrics from the data samplers
+        # associated with this application.
+        #
+        # NOTE If a data sampler has problems then what data was
+        # collected up to that point is retained. The data
+        # collector itself is still retained and would be used
+        # again on future harvest. If it is a persistent problem
+        # with the data sampler the issue would then reoccur
+        # with every harvest. If data sampler is a user provided
+        # data sampler, then should perhaps deregister it if it
+        # keeps having problems.
+
+        _logger.debug('Fetching metrics from data sources for '
+                'harvest of %r.', self._app_name)
+
+        for data_sampler in self._data_samplers:
+            try:
+                for sample in data_sampler.metrics():
+                    try:
+                        name, value = sample
+                        stats.record_custom_metric(name, value)
+                    except Exception:
+                        _logger.exception('The merging of custom '
+                                'metric sample %r from data '
+                                'source %r has failed. Validate '
+                                'the format of the sample. If '
+                                'this issue persists then please '
+                                'report this problem to the data '
+                                'source provider or New Relic '
+                                'support for further '
+                                'investigation.', sample,
+                                data_sampler.name)
+                        break
+
+            except Exception:
+                _logger.exception('The merging of custom metric '
+                        'samples from data source %r has failed. '
+                        'Validate that the data source is '
+                        'producing samples correctly. If this '
+                        'issue persists then please report this '
+                        'problem to the data source provider or '
+                        'New Relic support for further '
+                        'investigation.', data_sampler.name)
+
+        # Add a metric we can use to track how many harvest
+        # periods have occurred.
+
+        stats.record_custom_metric('Instance/Reporting', 0)
+
+        # If an import order issue was detected, send a metric for
+        # each uninstrumented module
+
+        # Report how effective caching the results of the
+        # normalization rules has been.
+
+        for rule_type, engine in self._rules_engine.items():
+            if engine.cache is None:
+                continue
+
+            hits, misses = engine.cache.reset_counts()
+            metric_prefix = ('Supportability/Python/'
+                    'RulesEngine/%s/Cache' % rule_type)
+
+            internal_count_metric(metric_prefix + '/Hits', hits)
+            internal_count_metric(metric_prefix + '/Misses',
+                    misses)
+
+        if self._uninstrumented:
+            for uninstrumented in self._uninstrumented:
+                internal_count_metric(
+                        'Supportability/Python/Uninstrumented', 1)
+                internal_count_metric(
+                        'Supportability/Uninstrumented/'
+                        '%s' % uninstrumented, 1)
+
+    def _send_harvest_requests(self, requests, configuration,
+            internal_metrics):
+        """Sends the data for each of the harvest requests. Each request
+        is a tuple consisting of a description of the data, a function
+        to send it, and functions to call when the data has been sent
+        and once the data has been dealt with. If parallel harvest
+        requests are enabled, the requests are sent concurrently using
+        a set of worker threads sharing the pool of connections held by
+        the session, with the internal metrics they record being merged
+        into those of the harvest. As when sent sequentially, no further
+        requests are sent once any request has failed, with the failure
+        then being raised so that the remainder of the harvest, including
+        the sending of the metric data, is abandoned.
+
+        """
+
+        from newrelic.core.data_collector import PAYLOAD_SPOOLED
+
+        max_parallel = (configuration.agent_limits.
+                max_parallel_harvest_requests)
+
+        # Where the audit log is being written, requests are always sent
+        # sequentially so that the entries in the log are not interleaved.
+
+        if (max_parallel <= 1 or len(requests) <= 1 or
+                configuration.audit_log_file):
+            for name, send, on_sent, reset in requests:
+                _logger.debug('Sending %s data for harvest of %r.',
+                        name, self._app_name)
+
+                result = send()
+
+                # Data spooled to disk to be replayed by a later harvest
+                # has not been sent, but is not to be retried either.
+
+                if on_sent is not None and result is not PAYLOAD_SPOOLED:
+                    on_sent()
+                if reset is not None:
+                    reset()
+
+            return
+
+        pending = list(reversed(requests))
+        outcomes = {}
+        spooled = set()
+        worker_metrics = []
+        lock = threading.Lock()
+
+        def send_requests():
+            metrics = CustomMetrics()
+
+            with lock:
+                worker_metrics.append(metrics)
+
+            with InternalTraceContext(metrics):
+                while True:
+                    with lock:
+                        if not pending:
+                            return
+                        request = pending.pop()
+
+                    name, send = request[:2]
+
+                    _logger.debug('Sending %s data for harvest of %r.',
+                            name, self._app_name)
+
+                    try:
+                        result = send()
+                    except Exception:
+                        outcomes[name] = sys.exc_info()[1]
+
+                        # Stop dispatching the requests which have not yet
+                        # been sent. Any data for these is dealt with by
+                        # the handler for the failure in the same way as
+                        # if the requests had been sent sequentially.
+
+                        with lock:
+                            del pending[:]
+                    else:
+                        outcomes[name] = None
+
+                        if result is PAYLOAD_SPOOLED:
+                            spooled.add(name)
+
+        threads = []
+
+        for index in range(min(max_parallel, len(requests))):
+            thread = threading.Thread(target=send_requests,
+                    name='NR-Harvest-Sender-%d' % index)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        for thread in threads:
+            thread.join()
+
+        # Any internal metrics recorded by the worker threads when
+        # sending the data are merged back into those of the harvest.
+        # These are accumulated stats rather than single values, so are
+        # merged directly rather than being recorded as new values.
+
+        for metrics in worker_metrics:
+            internal_metrics.merge_metrics(metrics.metrics())
+
+        # Where more than one request failed, the failure raised is the
+        # one with the most severe consequence for the harvest, with the
+        # first in order of the requests being used when of equal
+        # severity. This is then dealt with by the handlers in the
+        # harvest exactly as when requests are sent sequentially.
+
+        def severity(exception):
+            if isinstance(exception, ForceAgentDisconnect):
+                return 0
+            elif isinstance(exception, ForceAgentRestart):
+                return 1
+            elif isinstance(exception, RetryDataForRequest):
+                return 2
+            elif isinstance(exception, DiscardDataForRequest):
+                return 3
+            return 4
+
+        failures = [outcomes[request[0]] for request in requests
+                if outcomes.get(request[0]) is not None]
+
+        raise_exception = None
+
+        if failures:
+            raise_exception = min(failures, key=severity)
+
+        # Now process the outcome of each request which was sent. Data
+        # which was sent, or which we were told to discard, is reset.
+        # Any data for which a retry was requested, or which was never
+        # sent, is left in place so the rollback performed in the
+        # handler for a retry will merge it into the next harvest.
+
+        for name, send, on_sent, reset in requests:
+            if name not in outcomes:
+                continue
+
+            exception = outcomes[name]
+
+            if exception is None:
+                if on_sent is not None and name not in spooled:
+                    on_sent()
+
+            elif isinstance(exception, (ForceAgentDisconnect,
+                    ForceAgentRestart, RetryDataForRequest)):
+                continue
+
+            elif exception is raise_exception:
+                # Supportability metrics for the failure being raised
+                # are recorded by the handler in the harvest.
+
+                pass
+
+            elif isinstance(exception, DiscardDataForRequest):
+                internal_metric('Supportability/Python/Harvest/'
+                        'Exception/%s' % callable_name(type(exception)), 1)
+
+                self._discard_count += 1
+
+            else:
+                internal_metric('Supportability/Python/Harvest/'
+                        'Exception/%s' % callable_name(type(exception)), 1)
+
+                _logger.error('Unexpected exception when attempting '
+                        'to send %s data for harvest of %r. Please report '
+                        'this problem to New Relic support for further '
+                        'investigation. %r', name, self._app_name,
+                        exception)
+
+            if reset is not None:
+                reset()
+
+        if raise_exception is not None:
+            raise raise_exception
+
     def cmd_start_profiler(self, command_id=0, **kwargs):
         """Triggered by the start_profiler agent command to start a
         thread profiling session.
@@ -983,6 +1377,13 @@ class Application(object):
 
             return
 
+        # When reporting via a local aggregator, the data accumulated in
+        # this process is instead forwarded to the aggregator process,
+        # which merges it with that from other processes and reports it.
+
+        if self._active_session.LOCAL_AGGREGATOR:
+            return self._forward_harvest(shutdown)
+
         internal_metrics = CustomMetrics()
 
         call_metric = 'flexible' if flexible else 'default'
@@ -1004,9 +1405,28 @@ class Application(object):
                 _logger.debug('Snapshotting for harvest[%s] of %r.', call_metric, self._app_name)
 
                 configuration = self._active_session.configuration
-                transaction_count = self._transaction_count
+
+                # Wait for any transactions queued for recording on the
+                # background threads to be processed, so they are
+                # reported in the harvest period in which they completed.
+
+                recording_queue = self._recording_queue
+
+                if recording_queue is not None:
+                    if not recording_queue.flush(configuration.
+                            transaction_recording.flush_timeout):
+                        _logger.debug('Timed out waiting for queued '
+                                'transactions to be recorded prior to '
+                                'harvest of %r.', self._app_name)
+
+                    for name, value in recording_queue.metrics():
+                        internal_metric(name, value)
 
                 with self._stats_lock:
+                    self._merge_stats_shards()
+
+                    transaction_count = self._transaction_count
+
                     self._transaction_count = 0
 
                     self._last_transaction = 0.0
@@ -1026,65 +1446,7 @@ class Application(object):
 
                     stats.merge_metric_stats(stats_custom)
 
-                    # Now merge in any metrics from the data samplers
-                    # associated with this application.
-                    #
-                    # NOTE If a data sampler has problems then what data was
-                    # collected up to that point is retained. The data
-                    # collector itself is still retained and would be used
-                    # again on future harvest. If it is a persistent problem
-                    # with the data sampler the issue would then reoccur
-                    # with every harvest. If data sampler is a user provided
-                    # data sampler, then should perhaps deregister it if it
-                    # keeps having problems.
-
-                    _logger.debug('Fetching metrics from data sources for '
-                            'harvest of %r.', self._app_name)
-
-                    for data_sampler in self._data_samplers:
-                        try:
-                            for sample in data_sampler.metrics():
-                                try:
-                                    name, value = sample
-                                    stats.record_custom_metric(name, value)
-                                except Exception:
-                                    _logger.exception('The merging of custom '
-                                            'metric sample %r from data '
-                                            'source %r has failed. Validate '
-                                            'the format of the sample. If '
-                                            'this issue persists then please '
-                                            'report this problem to the data '
-                                            'source provider or New Relic '
-                                            'support for further '
-                                            'investigation.', sample,
-                                            data_sampler.name)
-                                    break
-
-                        except Exception:
-                            _logger.exception('The merging of custom metric '
-                                    'samples from data source %r has failed. '
-                                    'Validate that the data source is '
-                                    'producing samples correctly. If this '
-                                    'issue persists then please report this '
-                                    'problem to the data source provider or '
-                                    'New Relic support for further '
-                                    'investigation.', data_sampler.name)
-
-                    # Add a metric we can use to track how many harvest
-                    # periods have occurred.
-
-                    stats.record_custom_metric('Instance/Reporting', 0)
-
-                    # If an import order issue was detected, send a metric for
-                    # each uninstrumented module
-
-                    if self._uninstrumented:
-                        for uninstrumented in self._uninstrumented:
-                            internal_count_metric(
-                                    'Supportability/Python/Uninstrumented', 1)
-                            internal_count_metric(
-                                    'Supportability/Uninstrumented/'
-                                    '%s' % uninstrumented, 1)
+                    self._record_harvest_metrics(stats)
 
                 # Create our time stamp as to when this reporting period
                 # ends and start reporting the data.
@@ -1110,6 +1472,17 @@ class Application(object):
 
                 try:
                     # Send the transaction and custom metric data.
+                    #
+                    # Each of the requests for sending event data, errors
+                    # and traces is first gathered up as a tuple of the
+                    # description of the data, the function to send it,
+                    # the function to call once it has been successfully
+                    # sent and the function to reset the data in the
+                    # snapshot once it has been dealt with. These are
+                    # then sent, potentially in parallel, before sending
+                    # the metric data.
+
+                    harvest_requests = []
 
                     # Send data set for analytics, which is Synthetic analytic
                     # events, and the sampled data set of regular requests sent
@@ -1118,14 +1491,14 @@ class Application(object):
                     synthetics_events = stats.synthetics_events
                     if synthetics_events:
                         if synthetics_events.num_samples:
-                            _logger.debug('Sending synthetics event data for '
-                                    'harvest of %r.', self._app_name)
-
-                            self._active_session.send_transaction_events(
-                                    synthetics_events.sampling_info,
-                                    synthetics_events)
-
-                        stats.reset_synthetics_events()
+                            harvest_requests.append(('synthetics event',
+                                    partial(self._active_session.
+                                        send_transaction_events,
+                                        synthetics_events.sampling_info,
+                                        synthetics_events),
+                                    None, stats.reset_synthetics_events))
+                        else:
+                            stats.reset_synthetics_events()
 
                     if (configuration.collect_analytics_events and
                             configuration.transaction_events.enabled):
@@ -1142,14 +1515,14 @@ class Application(object):
                                     transaction_events.num_samples)
 
                             if transaction_events.num_samples:
-                                _logger.debug('Sending analytics event data '
-                                        'for harvest of %r.', self._app_name)
-
-                                self._active_session.send_transaction_events(
-                                        transaction_events.sampling_info,
-                                        transaction_events)
-
-                            stats.reset_transaction_events()
+                                harvest_requests.append(('analytics event',
+                                        partial(self._active_session.
+                                            send_transaction_events,
+                                            transaction_events.sampling_info,
+                                            transaction_events),
+                                        None, stats.reset_transaction_events))
+                            else:
+                                stats.reset_transaction_events()
 
                     # Send span events
 
@@ -1172,29 +1545,26 @@ class Application(object):
                         else:
                             spans = stats.span_events
                             if spans:
-                                if spans.num_samples > 0:
-                                    span_samples = list(spans)
-
-                                    _logger.debug(
-                                            'Sending span event data '
-                                            'for harvest of %r.',
-                                            self._app_name)
-
-                                    self._active_session.send_span_events(
-                                        spans.sampling_info, span_samples)
-                                    span_samples = None
-
                                 # As per spec
-                                spans_seen = spans.num_seen
-                                spans_sampled = spans.num_samples
-                                internal_count_metric(
+
+                                spans_sent = partial(self._record_events_sent,
                                         'Supportability/SpanEvent/'
-                                        'TotalEventsSeen', spans_seen)
-                                internal_count_metric(
+                                        'TotalEventsSeen',
                                         'Supportability/SpanEvent/'
-                                        'TotalEventsSent', spans_sampled)
+                                        'TotalEventsSent',
+                                        spans.num_seen, spans.num_samples)
 
-                                stats.reset_span_events()
+                                if spans.num_samples > 0:
+                                    harvest_requests.append(('span event',
+                                            partial(self._active_session.
+                                                send_span_events,
+                                                spans.sampling_info,
+                                                list(spans)),
+                                            spans_sent,
+                                            stats.reset_span_events))
+                                else:
+                                    spans_sent()
+                                    stats.reset_span_events()
 
                     # Send error events
 
@@ -1204,27 +1574,28 @@ class Application(object):
 
                         error_events = stats.error_events
                         if error_events:
-                            num_error_samples = error_events.num_samples
-                            if num_error_samples > 0:
-                                error_event_samples = list(error_events)
-
-                                _logger.debug('Sending error event data '
-                                        'for harvest of %r.', self._app_name)
-
-                                samp_info = error_events.sampling_info
-                                self._active_session.send_error_events(
-                                        samp_info,
-                                        error_event_samples)
-                                error_event_samples = None
-
                             # As per spec
-                            internal_count_metric('Supportability/Events/'
-                                    'TransactionError/Seen',
-                                    error_events.num_seen)
-                            internal_count_metric('Supportability/Events/'
-                                    'TransactionError/Sent', num_error_samples)
 
-                            stats.reset_error_events()
+                            error_events_sent = partial(
+                                    self._record_events_sent,
+                                    'Supportability/Events/'
+                                    'TransactionError/Seen',
+                                    'Supportability/Events/'
+                                    'TransactionError/Sent',
+                                    error_events.num_seen,
+                                    error_events.num_samples)
+
+                            if error_events.num_samples > 0:
+                                harvest_requests.append(('error event',
+                                        partial(self._active_session.
+                                            send_error_events,
+                                            error_events.sampling_info,
+                                            list(error_events)),
+                                        error_events_sent,
+                                        stats.reset_error_events))
+                            else:
+                                error_events_sent()
+                                stats.reset_error_events()
 
                     # Send custom events
 
@@ -1234,23 +1605,24 @@ class Application(object):
                         customs = stats.custom_events
 
                         if customs:
-                            if customs.num_samples > 0:
-                                custom_samples = list(customs)
-
-                                _logger.debug('Sending custom event data '
-                                        'for harvest of %r.', self._app_name)
-
-                                self._active_session.send_custom_events(
-                                        customs.sampling_info, custom_samples)
-                                custom_samples = None
-
                             # As per spec
-                            internal_count_metric('Supportability/Events/'
-                                    'Customer/Seen', customs.num_seen)
-                            internal_count_metric('Supportability/Events/'
-                                    'Customer/Sent', customs.num_samples)
 
-                            stats.reset_custom_events()
+                            customs_sent = partial(self._record_events_sent,
+                                    'Supportability/Events/Customer/Seen',
+                                    'Supportability/Events/Customer/Sent',
+                                    customs.num_seen, customs.num_samples)
+
+                            if customs.num_samples > 0:
+                                harvest_requests.append(('custom event',
+                                        partial(self._active_session.
+                                            send_custom_events,
+                                            customs.sampling_info,
+                                            list(customs)),
+                                        customs_sent,
+                                        stats.reset_custom_events))
+                            else:
+                                customs_sent()
+                                stats.reset_custom_events()
 
                     # Send the accumulated error data.
 
@@ -1258,10 +1630,10 @@ class Application(object):
                         error_data = stats.error_data()
 
                         if error_data:
-                            _logger.debug('Sending error data for harvest '
-                                    'of %r.', self._app_name)
-
-                            self._active_session.send_errors(error_data)
+                            harvest_requests.append(('error',
+                                    partial(self._active_session.send_errors,
+                                        error_data),
+                                    None, None))
 
                     if not flexible:
                         if configuration.collect_traces:
@@ -1279,27 +1651,30 @@ class Application(object):
                                             connections)
 
                                     if slow_sql_data:
-                                        _logger.debug(
-                                                'Sending slow SQL data for '
-                                                'harvest of %r.',
-                                                self._app_name)
-
-                                        self._active_session.send_sql_traces(
-                                                slow_sql_data)
+                                        harvest_requests.append(('slow SQL',
+                                                partial(self._active_session.
+                                                    send_sql_traces,
+                                                    slow_sql_data),
+                                                None, None))
 
                                 slow_transaction_data = (
                                         stats.transaction_trace_data(
                                         connections))
 
                                 if slow_transaction_data:
-                                    _logger.debug('Sending slow transaction '
-                                            'data for harvest of %r.',
-                                            self._app_name)
+                                    harvest_requests.append((
+                                            'slow transaction',
+                                            partial(self._active_session.
+                                                send_transaction_traces,
+                                                slow_transaction_data),
+                                            None, None))
+
+                    self._send_harvest_requests(harvest_requests,
+                            configuration, internal_metrics)
 
-                                    self._active_session \
-                                    .send_transaction_traces(
-                                            slow_transaction_data)
+                    harvest_requests = None
 
+                    if not flexible:
                         # Create a metric_normalizer based on normalize_name
                         # If metric rename rules are empty, set normalizer
                         # to None and the stats engine will skip steps as
@@ -1311,6 +1686,10 @@ class Application(object):
                         else:
                             metric_normalizer = None
 
+                        for metric_name, metric_value in (self.
+                                _active_session.spool_metrics()):
+                            internal_metric(metric_name, metric_value)
+
                         # Merge all ready internal metrics
                         stats.merge_custom_metrics(internal_metrics.metrics())
 
@@ -1347,6 +1726,12 @@ class Application(object):
 
                         self._period_start = period_end
 
+                        # The data collector is reachable, so replay a
+                        # limited number of payloads which were spooled to
+                        # disk when previously they could not be sent.
+
+                        self._active_session.replay_spooled_payloads()
+
                         # Fetch agent commands sent from the data collector
                         # and process them.
 
@@ -1483,6 +1868,97 @@ class Application(object):
                         'for %r.', self._app_name)
                 self._active_session.send_profile_data(profile_data)
 
+    def _forward_harvest(self, shutdown=False):
+        """Forwards all data accumulated since the last harvest to the
+        local aggregator process. If the data cannot be forwarded it is
+        merged back in to be forwarded with the next harvest.
+
+        """
+
+        internal_metrics = CustomMetrics()
+
+        with InternalTraceContext(internal_metrics):
+            with InternalTrace('Supportability/Python/Harvest/Calls/'
+                    'forward'):
+
+                self._harvest_count += 1
+
+                configuration = self._active_session.configuration
+
+                recording_queue = self._recording_queue
+
+                if recording_queue is not None:
+                    recording_queue.flush(configuration.
+                            transaction_recording.flush_timeout)
+
+                    for name, value in recording_queue.metrics():
+                        internal_metric(name, value)
+
+                with self._stats_lock:
+                    self._merge_stats_shards()
+
+                    transaction_count = self._transaction_count
+
+                    self._transaction_count = 0
+
+                    self._last_transaction = 0.0
+
+                    stats = self._stats_engine.forwarding_snapshot()
+
+                with self._stats_custom_lock:
+                    self._global_events_account = 0
+
+                    stats_custom = self._stats_custom_engine.harvest_snapshot()
+
+                stats.merge_metric_stats(stats_custom)
+
+                self._record_harvest_metrics(stats)
+
+                _logger.debug('Forwarding data for harvest of %r to the '
+                        'local aggregator.', self._app_name)
+
+                connections = SQLConnections(
+                        configuration.agent_limits.max_sql_connections)
+
+                try:
+                    with connections:
+                        self._active_session.send_forwarded_stats(stats,
+                                transaction_count, connections)
+
+                except RetryDataForRequest:
+                    _logger.debug('Unable to forward data for harvest of %r '
+                            'to the local aggregator. The data will be '
+                            'forwarded with the next harvest.',
+                            self._app_name)
+
+                    with self._stats_lock:
+                        self._transaction_count += transaction_count
+                        self._stats_engine.merge_shard(stats)
+
+        with self._stats_lock:
+            self._stats_engine.merge_custom_metrics(
+                    internal_metrics.metrics())
+
+        if shutdown:
+            self.internal_agent_shutdown(restart=False)
+
+    def merge_forwarded_stats(self, data, transaction_count):
+        """Merges data forwarded from another process by way of the local
+        aggregator, as returned by forwarded_data() of its stats engine.
+        Returns False if there is no active session, in which case the
+        data has not been merged.
+
+        """
+
+        if not self._active_session:
+            return False
+
+        with self._stats_lock:
+            self._transaction_count += transaction_count
+            self._stats_engine.merge_forwarded_data(data)
+
+        return True
+
     def internal_agent_shutdown(self, restart=False):
         """Terminates the active agent session for this application and
         optionally triggers activation of a new session.
@@ -1508,6 +1984,17 @@ class Application(object):
 
         self.stop_data_samplers()
 
+        # Stop the background recording threads. Any transactions still
+        # queued will be recorded before the threads exit.
+
+        if self._recording_queue is not None:
+            try:
+                self._recording_queue.shutdown(
+                        self._active_session.configuration.
+                        transaction_recording.flush_timeout)
+            except Exception:
+                pass
+
         # Now shutdown the actual agent session.
 
         try:
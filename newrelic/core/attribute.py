@@ -163,6 +163,40 @@ def resolve_agent_attributes(
     return a_attrs
 
 
+def process_user_attributes(attr_dict, attribute_filter):
+
+    # Validate and truncate user attributes, and determine the destinations
+    # for each, in a single pass. Attributes which fail validation, or which
+    # go to no destination, are dropped. The result can then be filtered
+    # for each destination with filter_attributes(), rather than processing
+    # the attributes again for every destination.
+
+    attributes = []
+
+    for k, v in attr_dict.items():
+        name, value = process_user_attribute(k, v)
+
+        if name is None:
+            continue
+
+        dest = attribute_filter.apply(name, DST_ALL)
+
+        if dest:
+            attributes.append(Attribute(name, value, dest))
+
+    return attributes
+
+
+def filter_attributes(attributes, target_destination, attr_class=dict):
+    attrs = attr_class()
+
+    for attr in attributes:
+        if attr.destinations & target_destination:
+            attrs[attr.name] = attr.value
+
+    return attrs
+
+
 def create_user_attributes(attr_dict, attribute_filter):
     destinations = DST_ALL
     return create_attributes(attr_dict, destinations, attribute_filter)
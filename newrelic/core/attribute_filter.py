@@ -57,11 +57,37 @@ class AttributeFilter(object):
     #      the bitfield.
     #
     #   4. Return the resulting bitfield after all rules have been applied.
+    #
+    # Rather than testing every rule against each attribute name, the rules
+    # are compiled into a decision table when the filter is created. The
+    # only rules which can match a name are the wildcard rules whose prefix
+    # is a prefix of the name, and the exact rules for the name itself. In
+    # the sorted order these come shortest prefix first, with an exact rule
+    # last, so walking a trie of the wildcard prefixes character by
+    # character, then looking up the exact rules, visits the matching rules
+    # in the same order as traversing the full list would.
+    #
+    # Each rule either ORs in or masks out bits, so the rules sharing a
+    # name can be collapsed into a single pair of masks, applied as
+    # "(destinations & and_mask) | or_mask".
+    #
+    # Results are memoized per attribute name and default destinations.
+    # As attribute names derived from request data can be of unlimited
+    # cardinality, the cache is emptied whenever it fills up. This keeps
+    # the lookup for a cached result to a single dictionary access, where
+    # a least recently used cache would need a lock around each access.
 
     def __init__(self, flattened_settings):
 
         self.enabled_destinations = self._set_enabled_destinations(flattened_settings)
         self.rules = self._build_rules(flattened_settings)
+        self._prefixes, self._exact = self._compile_rules(self.rules)
+
+        self.cache_size = flattened_settings.get(
+                'agent_limits.attribute_filter_cache_size', None)
+        if self.cache_size is None:
+            self.cache_size = 1000
+
         self.cache = {}
 
     def __repr__(self):
@@ -135,26 +161,82 @@ class AttributeFilter(object):
 
         return tuple(rules)
 
+    def _compile_rules(self, rules):
+
+        # Builds the trie of wildcard prefixes and the table of exact
+        # names. Trie nodes are dictionaries keyed by the next character
+        # of the prefix, with the masks for rules ending at that node
+        # stored under the key None.
+
+        prefixes = {}
+        exact = {}
+
+        for rule in rules:
+            if rule.is_wildcard:
+                node = prefixes
+                for character in rule.name:
+                    node = node.setdefault(character, {})
+                masks = node.get(None, (DST_ALL, DST_NONE))
+                node[None] = self._compose_rule(masks, rule)
+            else:
+                masks = exact.get(rule.name, (DST_ALL, DST_NONE))
+                exact[rule.name] = self._compose_rule(masks, rule)
+
+        return prefixes, exact
+
+    def _compose_rule(self, masks, rule):
+
+        # Returns the masks equivalent to applying the given masks and then
+        # the rule. Includes may not enable a destination which has
+        # attributes disabled.
+
+        and_mask, or_mask = masks
+
+        if rule.is_include:
+            or_mask |= rule.destinations & self.enabled_destinations
+        else:
+            and_mask &= ~rule.destinations
+            or_mask &= ~rule.destinations
+
+        return and_mask, or_mask
+
     def apply(self, name, default_destinations):
         if self.enabled_destinations == DST_NONE:
             return DST_NONE
 
         cache_index = (name, default_destinations)
 
-        if cache_index in self.cache:
-            return self.cache[cache_index]
+        cache = self.cache
+        destinations = cache.get(cache_index)
+        if destinations is not None:
+            return destinations
 
         destinations = self.enabled_destinations & default_destinations
 
-        for rule in self.rules:
-            if rule.name_match(name):
-                if rule.is_include:
-                    inc_dest = rule.destinations & self.enabled_destinations
-                    destinations |= inc_dest
-                else:
-                    destinations &= ~rule.destinations
+        node = self._prefixes
+        masks = node.get(None)
+
+        if masks is not None:
+            destinations = (destinations & masks[0]) | masks[1]
+
+        for character in name:
+            node = node.get(character)
+            if node is None:
+                break
+
+            masks = node.get(None)
+            if masks is not None:
+                destinations = (destinations & masks[0]) | masks[1]
+
+        masks = self._exact.get(name)
+        if masks is not None:
+            destinations = (destinations & masks[0]) | masks[1]
+
+        if self.cache_size > 0:
+            if len(cache) >= self.cache_size:
+                cache.clear()
+            cache[cache_index] = destinations
 
-        self.cache[cache_index] = destinations
         return destinations
 
 class AttributeFilterRule(object):
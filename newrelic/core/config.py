@@ -301,6 +301,22 @@ class InfiniteTracingSettings(Settings):
         return True
 
 
+class TransactionRecordingSettings(Settings):
+    pass
+
+
+class PayloadSpoolSettings(Settings):
+    pass
+
+
+class HarvestScheduleSettings(Settings):
+    pass
+
+
+class LocalDaemonSettings(Settings):
+    pass
+
+
 class EventHarvestConfigSettings(Settings):
     nested = True
     _lock = threading.Lock()
@@ -364,6 +380,10 @@ _settings.distributed_tracing = DistributedTracingSettings()
 _settings.serverless_mode = ServerlessModeSettings()
 _settings.infinite_tracing = InfiniteTracingSettings()
 _settings.event_harvest_config = EventHarvestConfigSettings()
+_settings.transaction_recording = TransactionRecordingSettings()
+_settings.payload_spool = PayloadSpoolSettings()
+_settings.harvest_schedule = HarvestScheduleSettings()
+_settings.local_daemon = LocalDaemonSettings()
 _settings.event_harvest_config.harvest_limits = \
         EventHarvestConfigHarvestLimitSettings()
 
@@ -635,10 +655,13 @@ _settings.span_events.attributes.include = []
 _settings.transaction_segments.attributes.enabled = True
 _settings.transaction_segments.attributes.exclude = []
 _settings.transaction_segments.attributes.include = []
+_settings.transaction_segments.aggregate_repeated = False
+_settings.transaction_segments.lightweight_unsampled = False
 
 _settings.transaction_tracer.enabled = True
 _settings.transaction_tracer.transaction_threshold = None
 _settings.transaction_tracer.record_sql = 'obfuscated'
+_settings.transaction_tracer.sql_obfuscation_engine = 'regex'
 _settings.transaction_tracer.stack_trace_threshold = 0.5
 _settings.transaction_tracer.explain_enabled = True
 _settings.transaction_tracer.explain_threshold = 0.5
@@ -680,7 +703,11 @@ _settings.synthetics.enabled = True
 
 _settings.agent_limits.data_collector_timeout = 30.0
 _settings.agent_limits.transaction_traces_nodes = 2000
+_settings.agent_limits.max_transaction_segments = 0
 _settings.agent_limits.sql_query_length_maximum = 16384
+_settings.agent_limits.sql_statement_cache_size = 1000
+_settings.agent_limits.normalization_cache_size = 1000
+_settings.agent_limits.attribute_filter_cache_size = 1000
 _settings.agent_limits.slow_sql_stack_trace = 30
 _settings.agent_limits.max_sql_connections = 4
 _settings.agent_limits.sql_explain_plans = 30
@@ -695,6 +722,9 @@ _settings.agent_limits.synthetics_events = 200
 _settings.agent_limits.synthetics_transactions = 20
 _settings.agent_limits.data_compression_threshold = 64 * 1024
 _settings.agent_limits.data_compression_level = None
+_settings.agent_limits.data_compression_streaming = False
+_settings.agent_limits.data_compression_time_budget = 0.0
+_settings.agent_limits.max_parallel_harvest_requests = 1
 
 _settings.infinite_tracing.trace_observer_host = os.environ.get(
         'NEW_RELIC_INFINITE_TRACING_TRACE_OBSERVER_HOST', None)
@@ -703,6 +733,39 @@ _settings.infinite_tracing.trace_observer_port = _environ_as_int(
 _settings.infinite_tracing.ssl = True
 _settings.infinite_tracing.span_queue_size = _environ_as_int(
         'NEW_RELIC_INFINITE_TRACING_SPAN_QUEUE_SIZE', 10000)
+_settings.infinite_tracing.batching = _environ_as_bool(
+        'NEW_RELIC_INFINITE_TRACING_BATCHING', default=False)
+_settings.infinite_tracing.batch_size = 100
+_settings.infinite_tracing.batch_timeout = 0.1
+
+_settings.transaction_recording.background_enabled = _environ_as_bool(
+        'NEW_RELIC_TRANSACTION_RECORDING_BACKGROUND_ENABLED', default=False)
+_settings.transaction_recording.queue_size = 1000
+_settings.transaction_recording.worker_threads = 1
+_settings.transaction_recording.overflow_policy = 'drop'
+_settings.transaction_recording.flush_timeout = 5.0
+_settings.transaction_recording.stats_shards = 0
+_settings.transaction_recording.compact_stats_table = False
+
+_settings.payload_spool.enabled = _environ_as_bool(
+        'NEW_RELIC_PAYLOAD_SPOOL_ENABLED', default=False)
+_settings.payload_spool.directory = os.environ.get(
+        'NEW_RELIC_PAYLOAD_SPOOL_DIRECTORY', None)
+_settings.payload_spool.max_size = 50 * 1024 * 1024
+_settings.payload_spool.max_age = 3600.0
+_settings.payload_spool.segment_size = 1024 * 1024
+_settings.payload_spool.replay_limit = 10
+
+_settings.harvest_schedule.staggered = False
+_settings.harvest_schedule.jitter = 0.0
+
+_settings.local_daemon.enabled = _environ_as_bool(
+        'NEW_RELIC_LOCAL_DAEMON_ENABLED', default=False)
+_settings.local_daemon.socket_path = os.environ.get(
+        'NEW_RELIC_LOCAL_DAEMON_SOCKET_PATH', None)
+_settings.local_daemon.synchronous_startup = False
+_settings.local_daemon.startup_timeout = 5.0
+_settings.local_daemon.timeout = 30.0
 
 _settings.event_harvest_config.harvest_limits.analytic_event_data = \
         DEFAULT_RESERVOIR_SIZE
@@ -18,34 +18,115 @@
 
 from __future__ import print_function
 
+import copy
+import hashlib
 import logging
+import os
+import tempfile
 
 from newrelic.common.agent_http import (
     ApplicationModeClient,
     DeveloperModeClient,
     ServerlessModeClient,
 )
+from newrelic.common.encoding_utils import json_decode, json_encode
 from newrelic.core.agent_protocol import AgentProtocol, ServerlessModeProtocol
 from newrelic.core.agent_streaming import StreamingRpc
-from newrelic.core.config import global_settings
+from newrelic.core.config import finalize_application_settings, global_settings
+from newrelic.core.internal_metrics import internal_count_metric
+from newrelic.core.local_aggregator import (
+    AggregatorClient,
+    LocalAggregatorUnavailable,
+)
+from newrelic.core.payload_spool import PayloadSpool
+from newrelic.network.exceptions import (
+    DiscardDataForRequest,
+    PayloadTooLarge,
+    RetryDataForRequest,
+)
 
 _logger = logging.getLogger(__name__)
 
+# Returned in place of the response when the payload for a request could
+# not be sent in full, but that which was not sent was spooled to disk or
+# is held by the session, to be sent by a later harvest. The data has then
+# neither been sent nor is it to be retried by the caller.
+
+PAYLOAD_SPOOLED = object()
+
 
 class Session(object):
     PROTOCOL = AgentProtocol
     CLIENT = ApplicationModeClient
+    LOCAL_AGGREGATOR = False
+
+    # The endpoints for which payloads can be spooled to disk when they
+    # cannot be sent, mapped to whether the payload starts with the agent
+    # run ID. The agent run ID is not spooled, as the payload may be
+    # replayed by a later agent run.
+
+    SPOOLED_ENDPOINTS = {
+        "analytic_event_data": True,
+        "custom_event_data": True,
+        "error_event_data": True,
+        "span_event_data": True,
+        "error_data": True,
+        "transaction_sample_data": True,
+        "sql_trace_data": False,
+    }
+
+    # The number of items encoded when estimating the size of the payload
+    # for a list of items.
+
+    PAYLOAD_SIZE_SAMPLES = 16
 
     def __init__(self, app_name, linked_applications, environment, settings):
         self._protocol = self.PROTOCOL.connect(
             app_name, linked_applications, environment, settings, client_cls=self.CLIENT
         )
         self._rpc = None
+        self._spool = self._create_spool(app_name, self.configuration)
+        self._spooled = False
+        self._unsent = {}
+        self._payload_size_limits = {}
+
+    @staticmethod
+    def _create_spool(app_name, settings):
+        spool_settings = settings.payload_spool
+
+        if not spool_settings.enabled:
+            return None
+
+        # Payloads are only ever replayed for the same application and
+        # account as they were spooled for. The default spool directory
+        # is created directly within the shared temporary directory, so
+        # that it is the only directory which need be private to the user.
+
+        key = "%s:%s" % (settings.license_key, app_name)
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+        if spool_settings.directory:
+            directory = os.path.join(spool_settings.directory, digest)
+        else:
+            directory = os.path.join(
+                tempfile.gettempdir(), "newrelic-payload-spool-%s" % digest
+            )
+
+        return PayloadSpool(
+            directory,
+            max_size=spool_settings.max_size,
+            max_age=spool_settings.max_age,
+            segment_size=spool_settings.segment_size,
+        )
 
     @property
     def configuration(self):
         return self._protocol.configuration
 
+    @property
+    def server_configuration(self):
+        return self._protocol.server_configuration
+
     @property
     def agent_run_id(self):
         return self._protocol.configuration.agent_run_id
@@ -53,6 +134,261 @@ class Session(object):
     def close_connection(self):
         self._protocol.close_connection()
 
+    def _send(self, method, payload):
+        try:
+            return self._protocol.send(method, payload)
+        except RetryDataForRequest:
+            if self._spool is None or method not in self.SPOOLED_ENDPOINTS:
+                raise
+
+            if self.SPOOLED_ENDPOINTS[method]:
+                payload = payload[1:]
+
+            if not self._spool.store(method, json_encode(payload)):
+                raise
+
+            _logger.debug(
+                "Spooled %s data to %r as it could not be sent.",
+                method,
+                self._spool.directory,
+            )
+
+            self._spooled = True
+
+            return PAYLOAD_SPOOLED
+
+    @classmethod
+    def _estimate_payload_size(cls, items):
+        # Estimates the size of the encoded items from the size of an
+        # evenly spaced sample of them, allowing a separator for each.
+
+        if not items:
+            return 0
+
+        sample = items[:: max(len(items) // cls.PAYLOAD_SIZE_SAMPLES, 1)]
+        size = sum(len(json_encode(item)) + 1 for item in sample)
+
+        return size * len(items) // len(sample)
+
+    def _max_payload_size(self):
+        return self.configuration.max_payload_size_in_bytes
+
+    def _split_items(self, method, items):
+        # Splits the items into batches for which the payload is expected
+        # to be accepted, based on the size of payloads previously
+        # rejected by the data collector as being too large or, before
+        # any have been, the maximum payload size. Batches are returned
+        # as the start and end index of the items in each.
+
+        limit = self._payload_size_limits.get(method) or self._max_payload_size()
+
+        if not limit or len(items) <= 1:
+            return [(0, len(items))]
+
+        size = self._estimate_payload_size(items)
+
+        if size <= limit:
+            return [(0, len(items))]
+
+        count = min(-(-size // limit), len(items))
+        batch_size = -(-len(items) // count)
+
+        return [
+            (index, min(index + batch_size, len(items)))
+            for index in range(0, len(items), batch_size)
+        ]
+
+    @staticmethod
+    def _apportion_sampling_info(sampling_info, start, end, total):
+        # Returns the sampling info for a batch of the items, with the
+        # counts apportioned in proportion to the share of the items in
+        # the batch. The share is calculated from the index of the items
+        # so that the counts for all the batches sum to the original.
+
+        if not sampling_info or (start, end) == (0, total):
+            return sampling_info
+
+        sampling_info = dict(sampling_info)
+
+        for key in ("events_seen", "reservoir_size"):
+            value = sampling_info.get(key)
+            if value is not None:
+                sampling_info[key] = value * end // total - value * start // total
+
+        return sampling_info
+
+    def _send_items(self, method, payload, items, send=None, sampling_info=None):
+        """Sends the list of items as the last element of the payload,
+        split across as many requests as are needed for each to be of a
+        size accepted by the data collector. A batch rejected as too large
+        is halved and each half sent in turn, with the estimated size of
+        the rejected batch being remembered so that later payloads for the
+        same endpoint are split before being sent. An item which is too
+        large to be sent on its own is discarded. Where sampling info is
+        supplied, it is added to the payload before the items, with the
+        counts shared across the batches. Where a retry is requested once
+        part of the items have been sent, the remainder is held by the
+        session, to be sent by a later harvest.
+
+        """
+
+        send = send or self._send
+        items = list(items)
+        batches = self._split_items(method, items)
+
+        if len(batches) > 1:
+            internal_count_metric(
+                "Supportability/Python/Collector/SplitPayload/%s" % method,
+                len(batches) - 1,
+            )
+
+        batches.reverse()
+        sent = False
+        spooled = False
+        result = None
+
+        while batches:
+            start, end = batches.pop()
+            batch = items[start:end]
+
+            batch_payload = payload
+
+            if sampling_info is not None:
+                batch_payload += (
+                    self._apportion_sampling_info(
+                        sampling_info, start, end, len(items)
+                    ),
+                )
+
+            try:
+                result = send(method, batch_payload + (batch,))
+
+            except PayloadTooLarge:
+                if len(items) <= 1:
+                    raise
+
+                if len(batch) <= 1:
+                    _logger.debug(
+                        "Discarding %s item as it is too large to be sent.", method
+                    )
+                    continue
+
+                size = self._estimate_payload_size(batch)
+                limit = self._payload_size_limits.get(method, size)
+                self._payload_size_limits[method] = max(min(limit, size // 2), 1)
+
+                internal_count_metric(
+                    "Supportability/Python/Collector/SplitPayload/%s" % method, 1
+                )
+
+                middle = start + len(batch) // 2
+                batches.append((middle, end))
+                batches.append((start, middle))
+                continue
+
+            except RetryDataForRequest:
+                # The data cannot be retried by the caller once part of it
+                # has been accepted, as that part would then be sent twice.
+                # Only the items not yet sent are held for a later harvest,
+                # with the same payload, so that metric data is still
+                # reported for the period it was collected over. Any held
+                # back from an earlier harvest are replaced.
+
+                if not sent:
+                    raise
+
+                _logger.debug(
+                    "Holding the remainder of the %s data for a later harvest "
+                    "as only part of it could be sent.",
+                    method,
+                )
+
+                self._unsent[method] = (
+                    payload,
+                    items[start:],
+                    send,
+                    self._apportion_sampling_info(
+                        sampling_info, start, len(items), len(items)
+                    ),
+                )
+                self._spooled = True
+
+                return PAYLOAD_SPOOLED
+
+            if result is PAYLOAD_SPOOLED:
+                spooled = True
+            else:
+                sent = True
+
+        if spooled:
+            return PAYLOAD_SPOOLED
+
+        return result
+
+    def _send_unsent_items(self):
+        # Sends the remainder of the data for any endpoint which was only
+        # partly sent by an earlier harvest. Where it again cannot be
+        # sent, it is held for the next harvest.
+
+        unsent, self._unsent = self._unsent, {}
+
+        for method, (payload, items, send, sampling_info) in unsent.items():
+            try:
+                self._send_items(
+                    method, payload, items, send=send, sampling_info=sampling_info
+                )
+            except RetryDataForRequest:
+                self._unsent.setdefault(method, (payload, items, send, sampling_info))
+            except DiscardDataForRequest:
+                pass
+
+    def replay_spooled_payloads(self):
+        """Sends a limited number of payloads previously spooled to disk
+        because they could not be sent, along with the remainder of any
+        data only partly sent. Replay stops at the first payload which
+        again cannot be sent, leaving it in the spool. Nothing is replayed
+        by a harvest in which a payload was spooled or data only partly
+        sent, so payloads are only ever replayed by a later harvest.
+
+        """
+
+        if self._spooled:
+            self._spooled = False
+            return 0
+
+        self._send_unsent_items()
+
+        if self._spool is None:
+            return 0
+
+        def send(method, data):
+            if method not in self.SPOOLED_ENDPOINTS:
+                return True
+
+            payload = json_decode(data.decode("utf-8"))
+
+            if self.SPOOLED_ENDPOINTS[method]:
+                payload = [self.agent_run_id] + payload
+
+            try:
+                self._protocol.send(method, payload)
+            except RetryDataForRequest:
+                return False
+            except DiscardDataForRequest:
+                pass
+
+            return True
+
+        return self._spool.replay(
+            send, self.configuration.payload_spool.replay_limit
+        )
+
+    def spool_metrics(self):
+        if self._spool is None:
+            return ()
+
+        return self._spool.metrics()
+
     def connect_span_stream(self, span_iterator, record_metric):
         if not self._rpc:
             host = self.configuration.infinite_tracing.trace_observer_host
@@ -98,25 +434,31 @@ class Session(object):
             return
 
         payload = (self.agent_run_id, transaction_traces)
-        return self._protocol.send("transaction_sample_data", payload)
+        return self._send("transaction_sample_data", payload)
 
     def send_transaction_events(self, sampling_info, sample_set):
         """Called to submit sample set for analytics."""
 
-        payload = (self.agent_run_id, sampling_info, sample_set)
-        return self._protocol.send("analytic_event_data", payload)
+        payload = (self.agent_run_id,)
+        return self._send_items(
+            "analytic_event_data", payload, sample_set, sampling_info=sampling_info
+        )
 
     def send_custom_events(self, sampling_info, custom_event_data):
         """Called to submit sample set for custom events."""
 
-        payload = (self.agent_run_id, sampling_info, custom_event_data)
-        return self._protocol.send("custom_event_data", payload)
+        payload = (self.agent_run_id,)
+        return self._send_items(
+            "custom_event_data", payload, custom_event_data, sampling_info=sampling_info
+        )
 
     def send_span_events(self, sampling_info, span_event_data):
         """Called to submit sample set for span events."""
 
-        payload = (self.agent_run_id, sampling_info, span_event_data)
-        return self._protocol.send("span_event_data", payload)
+        payload = (self.agent_run_id,)
+        return self._send_items(
+            "span_event_data", payload, span_event_data, sampling_info=sampling_info
+        )
 
     def send_metric_data(self, start_time, end_time, metric_data):
         """Called to submit metric data for specified period of time.
@@ -125,8 +467,10 @@ class Session(object):
         specific metrics.
         """
 
-        payload = (self.agent_run_id, start_time, end_time, metric_data)
-        return self._protocol.send("metric_data", payload)
+        payload = (self.agent_run_id, start_time, end_time)
+        return self._send_items(
+            "metric_data", payload, metric_data, send=self._protocol.send
+        )
 
     def get_agent_commands(self):
         """Receive agent commands from the data collector.
@@ -146,13 +490,15 @@ class Session(object):
 
         """
         payload = (self.agent_run_id, errors)
-        return self._protocol.send("error_data", payload)
+        return self._send("error_data", payload)
 
     def send_error_events(self, sampling_info, error_data):
         """Called to submit sample set for error events."""
 
-        payload = (self.agent_run_id, sampling_info, error_data)
-        return self._protocol.send("error_event_data", payload)
+        payload = (self.agent_run_id,)
+        return self._send_items(
+            "error_event_data", payload, error_data, sampling_info=sampling_info
+        )
 
     def send_sql_traces(self, sql_traces):
         """Called to sub SQL traces. The SQL traces should be an
@@ -164,7 +510,7 @@ class Session(object):
         """
 
         payload = (sql_traces,)
-        return self._protocol.send("sql_trace_data", payload)
+        return self._send("sql_trace_data", payload)
 
     def send_agent_command_results(self, cmd_results):
         """Acknowledge the receipt of an agent command."""
@@ -209,6 +555,17 @@ class ServerlessModeSession(Session):
     PROTOCOL = ServerlessModeProtocol
     CLIENT = ServerlessModeClient
 
+    @staticmethod
+    def _create_spool(*args, **kwargs):
+        pass
+
+    @staticmethod
+    def _max_payload_size():
+        # All payloads for an endpoint are written out as one when the
+        # data is finalized, so they are never split.
+
+        pass
+
     @staticmethod
     def connect_span_stream(*args, **kwargs):
         pass
@@ -222,6 +579,114 @@ class ServerlessModeSession(Session):
         pass
 
 
+class LocalAggregatorSession(Session):
+    """Session used when reporting data via a local aggregator process.
+    The configuration for the application is obtained from the aggregator
+    and accumulated data is forwarded to it at each harvest, with the
+    aggregator being responsible for reporting it to the data collector.
+
+    """
+
+    LOCAL_AGGREGATOR = True
+
+    def __init__(self, app_name, linked_applications, environment, settings):
+        self._app_name = app_name
+        self._rpc = None
+        self._spool = None
+        self._spooled = False
+        self._unsent = {}
+
+        self._client = AggregatorClient(
+            settings.local_daemon.socket_path,
+            settings.local_daemon.timeout,
+        )
+
+        try:
+            server_configuration = self._client.request(
+                "connect",
+                app_name,
+                linked_applications,
+                settings.local_daemon.synchronous_startup,
+            )
+        except EnvironmentError as exc:
+            _logger.debug(
+                "Unable to connect to the local aggregator at %r: %s",
+                self._client.socket_path,
+                exc,
+            )
+            raise LocalAggregatorUnavailable()
+
+        # The aggregator is running, but the application has not yet
+        # registered with the data collector, so we need to try again.
+
+        if server_configuration is None:
+            self._client.close()
+            raise RetryDataForRequest()
+
+        # The configuration returned by the data collector to the
+        # aggregator is applied to the local settings in the same way as
+        # when registering with the data collector directly.
+
+        self._server_configuration = server_configuration
+        self._configuration = finalize_application_settings(
+            self.PROTOCOL._apply_high_security_mode_fixups(
+                copy.deepcopy(server_configuration), settings
+            ),
+            settings,
+        )
+
+    @property
+    def configuration(self):
+        return self._configuration
+
+    @property
+    def server_configuration(self):
+        return self._server_configuration
+
+    @property
+    def agent_run_id(self):
+        return self._configuration.agent_run_id
+
+    def close_connection(self):
+        self._client.close()
+
+    def send_forwarded_stats(self, stats, transaction_count, connections):
+        """Forwards the data held by the stats engine snapshot to the
+        local aggregator, using the SQL connections for any explain plans
+        in the transaction traces and slow SQL.
+
+        """
+
+        try:
+            merged = self._client.request(
+                "merge",
+                self._app_name,
+                stats.forwarded_data(connections),
+                transaction_count,
+            )
+        except EnvironmentError:
+            merged = False
+
+        if not merged:
+            raise RetryDataForRequest()
+
+    @staticmethod
+    def connect_span_stream(*args, **kwargs):
+        pass
+
+    @staticmethod
+    def get_agent_commands(*args, **kwargs):
+        return ()
+
+    @staticmethod
+    def shutdown_session():
+        pass
+
+    @staticmethod
+    def finalize():
+        pass
+
+
 def create_session(license_key, app_name, linked_applications, environment):
     settings = global_settings()
     if settings.serverless_mode.enabled:
@@ -232,5 +697,18 @@ def create_session(license_key, app_name, linked_applications, environment):
         return DeveloperModeSession(
             app_name, linked_applications, environment, settings
         )
-    else:
-        return Session(app_name, linked_applications, environment, settings)
+
+    if settings.local_daemon.enabled:
+        try:
+            return LocalAggregatorSession(
+                app_name, linked_applications, environment, settings
+            )
+        except LocalAggregatorUnavailable:
+            _logger.info(
+                "No local aggregator is listening on %r. Data for %r will "
+                "be reported directly to the data collector.",
+                settings.local_daemon.socket_path,
+                app_name,
+            )
+
+    return Session(app_name, linked_applications, environment, settings)
@@ -23,6 +23,7 @@ import weakref
 
 import newrelic.packages.six as six
 
+from newrelic.common.lru_cache import LRUCache
 from newrelic.core.internal_metrics import internal_metric
 from newrelic.core.config import global_settings
 
@@ -117,6 +118,98 @@ def _obfuscate_sql(sql, database):
 
     return sql
 
+# Alternate engine for obfuscation of SQL which tokenizes the statement in
+# a single pass. The patterns for quoted strings, literals and the quote
+# characters indicating a malformed query are joined into one regular
+# expression, tried in that order at each position, which produces the
+# same result as the separate substitutions and cleanup search above.
+#
+# As the literal patterns need to be case insensitive but the patterns for
+# quoted strings are not, the literal patterns are spelt out with explicit
+# character classes rather than relying on the IGNORECASE flag. Because
+# the patterns are joined, the back reference in the dollar quotes pattern
+# must also use a named group so it doesn't depend on group numbering.
+#
+# A '$' only indicates a malformed query for PostgreSQL when it would not
+# be followed by a '?' in the result of the separate substitutions. That
+# is, when it isn't already followed by a '?', a quoted string or a
+# literal.
+
+_tokenize_dollar_quotes_p = (r'(?P<dollar>\$(?!\d)[^$]*?\$)'
+        r'.*?(?:(?P=dollar)|$)')
+_tokenize_dollar_follows_p = (r'(?P<follows>\$(?!\d)[^$]*?\$)'
+        r'.*?(?:(?P=follows)|$)')
+
+_tokenize_uuid_p = r'\{?(?:[0-9a-fA-F]\-?){32}\}?'
+_tokenize_int_p = r'(?<!:)-?\b(?:[0-9]+\.)?[0-9]+(?:[eE][+-]?[0-9]+)?'
+_tokenize_hex_p = r'0[xX][0-9a-fA-F]+'
+_tokenize_bool_p = (r'\b(?:[tT][rR][uU][eE]|[fF][aA][lL][sS][eE]|'
+        r'[nN][uU][lL][lL])\b')
+
+_tokenize_literals_p = '|'.join([_tokenize_uuid_p, _tokenize_hex_p,
+        _tokenize_int_p, _tokenize_bool_p])
+
+# Oracle quoted strings start with a word character. Where one directly
+# follows a boolean literal, the separate substitutions would first have
+# replaced it with a '?', leaving a word boundary after the literal.
+
+_tokenize_oracle_bool_p = (r'\b(?:[tT][rR][uU][eE]|[fF][aA][lL][sS][eE]|'
+        r'[nN][uU][lL][lL])(?:\b|(?=%s))' % _oracle_quotes_p)
+
+_tokenize_oracle_literals_p = '|'.join([_tokenize_uuid_p, _tokenize_hex_p,
+        _tokenize_int_p, _tokenize_oracle_bool_p])
+
+_tokenize_single_dollar_cleanup_p = r"'|\$(?!\?|%s|%s|%s)" % (
+        _single_quotes_p, _tokenize_dollar_follows_p, _tokenize_literals_p)
+
+
+def _tokenize_re(quotes_p, cleanup_p, literals_p=_tokenize_literals_p):
+    return re.compile('%s|%s|(?P<malformed>%s)' % (quotes_p, literals_p,
+            cleanup_p))
+
+
+_tokenize_single_re = _tokenize_re(_single_quotes_p,
+        _single_quotes_cleanup_p)
+
+_tokenize_table = {
+    'single': _tokenize_single_re,
+    'single+double': _tokenize_re(_any_quotes_p, _any_quotes_cleanup_p),
+    'single+dollar': _tokenize_re(_single_quotes_p + '|' +
+            _tokenize_dollar_quotes_p, _tokenize_single_dollar_cleanup_p),
+    'single+oracle': _tokenize_re(_single_oracle_p,
+            _single_quotes_cleanup_p, _tokenize_oracle_literals_p),
+}
+
+
+def _obfuscate_sql_tokenized(sql, database):
+    tokenize_re = _tokenize_table.get(database.quoting_style,
+            _tokenize_single_re)
+
+    result = []
+    position = 0
+
+    for match in tokenize_re.finditer(sql):
+        if match.lastgroup == 'malformed':
+            return '?'
+
+        result.append(sql[position:match.start()])
+        result.append('?')
+
+        position = match.end()
+
+    if not result:
+        return sql
+
+    result.append(sql[position:])
+
+    return ''.join(result)
+
+
+_obfuscation_engines = {
+    'regex': _obfuscate_sql,
+    'tokenizer': _obfuscate_sql_tokenized,
+}
+
 # Normalization of the SQL is done so that when we can produce a hash
 # value for a slow SQL such that it generates the same value for two SQL
 # statements where only difference is values that may have been used.
@@ -812,64 +905,135 @@ class SQLDatabase(object):
         return result
 
 
+# The results of parsing a SQL statement only depend on the text of the
+# statement, the quoting style of the database and the engine used to
+# obfuscate the statement. As applications will
+# typically only issue a limited number of distinct statements, the
+# results are shared between instances of SQLStatement for the same
+# statement via a bounded cache. The individual results are still only
+# calculated on first use.
+
+
+class _ParsedSQL(object):
+
+    __slots__ = ('operation', 'target', 'uncommented', 'obfuscated',
+            'normalized')
+
+    def __init__(self, value=None):
+        self.operation = value
+        self.target = value
+        self.uncommented = value
+        self.obfuscated = value
+        self.normalized = value
+
+
+_sql_parse_cache = LRUCache()
+
+
 class SQLStatement(object):
 
     def __init__(self, sql, database=None):
-        self._operation = None
-        self._target = None
-        self._uncommented = None
-        self._obfuscated = None
-        self._normalized = None
         self._identifier = None
 
+        settings = global_settings()
+
         if isinstance(sql, six.binary_type):
             try:
                 sql = sql.decode('utf-8')
             except UnicodeError as e:
-                settings = global_settings()
                 if settings.debug.log_explain_plan_queries:
                     _logger.debug('An error occurred while decoding sql '
                             'statement: %s' % e.reason)
 
-                self._operation = ''
-                self._target = ''
-                self._uncommented = ''
-                self._obfuscated = ''
-                self._normalized = ''
+                self._parsed = _ParsedSQL('')
+                self._engine = None
+
+                self.sql = sql
+                self.database = database
+
+                return
 
         self.sql = sql
         self.database = database
 
+        self._parsed = self._parsed_sql(settings)
+
+    def _parsed_sql(self, settings):
+        # Returns the parse results for the statement, for the engine used
+        # to obfuscate statements given by the settings.
+
+        engine = self._engine = \
+                settings.transaction_tracer.sql_obfuscation_engine
+
+        # Very long statements are not cached so that the memory used by
+        # the cache stays bounded.
+
+        sql = self.sql
+        cache_size = settings.agent_limits.sql_statement_cache_size
+
+        if (not cache_size or not isinstance(sql, six.string_types) or
+                len(sql) > settings.agent_limits.sql_query_length_maximum):
+            return _ParsedSQL()
+
+        key = (sql, getattr(self.database, 'quoting_style', None), engine)
+
+        parsed = _sql_parse_cache.get(key)
+
+        if parsed is None:
+            parsed = _ParsedSQL()
+
+            _sql_parse_cache.maxsize = cache_size
+            _sql_parse_cache.put(key, parsed)
+
+        return parsed
+
     @property
     def operation(self):
-        if self._operation is None:
-            self._operation = _parse_operation(self.uncommented)
-        return self._operation
+        parsed = self._parsed
+        if parsed.operation is None:
+            parsed.operation = _parse_operation(self.uncommented)
+        return parsed.operation
 
     @property
     def target(self):
-        if self._target is None:
-            self._target = _parse_target(self.uncommented, self.operation)
-        return self._target
+        parsed = self._parsed
+        if parsed.target is None:
+            parsed.target = _parse_target(self.uncommented, self.operation)
+        return parsed.target
 
     @property
     def uncommented(self):
-        if self._uncommented is None:
-            self._uncommented = _uncomment_sql(self.sql)
-        return self._uncommented
+        parsed = self._parsed
+        if parsed.uncommented is None:
+            parsed.uncommented = _uncomment_sql(self.sql)
+        return parsed.uncommented
 
     @property
     def obfuscated(self):
-        if self._obfuscated is None:
-            self._obfuscated = _uncomment_sql(_obfuscate_sql(self.sql,
+        # Where the obfuscation engine has been changed since the parse
+        # results were looked up, those for the new engine are used.
+
+        settings = global_settings()
+        engine = settings.transaction_tracer.sql_obfuscation_engine
+
+        if self._engine is not None and engine != self._engine:
+            self._parsed = self._parsed_sql(settings)
+            self._identifier = None
+
+        parsed = self._parsed
+        if parsed.obfuscated is None:
+            obfuscate_sql = _obfuscation_engines.get(engine, _obfuscate_sql)
+            parsed.obfuscated = _uncomment_sql(obfuscate_sql(self.sql,
                 self.database))
-        return self._obfuscated
+        return parsed.obfuscated
 
     @property
     def normalized(self):
-        if self._normalized is None:
-            self._normalized = _normalize_sql(self.obfuscated)
-        return self._normalized
+        obfuscated = self.obfuscated
+        parsed = self._parsed
+        if parsed.normalized is None:
+            parsed.normalized = _normalize_sql(obfuscated)
+        return parsed.normalized
 
     @property
     def identifier(self):
@@ -0,0 +1,92 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module implements the calculation of the times at which the
+harvests of the agent are run.
+
+"""
+
+import os
+import random
+import zlib
+
+from newrelic.common.system_info import gethostname
+
+
+def process_offset():
+    """Returns a fraction between 0 and 1 which is stable for the life of
+    the process but differs between processes, even those started at the
+    same time on the same host.
+
+    """
+
+    key = "%s:%d" % (gethostname(), os.getpid())
+    return (zlib.crc32(key.encode("utf-8")) & 0xFFFFFFFF) / float(1 << 32)
+
+
+class HarvestSchedule(object):
+    """Calculates the time of each harvest run with a fixed period.
+
+    When staggered, harvests are run at times which are a whole number of
+    periods from an offset within the period, the offset being derived
+    from the host and process. Processes started together, such as the
+    workers of a web server after a deploy, therefore harvest at different
+    points within each period rather than all at once. Each harvest is
+    scheduled relative to the time the previous harvest was due rather
+    than when it ran, so that neither delays in waking the harvest thread
+    nor the time spent harvesting cause harvests to drift. Any jitter is
+    applied afresh to each harvest for the same reason.
+
+    When not staggered, each harvest is run one period after the previous
+    harvest was started.
+
+    """
+
+    def __init__(self, staggered=True, jitter=0.0, offset=None):
+        self.staggered = staggered
+        self.jitter = jitter
+        self.offset = process_offset() if offset is None else offset
+        self.due = None
+
+    def next_time(self, period, now):
+        """Returns the time at which the next harvest should be run, given
+        the period of the harvest and the current time.
+
+        """
+
+        if not self.staggered:
+            return now + period
+
+        phase = self.offset * period
+        due = (now - phase) // period * period + phase + period
+
+        # If the harvest thread was woken slightly before the time the
+        # last harvest was due, the calculation above yields that same
+        # time again, so the next harvest is always at least one period
+        # after the last one.
+
+        if self.due is not None:
+            due = max(due, self.due + period)
+
+        self.due = due
+
+        # The jitter is capped so there is still only one harvest in any
+        # one period.
+
+        jitter = min(self.jitter, period / 2.0)
+
+        if jitter > 0.0:
+            return due + random.uniform(0.0, jitter)
+
+        return due
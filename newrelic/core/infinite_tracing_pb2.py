@@ -29,7 +29,7 @@ else:
     package='com.newrelic.trace.v1',
     syntax='proto3',
     serialized_options=None,
-    serialized_pb=b'\n\x16infinite_tracing.proto\x12\x15\x63om.newrelic.trace.v1\"\x86\x04\n\x04Span\x12\x10\n\x08trace_id\x18\x01 \x01(\t\x12?\n\nintrinsics\x18\x02 \x03(\x0b\x32+.com.newrelic.trace.v1.Span.IntrinsicsEntry\x12H\n\x0fuser_attributes\x18\x03 \x03(\x0b\x32/.com.newrelic.trace.v1.Span.UserAttributesEntry\x12J\n\x10\x61gent_attributes\x18\x04 \x03(\x0b\x32\x30.com.newrelic.trace.v1.Span.AgentAttributesEntry\x1aX\n\x0fIntrinsicsEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\x34\n\x05value\x18\x02 \x01(\x0b\x32%.com.newrelic.trace.v1.AttributeValue:\x02\x38\x01\x1a\\\n\x13UserAttributesEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\x34\n\x05value\x18\x02 \x01(\x0b\x32%.com.newrelic.trace.v1.AttributeValue:\x02\x38\x01\x1a]\n\x14\x41gentAttributesEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\x34\n\x05value\x18\x02 \x01(\x0b\x32%.com.newrelic.trace.v1.AttributeValue:\x02\x38\x01\"t\n\x0e\x41ttributeValue\x12\x16\n\x0cstring_value\x18\x01 \x01(\tH\x00\x12\x14\n\nbool_value\x18\x02 \x01(\x08H\x00\x12\x13\n\tint_value\x18\x03 \x01(\x03H\x00\x12\x16\n\x0c\x64ouble_value\x18\x04 \x01(\x01H\x00\x42\x07\n\x05value\"%\n\x0cRecordStatus\x12\x15\n\rmessages_seen\x18\x01 \x01(\x04\x32\x65\n\rIngestService\x12T\n\nRecordSpan\x12\x1b.com.newrelic.trace.v1.Span\x1a#.com.newrelic.trace.v1.RecordStatus\"\x00(\x01\x30\x01\x62\x06proto3'
+    serialized_pb=b'\n\x16infinite_tracing.proto\x12\x15com.newrelic.trace.v1"\x86\x04\n\x04Span\x12\x10\n\x08trace_id\x18\x01 \x01(\t\x12?\n\nintrinsics\x18\x02 \x03(\x0b2+.com.newrelic.trace.v1.Span.IntrinsicsEntry\x12H\n\x0fuser_attributes\x18\x03 \x03(\x0b2/.com.newrelic.trace.v1.Span.UserAttributesEntry\x12J\n\x10agent_attributes\x18\x04 \x03(\x0b20.com.newrelic.trace.v1.Span.AgentAttributesEntry\x1aX\n\x0fIntrinsicsEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x124\n\x05value\x18\x02 \x01(\x0b2%.com.newrelic.trace.v1.AttributeValue:\x028\x01\x1a\\\n\x13UserAttributesEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x124\n\x05value\x18\x02 \x01(\x0b2%.com.newrelic.trace.v1.AttributeValue:\x028\x01\x1a]\n\x14AgentAttributesEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x124\n\x05value\x18\x02 \x01(\x0b2%.com.newrelic.trace.v1.AttributeValue:\x028\x01"t\n\x0eAttributeValue\x12\x16\n\x0cstring_value\x18\x01 \x01(\tH\x00\x12\x14\n\nbool_value\x18\x02 \x01(\x08H\x00\x12\x13\n\tint_value\x18\x03 \x01(\x03H\x00\x12\x16\n\x0cdouble_value\x18\x04 \x01(\x01H\x00B\x07\n\x05value"%\n\x0cRecordStatus\x12\x15\n\rmessages_seen\x18\x01 \x01(\x04"7\n\tSpanBatch\x12*\n\x05spans\x18\x01 \x03(\x0b2\x1b.com.newrelic.trace.v1.Span2\xc5\x01\n\rIngestService\x12T\n\nRecordSpan\x12\x1b.com.newrelic.trace.v1.Span\x1a#.com.newrelic.trace.v1.RecordStatus"\x00(\x010\x01\x12^\n\x0fRecordSpanBatch\x12 .com.newrelic.trace.v1.SpanBatch\x1a#.com.newrelic.trace.v1.RecordStatus"\x00(\x010\x01b\x06proto3'
   )
 
 
@@ -283,6 +283,37 @@ else:
     serialized_end=725,
   )
 
+
+  _SPANBATCH = _descriptor.Descriptor(
+    name='SpanBatch',
+    full_name='com.newrelic.trace.v1.SpanBatch',
+    filename=None,
+    file=DESCRIPTOR,
+    containing_type=None,
+    fields=[
+      _descriptor.FieldDescriptor(
+        name='spans', full_name='com.newrelic.trace.v1.SpanBatch.spans', index=0,
+        number=1, type=11, cpp_type=10, label=3,
+        has_default_value=False, default_value=[],
+        message_type=None, enum_type=None, containing_type=None,
+        is_extension=False, extension_scope=None,
+        serialized_options=None, file=DESCRIPTOR),
+    ],
+    extensions=[
+    ],
+    nested_types=[],
+    enum_types=[
+    ],
+    serialized_options=None,
+    is_extendable=False,
+    syntax='proto3',
+    extension_ranges=[],
+    oneofs=[
+    ],
+    serialized_start=727,
+    serialized_end=782,
+  )
+
   _SPAN_INTRINSICSENTRY.fields_by_name['value'].message_type = _ATTRIBUTEVALUE
   _SPAN_INTRINSICSENTRY.containing_type = _SPAN
   _SPAN_USERATTRIBUTESENTRY.fields_by_name['value'].message_type = _ATTRIBUTEVALUE
@@ -306,7 +337,9 @@ else:
   _ATTRIBUTEVALUE.fields_by_name['double_value'].containing_oneof = _ATTRIBUTEVALUE.oneofs_by_name['value']
   DESCRIPTOR.message_types_by_name['Span'] = _SPAN
   DESCRIPTOR.message_types_by_name['AttributeValue'] = _ATTRIBUTEVALUE
+  _SPANBATCH.fields_by_name['spans'].message_type = _SPAN
   DESCRIPTOR.message_types_by_name['RecordStatus'] = _RECORDSTATUS
+  DESCRIPTOR.message_types_by_name['SpanBatch'] = _SPANBATCH
   _sym_db.RegisterFileDescriptor(DESCRIPTOR)
 
   Span = _reflection.GeneratedProtocolMessageType('Span', (_message.Message,), {
@@ -354,6 +387,13 @@ else:
     })
   _sym_db.RegisterMessage(RecordStatus)
 
+  SpanBatch = _reflection.GeneratedProtocolMessageType('SpanBatch', (_message.Message,), {
+    'DESCRIPTOR' : _SPANBATCH,
+    '__module__' : 'infinite_tracing_pb2'
+    # @@protoc_insertion_point(class_scope:com.newrelic.trace.v1.SpanBatch)
+    })
+  _sym_db.RegisterMessage(SpanBatch)
+
 
   _SPAN_INTRINSICSENTRY._options = None
   _SPAN_USERATTRIBUTESENTRY._options = None
@@ -365,8 +405,8 @@ else:
     file=DESCRIPTOR,
     index=0,
     serialized_options=None,
-    serialized_start=727,
-    serialized_end=828,
+    serialized_start=785,
+    serialized_end=982,
     methods=[
     _descriptor.MethodDescriptor(
       name='RecordSpan',
@@ -377,6 +417,15 @@ else:
       output_type=_RECORDSTATUS,
       serialized_options=None,
     ),
+    _descriptor.MethodDescriptor(
+      name='RecordSpanBatch',
+      full_name='com.newrelic.trace.v1.IngestService.RecordSpanBatch',
+      index=1,
+      containing_service=None,
+      input_type=_SPANBATCH,
+      output_type=_RECORDSTATUS,
+      serialized_options=None,
+    ),
   ])
   _sym_db.RegisterServiceDescriptor(_INGESTSERVICE)
 
@@ -0,0 +1,377 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module implements the transport between processes reporting data
+via a local aggregator and the aggregator process itself.
+
+The aggregator process runs the agent as normal, registering each
+application with the data collector, but also listens on a UNIX domain
+socket. Processes using the aggregator obtain the configuration for an
+application from the aggregator rather than registering it with the
+data collector themselves, and at each harvest forward the data they
+have accumulated to the aggregator. The aggregator merges the data from
+all processes into the stats engine of the application and reports it
+to the data collector in its own harvest.
+
+Messages are encoded as JSON. The socket is created in a directory which
+must be private to the user the aggregator process runs as, and both ends
+of a connection check that the other is running as that same user.
+
+"""
+
+import errno
+import logging
+import os
+import socket
+import stat
+import struct
+import tempfile
+import threading
+
+from newrelic.packages.six.moves import socketserver
+
+from newrelic.common.encoding_utils import json_decode, json_encode
+from newrelic.network.exceptions import NetworkInterfaceException
+
+_logger = logging.getLogger(__name__)
+
+_LENGTH = struct.Struct('!I')
+
+_PEERCRED = struct.Struct('3i')
+
+
+class LocalAggregatorUnavailable(NetworkInterfaceException):
+    pass
+
+
+def _recv_exactly(sock, length):
+    chunks = []
+
+    while length:
+        chunk = sock.recv(min(length, 65536))
+        if not chunk:
+            raise socket.error('Connection closed by peer.')
+        chunks.append(chunk)
+        length -= len(chunk)
+
+    return b''.join(chunks)
+
+
+def send_message(sock, message):
+    data = json_encode(message).encode('utf-8')
+    sock.sendall(_LENGTH.pack(len(data)) + data)
+
+
+def recv_message(sock):
+    length, = _LENGTH.unpack(_recv_exactly(sock, _LENGTH.size))
+    return json_decode(_recv_exactly(sock, length).decode('utf-8'))
+
+
+def default_socket_path():
+    """Returns the path of the socket used when none is configured, which
+    is within a directory of the temporary directory specific to the user.
+
+    """
+
+    return os.path.join(tempfile.gettempdir(),
+            'newrelic-%d' % os.getuid(), 'aggregator.sock')
+
+
+def _insecure(message, path):
+    return EnvironmentError(errno.EACCES, message % path)
+
+
+def check_socket_directory(directory):
+    """Raises an EnvironmentError unless the directory is owned by the
+    current user and is not accessible to any other user, as otherwise
+    another user could substitute a socket of their own.
+
+    """
+
+    info = os.lstat(directory)
+
+    if not stat.S_ISDIR(info.st_mode):
+        raise _insecure('The local aggregator socket directory %r is not '
+                'a directory.', directory)
+
+    if info.st_uid != os.getuid():
+        raise _insecure('The local aggregator socket directory %r is not '
+                'owned by the current user.', directory)
+
+    if info.st_mode & 0o077:
+        raise _insecure('The local aggregator socket directory %r is '
+                'accessible to other users.', directory)
+
+
+def check_peer(sock):
+    """Raises an EnvironmentError if the process at the other end of the
+    connected UNIX domain socket is not running as the current user. The
+    check relies on SO_PEERCRED, so is skipped on platforms without it,
+    where the permissions of the socket directory are relied upon alone.
+
+    """
+
+    peercred = getattr(socket, 'SO_PEERCRED', None)
+
+    if peercred is None:
+        return
+
+    _, uid, _ = _PEERCRED.unpack(sock.getsockopt(socket.SOL_SOCKET,
+            peercred, _PEERCRED.size))
+
+    if uid != os.getuid():
+        raise EnvironmentError(errno.EACCES, 'The local aggregator peer is '
+                'running as user %d rather than the current user.' % uid)
+
+
+class AggregatorClient(object):
+
+    """Client for making requests of the local aggregator. Requests are
+    serialized over a single connection, which is established on demand
+    and re-established after any error.
+
+    """
+
+    def __init__(self, socket_path, timeout=None):
+        self._socket_path = socket_path or default_socket_path()
+        self._timeout = timeout
+        self._sock = None
+        self._lock = threading.Lock()
+
+    @property
+    def socket_path(self):
+        return self._socket_path
+
+    def _connect(self):
+        check_socket_directory(os.path.dirname(
+                os.path.abspath(self._socket_path)))
+
+        info = os.lstat(self._socket_path)
+
+        if not stat.S_ISSOCK(info.st_mode) or info.st_uid != os.getuid():
+            raise _insecure('The local aggregator socket %r is not a socket '
+                    'owned by the current user.', self._socket_path)
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self._timeout)
+
+        try:
+            sock.connect(self._socket_path)
+            check_peer(sock)
+        except Exception:
+            sock.close()
+            raise
+
+        return sock
+
+    def request(self, command, *args):
+        """Sends the command to the aggregator and returns the result.
+        Raises socket.error or an equivalent environment error if the
+        aggregator could not be reached.
+
+        """
+
+        with self._lock:
+            try:
+                if self._sock is None:
+                    self._sock = self._connect()
+
+                send_message(self._sock, (command, args))
+                return recv_message(self._sock)
+
+            except Exception:
+                self._close()
+                raise
+
+    def _close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except Exception:
+                pass
+            self._sock = None
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+class _AggregatorRequestHandler(socketserver.BaseRequestHandler):
+
+    def setup(self):
+        with self.server.connections_lock:
+            self.server.connections.add(self.request)
+
+    def finish(self):
+        with self.server.connections_lock:
+            self.server.connections.discard(self.request)
+
+    def handle(self):
+        try:
+            check_peer(self.request)
+        except EnvironmentError:
+            _logger.warning('Rejected a connection to the local aggregator '
+                    'from a process running as a different user.')
+            return
+
+        while True:
+            try:
+                command, args = recv_message(self.request)
+            except (EnvironmentError, EOFError, ValueError):
+                return
+
+            try:
+                handler = getattr(self.server.aggregator, 'cmd_' + command)
+                result = handler(*args)
+
+            except Exception:
+                _logger.exception('Unable to process the %r request made '
+                        'of the local aggregator. Please report this '
+                        'problem to New Relic support for further '
+                        'investigation.', command)
+
+                result = None
+
+            try:
+                send_message(self.request, result)
+            except EnvironmentError:
+                return
+
+
+class _AggregatorServer(socketserver.ThreadingMixIn,
+        socketserver.UnixStreamServer):
+
+    daemon_threads = True
+
+    def __init__(self, *args, **kwargs):
+        socketserver.UnixStreamServer.__init__(self, *args, **kwargs)
+        self.connections = set()
+        self.connections_lock = threading.Lock()
+
+    def close_connections(self):
+        with self.connections_lock:
+            connections = list(self.connections)
+
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except EnvironmentError:
+                pass
+
+
+class LocalAggregator(object):
+
+    """Listens on a UNIX domain socket for data forwarded from other
+    processes and merges it into the applications of the agent in this
+    process.
+
+    """
+
+    def __init__(self, socket_path, agent=None, startup_timeout=10.0):
+        self._socket_path = socket_path or default_socket_path()
+        self._agent = agent
+        self._startup_timeout = startup_timeout
+        self._server = None
+        self._thread = None
+
+    @property
+    def agent(self):
+        if self._agent is None:
+            from newrelic.core.agent import agent_instance
+            self._agent = agent_instance()
+        return self._agent
+
+    def start(self):
+        directory = os.path.dirname(os.path.abspath(self._socket_path))
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+
+        check_socket_directory(directory)
+
+        # A socket file left behind by a prior aggregator process which
+        # exited uncleanly would prevent us from binding the socket. As
+        # the directory is private, it can only have been left by us.
+
+        if os.path.lexists(self._socket_path):
+            os.remove(self._socket_path)
+
+        # The socket is created with permissions which make it accessible
+        # only to this user from the outset. The umask applies to the
+        # whole process, so is restored as soon as the socket is bound.
+
+        umask = os.umask(0o177)
+
+        try:
+            self._server = _AggregatorServer(self._socket_path,
+                    _AggregatorRequestHandler)
+        finally:
+            os.umask(umask)
+
+        self._server.aggregator = self
+
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                name='NR-Local-Aggregator')
+        self._thread.daemon = True
+        self._thread.start()
+
+        _logger.info('Local aggregator listening on %r.', self._socket_path)
+
+    def stop(self):
+        if self._server is None:
+            return
+
+        self._server.shutdown()
+        self._server.server_close()
+        self._server.close_connections()
+        self._thread.join()
+
+        self._server = None
+        self._thread = None
+
+        try:
+            os.remove(self._socket_path)
+        except OSError:
+            pass
+
+    def cmd_connect(self, app_name, linked_applications, wait):
+        """Activates the application if necessary and returns the
+        configuration the data collector returned when it was registered,
+        or None if it has not yet registered with the data collector.
+
+        """
+
+        timeout = self._startup_timeout if wait else 0.0
+
+        self.agent.activate_application(app_name, linked_applications,
+                timeout=timeout)
+
+        application = self.agent.application(app_name)
+
+        return application and application.server_configuration
+
+    def cmd_merge(self, app_name, data, transaction_count):
+        """Merges data forwarded from another process into the stats
+        engine of the application. Returns False if the application is
+        not currently active, in which case the data is retained by the
+        process which forwarded it.
+
+        """
+
+        application = self.agent.application(app_name)
+
+        if application is None:
+            return False
+
+        return application.merge_forwarded_stats(data, transaction_count)
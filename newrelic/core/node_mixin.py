@@ -14,22 +14,84 @@
 
 import newrelic.core.attribute as attribute
 
+from newrelic.common.encoding_utils import generate_guid
+from newrelic.common.overlay_dict import OverlayDict
 from newrelic.core.attribute_filter import (DST_SPAN_EVENTS,
         DST_TRANSACTION_SEGMENTS)
 
 
+# Fields of a node which vary between otherwise identical segments, and
+# which are therefore ignored when deciding whether a node can be merged
+# into the node of the preceding sibling segment.
+
+_AGGREGATE_IGNORED_FIELDS = frozenset(('children', 'start_time', 'end_time',
+        'duration', 'exclusive', 'guid'))
+
+
 class GenericNodeMixin(object):
     @property
-    def processed_user_attributes(self):
-        if hasattr(self, '_processed_user_attributes'):
-            return self._processed_user_attributes
+    def aggregate_end_time(self):
+        aggregate = getattr(self, '_aggregate', None)
+        return aggregate and aggregate[5] or self.end_time
+
+    def can_aggregate(self, node):
+        """Returns whether the node is for a segment identical to that of
+        this node, such that it can be merged into this node. A node for
+        which a guid has been generated is never merged, as the guid may
+        already have been referred to, such as by the headers of an
+        outbound request or by an error.
+
+        """
+
+        if type(node) is not type(self) or self.children or node.children:
+            return False
+
+        if node.guid is not None:
+            return False
+
+        for name, value, other in zip(self._fields, self, node):
+            if name not in _AGGREGATE_IGNORED_FIELDS and value != other:
+                return False
+
+        return True
+
+    def aggregate(self, node):
+        """Merges the timing of the node for an identical segment into
+        this node. Only the call count, the total and exclusive durations,
+        the minimum and maximum durations, and the end time of the last
+        call are kept.
+
+        """
+
+        aggregate = getattr(self, '_aggregate', None)
+        if aggregate is None:
+            aggregate = self._aggregate = [1, self.duration, self.exclusive,
+                    self.duration, self.duration, self.end_time]
+
+        duration = node.duration
+
+        aggregate[0] += 1
+        aggregate[1] += duration
+        aggregate[2] += node.exclusive
+        aggregate[3] = min(aggregate[3], duration)
+        aggregate[4] = max(aggregate[4], duration)
+        aggregate[5] = max(aggregate[5], node.end_time)
+
+    def resolved_user_attributes(self, attribute_filter):
+        """Returns the user attributes of the node as a list of attributes,
+        each validated, truncated and tagged with its destinations. This is
+        done once per node, with each output destination then selecting the
+        attributes by their destinations.
+
+        """
 
-        self._processed_user_attributes = u_attrs = {}
-        user_attributes = getattr(self, 'user_attributes', u_attrs)
-        for k, v in user_attributes.items():
-            k, v = attribute.process_user_attribute(k, v)
-            u_attrs[k] = v
-        return u_attrs
+        resolved = getattr(self, '_resolved_user_attributes', None)
+        if resolved is None:
+            resolved = self._resolved_user_attributes = \
+                    attribute.process_user_attributes(
+                            getattr(self, 'user_attributes', {}),
+                            attribute_filter)
+        return resolved
 
     def get_trace_segment_params(self, settings, params=None):
         _params = attribute.resolve_agent_attributes(
@@ -40,12 +102,19 @@ class GenericNodeMixin(object):
         if params:
             _params.update(params)
 
-        _params.update(attribute.resolve_user_attributes(
-                self.processed_user_attributes,
-                settings.attribute_filter,
+        _params.update(attribute.filter_attributes(
+                self.resolved_user_attributes(settings.attribute_filter),
                 DST_TRANSACTION_SEGMENTS))
 
-        _params['exclusive_duration_millis'] = 1000.0 * self.exclusive
+        aggregate = getattr(self, '_aggregate', None)
+        if aggregate:
+            _params['call_count'] = aggregate[0]
+            _params['min_duration_millis'] = 1000.0 * aggregate[3]
+            _params['max_duration_millis'] = 1000.0 * aggregate[4]
+            _params['exclusive_duration_millis'] = 1000.0 * aggregate[2]
+        else:
+            _params['exclusive_duration_millis'] = 1000.0 * self.exclusive
+
         return _params
 
     def span_event(
@@ -53,13 +122,28 @@ class GenericNodeMixin(object):
                 settings,
                 base_attrs=None,
                 parent_guid=None,
-                attr_class=dict):
-        i_attrs = base_attrs and base_attrs.copy() or attr_class()
-        i_attrs['type'] = 'Span'
+                attr_class=dict,
+                guid=None):
+        # The intrinsics common to all span events of the transaction are
+        # held once in the base attributes, which the intrinsics of each
+        # span event overlay rather than copy.
+
+        i_attrs = attr_class()
+        if not base_attrs:
+            i_attrs['type'] = 'Span'
         i_attrs['name'] = self.name
-        i_attrs['guid'] = self.guid
+        i_attrs['guid'] = guid or self.guid
         i_attrs['timestamp'] = int(self.start_time * 1000)
-        i_attrs['duration'] = self.duration
+
+        aggregate = getattr(self, '_aggregate', None)
+        if aggregate:
+            i_attrs['duration'] = aggregate[1]
+            i_attrs['nr.callCount'] = aggregate[0]
+            i_attrs['nr.minDuration'] = aggregate[3]
+            i_attrs['nr.maxDuration'] = aggregate[4]
+        else:
+            i_attrs['duration'] = self.duration
+
         i_attrs['category'] = 'generic'
 
         if parent_guid:
@@ -71,29 +155,49 @@ class GenericNodeMixin(object):
                 DST_SPAN_EVENTS,
                 attr_class=attr_class)
 
-        u_attrs = attribute.resolve_user_attributes(
-                self.processed_user_attributes,
-                settings.attribute_filter,
+        u_attrs = attribute.filter_attributes(
+                self.resolved_user_attributes(settings.attribute_filter),
                 DST_SPAN_EVENTS,
                 attr_class=attr_class)
 
+        if base_attrs:
+            i_attrs = OverlayDict(base_attrs, i_attrs)
+
         # intrinsics, user attrs, agent attrs
         return [i_attrs, u_attrs, a_attrs]
 
+    def span_count(self):
+        """Returns the number of span events which would be generated
+        for this node and its children, without creating them.
+
+        """
+
+        count = 1
+        for child in self.children:
+            count += child.span_count()
+        return count
+
     def span_events(self,
             settings, base_attrs=None, parent_guid=None, attr_class=dict):
 
+        # The guid of a trace is only generated if it was requested while
+        # the trace was active. Otherwise generate it now, so the span
+        # event and its children all refer to the same guid.
+
+        guid = self.guid or generate_guid()
+
         yield self.span_event(
                 settings,
                 base_attrs=base_attrs,
                 parent_guid=parent_guid,
-                attr_class=attr_class)
+                attr_class=attr_class,
+                guid=guid)
 
         for child in self.children:
             for event in child.span_events(
                     settings,
                     base_attrs=base_attrs,
-                    parent_guid=self.guid,
+                    parent_guid=guid,
                     attr_class=attr_class):
                 yield event
 
@@ -0,0 +1,412 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module implements a bounded on disk spool for payloads which
+could not be sent to the data collector, so they can be replayed once
+the data collector is reachable again.
+
+Payloads are appended as compressed records to segment files. Each
+process appends to its own active segment, which is sealed once it
+reaches the segment size or before being replayed. Sealed segments are
+claimed for replay by renaming them, so where the spool directory is
+shared by multiple processes, each segment is only replayed once.
+
+As payloads include request and user attributes, and payloads found in
+the spool are replayed to the data collector, the spool directory and
+segment files are only made accessible to the user the process runs as,
+and a spool directory which is owned by or accessible to another user is
+not used.
+
+"""
+
+import logging
+import os
+import stat
+import struct
+import threading
+import time
+import zlib
+
+_logger = logging.getLogger(__name__)
+
+ACTIVE_SUFFIX = '.active'
+SEALED_SUFFIX = '.seg'
+CLAIMED_SUFFIX = '.replay'
+
+# Each record consists of a header giving the time the payload was
+# spooled, and the lengths of the endpoint name and of the compressed
+# payload, followed by the endpoint name and compressed payload.
+
+_HEADER = struct.Struct('!dII')
+
+# An active segment belonging to another process which has not been
+# written to for this long is assumed to have been abandoned by a
+# process which exited without sealing it.
+
+ABANDONED_SEGMENT_AGE = 300.0
+
+
+def _read_records(path):
+    records = []
+
+    with open(path, 'rb') as fp:
+        while True:
+            header = fp.read(_HEADER.size)
+
+            # A truncated record can only occur at the end of a segment
+            # where a process was killed part way through a write.
+
+            if len(header) < _HEADER.size:
+                break
+
+            timestamp, method_length, data_length = _HEADER.unpack(header)
+
+            method = fp.read(method_length)
+            data = fp.read(data_length)
+
+            if len(method) < method_length or len(data) < data_length:
+                break
+
+            records.append((timestamp, method.decode('utf-8'), data))
+
+    return records
+
+
+def _open_segment(path, mode):
+    # Opens the segment file for writing, creating it if necessary such
+    # that it is only accessible to the current user.
+
+    flags = os.O_WRONLY | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+    flags |= os.O_APPEND if mode == 'ab' else os.O_TRUNC
+
+    return os.fdopen(os.open(path, flags, 0o600), mode)
+
+
+def _write_records(fp, records):
+    for timestamp, method, data in records:
+        method = method.encode('utf-8')
+        fp.write(_HEADER.pack(timestamp, len(method), len(data)))
+        fp.write(method)
+        fp.write(data)
+
+
+class PayloadSpool(object):
+
+    """Persists payloads for endpoints of the data collector to append
+    only segment files in a directory. The total size of the spool is
+    capped, with the oldest segments being evicted to make room for
+    new payloads, and payloads older than the maximum age are
+    discarded.
+
+    """
+
+    def __init__(self, directory, max_size=50 * 1024 * 1024,
+            max_age=3600.0, segment_size=1024 * 1024,
+            compression_level=6):
+        self._directory = directory
+        self._max_size = max_size
+        self._max_age = max_age
+        self._segment_size = segment_size
+        self._compression_level = compression_level
+
+        self._lock = threading.Lock()
+        self._active_path = None
+        self._active_size = 0
+        self._sequence = 0
+        self._insecure = False
+
+        self._stored = 0
+        self._replayed = 0
+        self._evicted = 0
+        self._dropped = 0
+
+    @property
+    def directory(self):
+        return self._directory
+
+    def _segment_name(self, suffix):
+        self._sequence += 1
+        return os.path.join(self._directory, '%016d-%010d-%d%s' % (
+                int(time.time() * 1000), self._sequence, os.getpid(),
+                suffix))
+
+    def _segments(self):
+        try:
+            names = os.listdir(self._directory)
+        except OSError:
+            return []
+
+        segments = []
+
+        for name in names:
+            path = os.path.join(self._directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            segments.append((stat.st_mtime, stat.st_size, name, path))
+
+        segments.sort(key=lambda segment: segment[2])
+
+        return segments
+
+    def _check_directory(self):
+        # Returns whether the spool directory is owned by the current user
+        # and is not accessible to any other user, who could otherwise read
+        # the payloads or plant payloads of their own to be replayed. This
+        # cannot be checked on platforms without user ids, such as Windows.
+
+        getuid = getattr(os, 'getuid', None)
+
+        if getuid is None:
+            return True
+
+        info = os.lstat(self._directory)
+
+        if (stat.S_ISDIR(info.st_mode) and info.st_uid == getuid() and
+                not info.st_mode & 0o077):
+            return True
+
+        if not self._insecure:
+            _logger.warning('The payload spool directory %r is not being '
+                    'used as it is owned by or accessible to another user.',
+                    self._directory)
+            self._insecure = True
+
+        return False
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _seal(self):
+        # Must be called with the lock held.
+
+        if self._active_path is None:
+            return
+
+        active_path = self._active_path
+
+        self._active_path = None
+        self._active_size = 0
+
+        try:
+            os.rename(active_path, active_path[:-len(ACTIVE_SUFFIX)] +
+                    SEALED_SUFFIX)
+        except OSError:
+            pass
+
+    def _evict(self, required=0):
+        # Must be called with the lock held. Removes segments which are
+        # older than the maximum age and then, oldest first, segments
+        # from other processes or which have already been sealed until
+        # there is room for the required number of bytes. Returns
+        # whether there is then enough room.
+
+        now = time.time()
+        total = 0
+        candidates = []
+
+        for mtime, size, name, path in self._segments():
+            if now - mtime > self._max_age:
+                self._remove(path)
+                self._evicted += 1
+                continue
+
+            total += size
+
+            if path != self._active_path:
+                candidates.append((size, path))
+
+        for size, path in candidates:
+            if total + required <= self._max_size:
+                break
+
+            self._remove(path)
+            self._evicted += 1
+            total -= size
+
+        return total + required <= self._max_size
+
+    def store(self, method, data):
+        """Appends the encoded payload for the endpoint to the spool.
+        Returns True if the payload was stored, or False if it could
+        not be, in which case the caller remains responsible for it.
+
+        """
+
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+
+        data = zlib.compress(data, self._compression_level)
+        required = _HEADER.size + len(method) + len(data)
+
+        with self._lock:
+            try:
+                if not os.path.isdir(self._directory):
+                    os.makedirs(self._directory, 0o700)
+
+                if not self._check_directory():
+                    self._dropped += 1
+                    return False
+
+                if not self._evict(required):
+                    self._dropped += 1
+                    return False
+
+                if (self._active_path is None or
+                        not os.path.exists(self._active_path)):
+                    self._active_path = self._segment_name(ACTIVE_SUFFIX)
+                    self._active_size = 0
+
+                with _open_segment(self._active_path, 'ab') as fp:
+                    _write_records(fp, [(time.time(), method, data)])
+
+                self._active_size += required
+
+                if self._active_size >= self._segment_size:
+                    self._seal()
+
+            except (IOError, OSError):
+                _logger.exception('Unable to write payload for %r to the '
+                        'spool directory %r.', method, self._directory)
+
+                self._dropped += 1
+                return False
+
+            self._stored += 1
+
+        return True
+
+    def _claim(self):
+        # Must be called with the lock held. Claims the oldest segment
+        # which is ready for replay by renaming it, which will fail if
+        # another process has claimed it first.
+
+        self._seal()
+
+        now = time.time()
+        owner = '.%d-' % os.getpid()
+
+        for mtime, size, name, path in self._segments():
+            if name.endswith(CLAIMED_SUFFIX):
+                # A claimed segment left behind by this process, or by a
+                # process which exited part way through a replay.
+
+                if owner in name or now - mtime > ABANDONED_SEGMENT_AGE:
+                    return path
+
+                continue
+
+            if name.endswith(ACTIVE_SUFFIX):
+                if now - mtime <= ABANDONED_SEGMENT_AGE:
+                    continue
+            elif not name.endswith(SEALED_SUFFIX):
+                continue
+
+            self._sequence += 1
+            claimed = '%s%s%d%s' % (path[:path.rindex('.')], owner,
+                    self._sequence, CLAIMED_SUFFIX)
+
+            try:
+                os.rename(path, claimed)
+            except OSError:
+                continue
+
+            return claimed
+
+    def replay(self, send, limit=10):
+        """Passes up to limit of the oldest payloads in the spool to the
+        send function, as the endpoint name and the decompressed encoded
+        payload. If the send function returns False the payload is kept
+        and replay stops. Any exception raised by the send function also
+        stops the replay and is propagated, with the payload being kept
+        in the spool. Returns the number of payloads replayed.
+
+        """
+
+        with self._lock:
+            try:
+                if not self._check_directory():
+                    return 0
+            except OSError:
+                return 0
+
+        replayed = 0
+
+        while replayed < limit:
+            with self._lock:
+                path = self._claim()
+
+            if path is None:
+                break
+
+            try:
+                records = _read_records(path)
+            except (IOError, OSError):
+                self._remove(path)
+                continue
+
+            now = time.time()
+            index = 0
+
+            try:
+                while index < len(records) and replayed < limit:
+                    timestamp, method, data = records[index]
+
+                    if now - timestamp <= self._max_age:
+                        if not send(method, zlib.decompress(data)):
+                            break
+                        replayed += 1
+                        self._replayed += 1
+
+                    index += 1
+
+            finally:
+                # Any records not replayed are written back to the
+                # claimed segment, ready for the next replay.
+
+                remaining = records[index:]
+
+                if remaining:
+                    with _open_segment(path + '.tmp', 'wb') as fp:
+                        _write_records(fp, remaining)
+                    os.rename(path + '.tmp', path)
+                else:
+                    self._remove(path)
+
+            if remaining:
+                break
+
+        return replayed
+
+    def metrics(self):
+        """Returns supportability metrics for the spool since the last
+        call and resets the counters.
+
+        """
+
+        stored, self._stored = self._stored, 0
+        replayed, self._replayed = self._replayed, 0
+        evicted, self._evicted = self._evicted, 0
+        dropped, self._dropped = self._dropped, 0
+
+        prefix = 'Supportability/Python/PayloadSpool/'
+
+        yield prefix + 'Stored', {'count': stored}
+        yield prefix + 'Replayed', {'count': replayed}
+        yield prefix + 'Evicted', {'count': evicted}
+        yield prefix + 'Dropped', {'count': dropped}
@@ -0,0 +1,240 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module implements a bounded queue serviced by background worker
+threads, used to move the recording of completed transactions off the
+thread which executed the transaction.
+
+"""
+
+import logging
+import os
+import threading
+import time
+
+from collections import OrderedDict
+
+from newrelic.packages.six.moves import queue
+
+_logger = logging.getLogger(__name__)
+
+OVERFLOW_DROP = 'drop'
+OVERFLOW_INLINE = 'inline'
+
+_SHUTDOWN = object()
+
+
+class RecordingQueue(object):
+
+    """Hands work items to a pool of worker threads which call the
+    supplied record function for each item. The queue is bounded and
+    when full the overflow policy decides whether the item is dropped
+    or recorded on the calling thread instead.
+
+    """
+
+    def __init__(self, record, maxsize=1000, workers=1,
+            overflow_policy=OVERFLOW_DROP, name='NR-Recording-Worker'):
+        self._record = record
+        self._maxsize = max(maxsize, 1)
+        self._workers = max(workers, 1)
+        self._overflow_policy = overflow_policy
+        self._name = name
+
+        self._lock = threading.Lock()
+        self._queue = None
+        self._threads = []
+        self._pid = None
+
+        # Each queued item is given a sequence number and is held in the
+        # pending set until it has been recorded, so that a flush can
+        # wait for just those items queued before it was called. The
+        # condition also guards the counters, which are updated from
+        # the threads queueing items as well as read at harvest time.
+
+        self._condition = threading.Condition(threading.Lock())
+        self._sequence = 0
+        self._pending = OrderedDict()
+
+        self._enqueued = 0
+        self._dropped = 0
+        self._inline = 0
+
+    def _start(self):
+        # Worker threads do not survive a fork, so if we find ourselves
+        # in a different process to the one the workers were started
+        # in, we discard any queued items inherited from the parent and
+        # start a fresh set of workers.
+
+        with self._lock:
+            pid = os.getpid()
+
+            if self._pid == pid:
+                return
+
+            with self._condition:
+                self._pending = OrderedDict()
+
+            self._queue = queue.Queue(self._maxsize)
+            self._threads = []
+
+            for index in range(self._workers):
+                thread = threading.Thread(target=self._run,
+                        args=(self._queue,),
+                        name='%s-%d' % (self._name, index))
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+            self._pid = pid
+
+    def _run(self, work_queue):
+        while True:
+            entry = work_queue.get()
+
+            if entry is _SHUTDOWN:
+                work_queue.task_done()
+                return
+
+            sequence, item = entry
+
+            try:
+                self._record(item)
+
+            except Exception:
+                _logger.exception('The background recording of transaction '
+                        'data has failed. This would indicate some sort of '
+                        'internal implementation issue with the agent. '
+                        'Please report this problem to New Relic support '
+                        'for further investigation.')
+
+            finally:
+                with self._condition:
+                    self._pending.pop(sequence, None)
+                    self._condition.notify_all()
+
+                work_queue.task_done()
+
+    def put(self, item):
+        """Queues the item for recording. Returns True if the item was
+        queued or recorded inline and False if it was dropped.
+
+        """
+
+        if self._pid != os.getpid():
+            self._start()
+
+        # The item is added to the queue while holding the lock so that
+        # items are taken from the queue in order of sequence number.
+
+        with self._condition:
+            sequence = self._sequence + 1
+
+            try:
+                self._queue.put_nowait((sequence, item))
+
+            except queue.Full:
+                if self._overflow_policy != OVERFLOW_INLINE:
+                    self._dropped += 1
+                    return False
+
+                self._inline += 1
+
+            else:
+                self._sequence = sequence
+                self._pending[sequence] = True
+                self._enqueued += 1
+                return True
+
+        self._record(item)
+
+        return True
+
+    def qsize(self):
+        if self._queue is None:
+            return 0
+
+        return self._queue.qsize()
+
+    def flush(self, timeout=None):
+        """Waits until all items queued prior to the call have been
+        recorded, or the timeout expires. Returns True if the queue was
+        fully drained.
+
+        """
+
+        if self._queue is None or self._pid != os.getpid():
+            return True
+
+        deadline = timeout is not None and time.time() + timeout
+
+        # Items queued after the call have a higher sequence number and
+        # are not waited on. As items are added to the pending set in
+        # order of sequence number, the first is the oldest outstanding.
+
+        with self._condition:
+            last = self._sequence
+
+            while self._pending and next(iter(self._pending)) <= last:
+                if deadline is False:
+                    self._condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0.0:
+                        return False
+                    self._condition.wait(remaining)
+
+        return True
+
+    def shutdown(self, timeout=None):
+        """Drains the queue and stops the worker threads. The queue
+        will be restarted if further items are subsequently queued.
+
+        """
+
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+
+            work_queue = self._queue
+            threads = self._threads
+
+            self._pid = None
+
+        for thread in threads:
+            try:
+                work_queue.put(_SHUTDOWN, timeout=timeout)
+            except queue.Full:
+                break
+
+        for thread in threads:
+            thread.join(timeout)
+
+    def metrics(self):
+        """Returns supportability metrics for the queue since the last
+        call and resets the counters.
+
+        """
+
+        with self._condition:
+            enqueued, self._enqueued = self._enqueued, 0
+            dropped, self._dropped = self._dropped, 0
+            inline, self._inline = self._inline, 0
+
+        prefix = 'Supportability/Python/RecordTransaction/Queue/'
+
+        yield prefix + 'Enqueued', {'count': enqueued}
+        yield prefix + 'Dropped', {'count': dropped}
+        yield prefix + 'Inline', {'count': inline}
+        yield prefix + 'Size', self.qsize()
@@ -23,7 +23,8 @@ from newrelic.packages import six
 _RootNode = namedtuple('_RootNode',
         ['name', 'children', 'start_time', 'end_time', 'exclusive',
         'duration', 'guid', 'agent_attributes', 'user_attributes',
-        'path', 'trusted_parent_span', 'tracing_vendors',])
+        'path', 'trusted_parent_span', 'tracing_vendors',
+        'folded_segment_count',])
 
 
 class RootNode(_RootNode, GenericNodeMixin):
@@ -56,6 +57,13 @@ class RootNode(_RootNode, GenericNodeMixin):
 
         params = self.get_trace_segment_params(root.settings)
 
+        # Segments folded into metrics rather than being kept are missing
+        # from the trace, so the number of them is recorded to show that
+        # the trace is incomplete.
+
+        if self.folded_segment_count:
+            params['folded_segment_count'] = self.folded_segment_count
+
         return newrelic.core.trace_node.TraceNode(
                 start_time=start_time,
                 end_time=end_time,
@@ -16,6 +16,8 @@ import re
 
 from collections import namedtuple
 
+from newrelic.common.lru_cache import LRUCache
+
 _NormalizationRule = namedtuple('_NormalizationRule',
         ['match_expression', 'replacement', 'ignore', 'eval_order',
         'terminate_chain', 'each_segment', 'replace_all'])
@@ -37,7 +39,7 @@ class NormalizationRule(_NormalizationRule):
 
 class RulesEngine(object):
 
-    def __init__(self, rules):
+    def __init__(self, rules, cache_size=0):
         self.__rules = []
 
         for rule in rules:
@@ -49,11 +51,31 @@ class RulesEngine(object):
 
         self.__rules = sorted(self.__rules, key=lambda rule: rule.eval_order)
 
+        # Applications only produce a bounded set of distinct names, so
+        # the result of normalizing a name is cached. A new engine is
+        # created whenever the rules change, which discards the cache.
+
+        self.cache = None
+        if self.__rules and cache_size:
+            self.cache = LRUCache(cache_size)
+
     @property
     def rules(self):
         return self.__rules
 
     def normalize(self, string):
+        cache = self.cache
+        if cache is None:
+            return self._normalize(string)
+
+        result = cache.get(string)
+        if result is None:
+            result = self._normalize(string)
+            cache.put(string, result)
+
+        return result
+
+    def _normalize(self, string):
         # URLs are supposed to be ASCII but can get a
         # URL with illegal non ASCII characters. As the
         # rule patterns and replacements are Unicode
@@ -119,7 +141,7 @@ class SegmentCollapseEngine(object):
 
     COLLAPSE_STAR_RE = re.compile(r'((?:^|/)\*)(?:/\*)*')
 
-    def __init__(self, rules):
+    def __init__(self, rules, cache_size=0):
         self.rules = {}
 
         prefixes = []
@@ -160,7 +182,23 @@ class SegmentCollapseEngine(object):
 
         self.prefixes = re.compile(pattern)
 
+        self.cache = None
+        if self.rules and cache_size:
+            self.cache = LRUCache(cache_size)
+
     def normalize(self, txn_name):
+        cache = self.cache
+        if cache is None:
+            return self._normalize(txn_name)
+
+        result = cache.get(txn_name)
+        if result is None:
+            result = self._normalize(txn_name)
+            cache.put(txn_name, result)
+
+        return result
+
+    def _normalize(self, txn_name):
         """Takes a transaction name and collapses the segments into a
         '*' except for the segments in the whitelist_terms.
 
@@ -27,6 +27,7 @@ import random
 import zlib
 import time
 import sys
+from array import array
 from heapq import heapreplace, heapify
 
 import newrelic.packages.six as six
@@ -179,6 +180,379 @@ class CountStats(TimeStats):
         pass
 
 
+STATS_KIND_TIME = 0
+STATS_KIND_COUNT = 1
+STATS_KIND_APDEX = 2
+
+
+def _stats_kind(stats):
+    if isinstance(stats, CompactStatsRow):
+        return stats.kind
+    elif isinstance(stats, ApdexStats):
+        return STATS_KIND_APDEX
+    elif isinstance(stats, CountStats):
+        return STATS_KIND_COUNT
+    return STATS_KIND_TIME
+
+
+def _gather(column, rows):
+    # Returns the values of the given rows of a column as an array. Where
+    # the rows are contiguous this is a single slice of the column.
+
+    if rows and rows[-1] - rows[0] == len(rows) - 1 and \
+            rows == list(range(rows[0], rows[-1] + 1)):
+        return column[rows[0]:rows[-1] + 1]
+
+    return array(column.typecode, map(column.__getitem__, rows))
+
+
+def _scatter(column, rows, values):
+    # Stores the values into the given rows of a column. Where the rows
+    # are contiguous this is a single slice assignment.
+
+    if rows and rows[-1] - rows[0] == len(rows) - 1 and \
+            rows == list(range(rows[0], rows[-1] + 1)):
+        column[rows[0]:rows[-1] + 1] = values
+        return
+
+    for row, value in zip(rows, values):
+        column[row] = value
+
+
+def _merge_minimum(count, current, value):
+    return count and min(current, value) or value
+
+
+def _merge_apdex_minimum(satisfying, tolerating, frustrating, current,
+        value):
+    return ((satisfying or tolerating or frustrating) and
+            min(current, value) or value)
+
+
+def _create_stats(kind, values):
+    if kind == STATS_KIND_APDEX:
+        stats = ApdexStats()
+    elif kind == STATS_KIND_COUNT:
+        stats = CountStats()
+    else:
+        stats = TimeStats()
+    stats[:] = values
+    return stats
+
+
+class CompactStatsTable(object):
+
+    """Table for accumulating apdex, time and value metrics which stores
+    the values for all metrics in contiguous columns of doubles, rather
+    than as a list object per metric.
+
+    """
+
+    # Each metric key is interned into a row number on first use. The
+    # six values making up the stats for a metric are held in six
+    # columns, with the kind of stats for the row (time, count or
+    # apdex) recorded in a separate column as it dictates how values
+    # are merged. Lookups via get() return a view onto the row which
+    # supports the same merge methods as the list based stats objects,
+    # so the table can be used in place of a dictionary of such objects.
+
+    def __init__(self):
+        self._index = {}
+        self._keys = []
+        self._kinds = array('b')
+        self._columns = tuple(array('d') for _ in range(6))
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __getitem__(self, key):
+        return CompactStatsRow(self, self._index[key])
+
+    def __setitem__(self, key, stats):
+        row = self._index.get(key)
+        kind = _stats_kind(stats)
+
+        if row is None:
+            self._add_row(key, kind, stats)
+        else:
+            self._kinds[row] = kind
+            for column, value in zip(self._columns, stats):
+                column[row] = value
+
+    def _add_row(self, key, kind, values):
+        row = len(self._keys)
+        self._index[key] = row
+        self._keys.append(key)
+        self._kinds.append(kind)
+        for column, value in zip(self._columns, values):
+            column.append(value)
+        return row
+
+    def get(self, key, default=None):
+        row = self._index.get(key)
+        if row is None:
+            return default
+        return CompactStatsRow(self, row)
+
+    def keys(self):
+        return list(self._keys)
+
+    def items(self):
+        return [(key, CompactStatsRow(self, row))
+                for row, key in enumerate(self._keys)]
+
+    iteritems = items
+
+    def merge_values(self, row, values):
+        """Merges the six stats values supplied into the given row,
+        according to the kind of stats held by the row.
+
+        """
+
+        c0, c1, c2, c3, c4, c5 = self._columns
+        kind = self._kinds[row]
+
+        if kind == STATS_KIND_TIME:
+            c1[row] += values[1]
+            c2[row] += values[2]
+            c3[row] = c0[row] and min(c3[row], values[3]) or values[3]
+            c4[row] = max(c4[row], values[4])
+            c5[row] += values[5]
+
+            # Must update the call count last as update of the
+            # minimum call time is dependent on initial value.
+
+            c0[row] += values[0]
+
+        elif kind == STATS_KIND_COUNT:
+            c0[row] += values[0]
+
+        else:
+            c0[row] += values[0]
+            c1[row] += values[1]
+            c2[row] += values[2]
+
+            c3[row] = ((c0[row] or c1[row] or c2[row]) and
+                    min(c3[row], values[3]) or values[3])
+            c4[row] = max(c4[row], values[3])
+
+    def merge_table(self, other):
+        """Merges all rows from another compact stats table into this
+        one. The keys of the other table are first remapped to rows of
+        this table. The values for rows already present are then merged
+        a whole column at a time for each kind of stats, and the values
+        for the remaining rows appended to the columns in bulk.
+
+        """
+
+        index = self._index
+        kinds = self._kinds
+
+        merged = dict((kind, ([], [])) for kind in (STATS_KIND_TIME,
+                STATS_KIND_COUNT, STATS_KIND_APDEX))
+        added = []
+
+        for other_row, key in enumerate(other._keys):
+            row = index.get(key)
+            if row is None:
+                added.append(other_row)
+            else:
+                rows, other_rows = merged[kinds[row]]
+                rows.append(row)
+                other_rows.append(other_row)
+
+        for kind, (rows, other_rows) in merged.items():
+            if rows:
+                self._merge_rows(kind, rows, other, other_rows)
+
+        if added:
+            self._append_rows(other, added)
+
+    def _merge_rows(self, kind, rows, other, other_rows):
+        # Merges the values of rows of the other table into the given rows
+        # of this table, all of which hold the given kind of stats.
+
+        columns = self._columns
+
+        a0, a1, a2, a3, a4, a5 = [_gather(column, rows)
+                for column in columns]
+        b0, b1, b2, b3, b4, b5 = [_gather(column, other_rows)
+                for column in other._columns]
+
+        def merged(*values):
+            return array('d', map(*values))
+
+        c0 = merged(operator.add, a0, b0)
+
+        if kind == STATS_KIND_TIME:
+            results = (c0, merged(operator.add, a1, b1),
+                    merged(operator.add, a2, b2),
+                    merged(_merge_minimum, a0, a3, b3),
+                    merged(max, a4, b4), merged(operator.add, a5, b5))
+
+        elif kind == STATS_KIND_COUNT:
+            results = (c0,)
+
+        else:
+            c1 = merged(operator.add, a1, b1)
+            c2 = merged(operator.add, a2, b2)
+            results = (c0, c1, c2,
+                    merged(_merge_apdex_minimum, c0, c1, c2, a3, b3),
+                    merged(max, a4, b3))
+
+        for column, values in zip(columns, results):
+            _scatter(column, rows, values)
+
+    def _append_rows(self, other, other_rows):
+        # Appends the given rows of the other table, for keys not yet
+        # present in this table.
+
+        row = len(self._keys)
+        keys = [other._keys[other_row] for other_row in other_rows]
+
+        self._keys.extend(keys)
+        self._index.update(zip(keys, range(row, row + len(keys))))
+        self._kinds.extend(_gather(other._kinds, other_rows))
+
+        for column, other_column in zip(self._columns, other._columns):
+            column.extend(_gather(other_column, other_rows))
+
+    def row_values(self, row):
+        """Returns the values for a row as a list in the form used for
+        reporting the metric to the data collector.
+
+        """
+
+        c0, c1, c2, c3, c4, c5 = self._columns
+
+        if self._kinds[row] == STATS_KIND_APDEX:
+            return [int(c0[row]), int(c1[row]), int(c2[row]),
+                    c3[row], c4[row], int(c5[row])]
+
+        return [int(c0[row]), c1[row], c2[row], c3[row], c4[row], c5[row]]
+
+    def metric_data(self, normalizer=None):
+        """Returns a list of the metrics held by the table in the form
+        used for reporting to the data collector. If a normalizer is
+        supplied the metric names are first normalized and metrics with
+        the same resulting name are merged together.
+
+        """
+
+        table = self
+
+        if normalizer is not None:
+            table = CompactStatsTable()
+            index = table._index
+            columns = self._columns
+
+            for row, key in enumerate(self._keys):
+                key = (normalizer(key[0])[0], key[1])
+                values = [column[row] for column in columns]
+                normalized_row = index.get(key)
+                if normalized_row is None:
+                    table._add_row(key, self._kinds[row], values)
+                else:
+                    table.merge_values(normalized_row, values)
+
+        row_values = table.row_values
+
+        return [(dict(name=key[0], scope=key[1]), row_values(row))
+                for row, key in enumerate(table._keys)]
+
+
+class CompactStatsRow(object):
+
+    """View onto a single row of a compact stats table, providing the
+    same interface as the list based stats objects.
+
+    """
+
+    __slots__ = ('_table', '_row')
+
+    def __init__(self, table, row):
+        self._table = table
+        self._row = row
+
+    @property
+    def kind(self):
+        return self._table._kinds[self._row]
+
+    def __len__(self):
+        return 6
+
+    def __getitem__(self, index):
+        return self._table.row_values(self._row)[index]
+
+    def __iter__(self):
+        return iter(self._table.row_values(self._row))
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    # Rows are mutable views, so are not hashable, consistently on both
+    # Python 2 and Python 3.
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self._table.row_values(self._row))
+
+    call_count = property(operator.itemgetter(0))
+    total_call_time = property(operator.itemgetter(1))
+    total_exclusive_call_time = property(operator.itemgetter(2))
+    min_call_time = property(operator.itemgetter(3))
+    max_call_time = property(operator.itemgetter(4))
+    sum_of_squares = property(operator.itemgetter(5))
+
+    satisfying = property(operator.itemgetter(0))
+    tolerating = property(operator.itemgetter(1))
+    frustrating = property(operator.itemgetter(2))
+
+    def merge_stats(self, other):
+        """Merge data from another stats object."""
+
+        self._table.merge_values(self._row, list(other))
+
+    def merge_apdex_metric(self, metric):
+        """Merge data from an apdex metric object."""
+
+        self._table.merge_values(self._row, (metric.satisfying,
+                metric.tolerating, metric.frustrating, metric.apdex_t,
+                metric.apdex_t, 0))
+
+    def merge_raw_time_metric(self, duration, exclusive=None):
+        """Merge time value."""
+
+        if self.kind == STATS_KIND_COUNT:
+            return
+
+        if exclusive is None:
+            exclusive = duration
+
+        self._table.merge_values(self._row, (1, duration, exclusive,
+                duration, duration, duration ** 2))
+
+    def merge_time_metric(self, metric):
+        """Merge data from a time metric object."""
+
+        self.merge_raw_time_metric(metric.duration, metric.exclusive)
+
+    def merge_custom_metric(self, value):
+        """Merge data value."""
+
+        self.merge_raw_time_metric(value)
+
+
 class CustomMetrics(object):
 
     """Table for collection a set of value metrics.
@@ -210,6 +584,20 @@ class CustomMetrics(object):
         else:
             stats.merge_stats(new_stats)
 
+    def merge_metrics(self, metrics):
+        """Merges the accumulated stats from an iterable of metric name
+        and stats pairs, such as returned by metrics() for another set
+        of value metrics.
+
+        """
+
+        for name, other in metrics:
+            stats = self.__stats_table.get(name)
+            if stats is None:
+                self.__stats_table[name] = copy.copy(other)
+            else:
+                stats.merge_stats(other)
+
     def metrics(self):
         """Returns an iterator over the set of value metrics. The items
         returned are a tuple consisting of the metric name and accumulated
@@ -306,6 +694,22 @@ class SampledDataSet(object):
         self.heap = False
         self.num_seen = 0
 
+    @property
+    def admission_threshold(self):
+        """Returns the priority which a sample must exceed to be retained,
+        or None if any sample would be retained as the data set is not
+        yet full.
+
+        """
+
+        if self.capacity <= 0:
+            return float('inf')
+
+        if self.heap:
+            return self.pq[0][0]
+
+        return None
+
     def should_sample(self, priority):
         if self.heap:
             # self.pq[0] is always the minimal
@@ -325,11 +729,16 @@ class SampledDataSet(object):
             priority = random.random()
 
         entry = (priority, self.num_seen, sample)
-        if self.num_seen == self.capacity:
-            self.pq.append(entry)
-            self.heap = self.heap or heapify(self.pq) or True
-        elif not self.heap:
+        if not self.heap:
             self.pq.append(entry)
+
+            # The reservoir becomes a heap once full. This is decided on
+            # the number of samples held rather than the number seen, as
+            # merging counts samples which were seen but never held.
+
+            if len(self.pq) >= self.capacity:
+                heapify(self.pq)
+                self.heap = True
         else:
             sampled = self.should_sample(priority)
             if not sampled:
@@ -337,13 +746,52 @@ class SampledDataSet(object):
             heapreplace(self.pq, entry)
 
     def merge(self, other_data_set):
-        for priority, seen_at, sample in other_data_set.pq:
-            self.add(sample, priority)
+        # Merge the samples of the other data set in bulk, rather than
+        # adding them one at a time. The samples are numbered as if they
+        # had been added in turn, and the ones retained are those with
+        # the highest priorities, as would be the case had they been
+        # added one at a time.
 
-        # Merge the num_seen from the other_data_set, but take care not to
-        # double-count the actual samples of other_data_set since the .add
-        # call above will add one to self.num_seen each time
-        self.num_seen += other_data_set.num_seen - other_data_set.num_samples
+        num_seen = self.num_seen
+        self.num_seen += other_data_set.num_seen
+
+        if not other_data_set.pq or self.capacity <= 0:
+            return
+
+        entries = [(priority, num_seen + index, sample) for
+                index, (priority, _, sample) in
+                enumerate(other_data_set.pq, 1)]
+
+        pq = self.pq
+
+        if self.heap:
+            # Only samples of a higher priority than the lowest held in
+            # the full reservoir can be retained. When only a few remain,
+            # as when merging the samples of a single transaction, it is
+            # cheaper to replace the lowest held samples one at a time
+            # than to select from all samples of both data sets.
+
+            minimum = pq[0][0]
+            entries = [entry for entry in entries if entry[0] > minimum]
+
+            if 2 * len(entries) < len(pq):
+                for entry in entries:
+                    if entry[0] > pq[0][0]:
+                        heapreplace(pq, entry)
+                return
+
+        pq.extend(entries)
+
+        if len(pq) >= self.capacity:
+            if len(pq) > self.capacity:
+                # A stable sort keeps samples of equal priority in the
+                # order they were seen, so the first seen are retained.
+
+                pq.sort(key=operator.itemgetter(0), reverse=True)
+                del pq[self.capacity:]
+
+            heapify(pq)
+            self.heap = True
 
 
 class LimitedDataSet(list):
@@ -432,6 +880,9 @@ class StatsEngine(object):
         self._custom_events = SampledDataSet()
         self._span_events = SampledDataSet()
         self._span_stream = None
+        self._transaction_events_threshold = None
+        self._error_events_threshold = None
+        self._span_events_threshold = None
         self.__sql_stats_table = {}
         self.__slow_transaction = None
         self.__slow_transaction_map = {}
@@ -440,6 +891,8 @@ class StatsEngine(object):
         self.__transaction_errors = []
         self._synthetics_events = LimitedDataSet()
         self.__synthetics_transactions = []
+        self.__forwarded_transaction_traces = []
+        self.__forwarded_slow_sql = []
 
     @property
     def settings(self):
@@ -477,6 +930,12 @@ class StatsEngine(object):
     def error_events(self):
         return self._error_events
 
+    def _new_stats_table(self):
+        if (self.__settings is not None and
+                self.__settings.transaction_recording.compact_stats_table):
+            return CompactStatsTable()
+        return {}
+
     def metrics_count(self):
         """Returns a count of the number of unique metrics currently
         recorded for apdex, time and value metrics.
@@ -504,8 +963,10 @@ class StatsEngine(object):
         stats = self.__stats_table.get(key)
         if stats is None:
             stats = ApdexStats(apdex_t=metric.apdex_t)
+            stats.merge_apdex_metric(metric)
             self.__stats_table[key] = stats
-        stats.merge_apdex_metric(metric)
+        else:
+            stats.merge_apdex_metric(metric)
 
         return key
 
@@ -562,6 +1023,25 @@ class StatsEngine(object):
         for metric in metrics:
             self.record_time_metric(metric)
 
+    def merge_time_stats(self, metrics):
+        """Merges in the accumulated stats for a set of time metrics. The
+        metrics should be provided as an iterable where each item is a
+        tuple of the metric name and scope, and the accumulated stats for
+        the metric.
+
+        """
+
+        if not self.__settings:
+            return
+
+        for (name, scope), other in metrics:
+            key = (name, scope or '')
+            stats = self.__stats_table.get(key)
+            if not stats:
+                self.__stats_table[key] = copy.copy(other)
+            else:
+                stats.merge_stats(other)
+
     def record_exception(self, exc=None, value=None, tb=None, params={},
             ignore_errors=[]):
 
@@ -906,6 +1386,8 @@ class StatsEngine(object):
 
         self.record_time_metrics(transaction.time_metrics(self))
 
+        self.merge_time_stats(transaction.folded_metrics)
+
         # Capture any errors if error collection is enabled.
         # Only retain maximum number allowed per harvest.
 
@@ -919,12 +1401,23 @@ class StatsEngine(object):
             self.__transaction_errors = self.__transaction_errors[:
                     settings.agent_limits.errors_per_harvest]
 
+        # Events of a transaction all share the priority of the
+        # transaction. Where the reservoir the events will be merged into
+        # is already full of events of at least that priority, the events
+        # are only counted as seen rather than being created.
+
+        priority = transaction.priority
+
         if (error_collector.capture_events and
                 error_collector.enabled and
                 settings.collect_error_events):
-            events = transaction.error_events(self.__stats_table)
-            for event in events:
-                self._error_events.add(event, priority=transaction.priority)
+            if self._is_below_threshold(priority,
+                    self._error_events_threshold):
+                self._error_events.num_seen += len(transaction.errors)
+            else:
+                events = transaction.error_events(self.__stats_table)
+                for event in events:
+                    self._error_events.add(event, priority=priority)
 
         # Capture any sql traces if transaction tracer enabled.
 
@@ -968,8 +1461,12 @@ class StatsEngine(object):
         elif (settings.collect_analytics_events and
                 settings.transaction_events.enabled):
 
-            event = transaction.transaction_event(self.__stats_table)
-            self._transaction_events.add(event, priority=transaction.priority)
+            if self._is_below_threshold(priority,
+                    self._transaction_events_threshold):
+                self._transaction_events.num_seen += 1
+            else:
+                event = transaction.transaction_event(self.__stats_table)
+                self._transaction_events.add(event, priority=priority)
 
         # Merge in custom events
 
@@ -985,8 +1482,46 @@ class StatsEngine(object):
                 for event in transaction.span_protos(settings):
                     self._span_stream.put(event)
             elif transaction.sampled:
-                for event in transaction.span_events(self.__settings):
-                    self._span_events.add(event, priority=transaction.priority)
+                self._record_span_events(transaction)
+
+    @staticmethod
+    def _is_below_threshold(priority, threshold):
+        return (priority is not None and threshold is not None and
+                priority <= threshold)
+
+    def _record_span_events(self, transaction):
+        span_events = self._span_events
+        priority = transaction.priority
+
+        # All span events for a transaction share the priority of the
+        # transaction. If the reservoir they will end up in is already
+        # full of samples with at least this priority, none of the span
+        # events could be retained, so rather than creating them only
+        # to be discarded, we only account for them as having been
+        # seen. The same applies once the reservoir fills up part way
+        # through the span events of this transaction.
+
+        if priority is None:
+            for event in transaction.span_events(self.__settings):
+                span_events.add(event)
+            return
+
+        threshold = self._span_events_threshold
+
+        if span_events.capacity <= 0 or (threshold is not None and
+                priority <= threshold):
+            span_events.num_seen += transaction.span_count()
+            return
+
+        added = 0
+
+        for event in transaction.span_events(self.__settings):
+            span_events.add(event, priority=priority)
+            added += 1
+
+            if not span_events.should_sample(priority):
+                span_events.num_seen += transaction.span_count() - added
+                break
 
     def metric_data(self, normalizer=None):
         """Returns a list containing the low level metric data for
@@ -1015,6 +1550,17 @@ class StatsEngine(object):
                     self.__settings.app_name,
                     list(six.iteritems(self.__stats_table)))
 
+        if isinstance(self.__stats_table, CompactStatsTable):
+            result = self.__stats_table.metric_data(normalizer)
+
+            if self.__settings.debug.log_normalized_metric_data:
+                _logger.info('Normalized metric data for harvest of %r '
+                        'is %r.', self.__settings.app_name,
+                        [((key['name'], key['scope']), value)
+                        for key, value in result])
+
+            return result
+
         if normalizer is not None:
             for key, value in six.iteritems(self.__stats_table):
                 key = (normalizer(key[0])[0], key[1])
@@ -1065,12 +1611,14 @@ class StatsEngine(object):
         if not self.__settings:
             return []
 
-        if not self.__sql_stats_table:
-            return []
-
         if not self.__settings.slow_sql.enabled:
             return []
 
+        # Slow SQL forwarded from other processes is already encoded.
+
+        if not self.__sql_stats_table:
+            return list(self.__forwarded_slow_sql)
+
         maximum = self.__settings.agent_limits.slow_sql_data
 
         slow_sql_nodes = sorted(six.itervalues(self.__sql_stats_table),
@@ -1139,6 +1687,10 @@ class StatsEngine(object):
 
             result.append(data)
 
+        if self.__forwarded_slow_sql:
+            result = sorted(result + self.__forwarded_slow_sql,
+                    key=lambda x: x[8])[-maximum:]
+
         return result
 
     def transaction_trace_data(self, connections):
@@ -1161,10 +1713,12 @@ class StatsEngine(object):
             traces.add(self.__slow_transaction)
         traces.update(self.__synthetics_transactions)
 
-        # Return an empty list if no transactions were captured.
+        # Return only any transaction traces forwarded from other
+        # processes, which are already encoded, if no transactions were
+        # captured.
 
         if not traces:
-            return []
+            return list(self.__forwarded_transaction_traces)
 
         # We want to limit the number of explain plans we do across
         # these. So work out what were the slowest and tag them.
@@ -1259,6 +1813,8 @@ class StatsEngine(object):
                     None,
                     trace.synthetics_resource_id, ])
 
+        trace_data.extend(self.__forwarded_transaction_traces)
+
         return trace_data
 
     def slow_transaction_data(self):
@@ -1324,13 +1880,15 @@ class StatsEngine(object):
         """
 
         self.__settings = settings
-        self.__stats_table = {}
+        self.__stats_table = self._new_stats_table()
         self.__sql_stats_table = {}
         self.__slow_transaction = None
         self.__slow_transaction_map = {}
         self.__slow_transaction_old_duration = None
         self.__transaction_errors = []
         self.__synthetics_transactions = []
+        self.__forwarded_transaction_traces = []
+        self.__forwarded_slow_sql = []
 
         self.reset_transaction_events()
         self.reset_error_events()
@@ -1340,7 +1898,10 @@ class StatsEngine(object):
         # streams are never reset after instantiation
         if reset_stream:
             self._span_stream = StreamBuffer(
-                settings.infinite_tracing.span_queue_size)
+                settings.infinite_tracing.span_queue_size,
+                batching=settings.infinite_tracing.batching,
+                batch_size=settings.infinite_tracing.batch_size,
+                batch_timeout=settings.infinite_tracing.batch_timeout)
 
     def reset_metric_stats(self):
         """Resets the accumulated statistics back to initial state for
@@ -1348,7 +1909,7 @@ class StatsEngine(object):
 
         """
 
-        self.__stats_table = {}
+        self.__stats_table = self._new_stats_table()
 
     def reset_transaction_events(self):
         """Resets the accumulated statistics back to initial state for
@@ -1434,7 +1995,9 @@ class StatsEngine(object):
         self.__slow_transaction = None
         self.__synthetics_transactions = []
         self.__sql_stats_table = {}
-        self.__stats_table = {}
+        self.__forwarded_transaction_traces = []
+        self.__forwarded_slow_sql = []
+        self.__stats_table = self._new_stats_table()
         self.__transaction_errors = []
 
     def harvest_snapshot(self, flexible=False):
@@ -1484,6 +2047,95 @@ class StatsEngine(object):
 
         return snapshot
 
+    def forwarding_snapshot(self):
+        """Creates a snapshot of all the accumulated data, irrespective of
+        the event harvest configuration, for forwarding to the stats
+        engine of another process using forwarded_data(). The originals
+        are then reset back to being empty. The snapshot does not hold a
+        reference to the span stream.
+
+        """
+
+        snapshot = copy.copy(self)
+        snapshot._span_stream = None
+
+        self.reset_stats(self.__settings)
+
+        return snapshot
+
+    def forwarded_data(self, connections):
+        """Returns the data accumulated in the stats engine in a form
+        which can be encoded as JSON, for forwarding to another process to
+        be merged using merge_forwarded_data(). Transaction traces and slow
+        SQL are included in the form in which they are sent to the data
+        collector, using the SQL connections for any explain plans.
+
+        """
+
+        def _data_set(data_set):
+            return [data_set.capacity, data_set.num_seen,
+                    [[priority, sample] for priority, _, sample
+                    in data_set.pq]]
+
+        return {
+            'metrics': [[name, scope, _stats_kind(stats), list(stats)]
+                    for (name, scope), stats
+                    in six.iteritems(self.__stats_table)],
+            'transaction_events': _data_set(self._transaction_events),
+            'synthetics_events': [self._synthetics_events.capacity,
+                    self._synthetics_events.num_seen,
+                    list(self._synthetics_events)],
+            'error_events': _data_set(self._error_events),
+            'custom_events': _data_set(self._custom_events),
+            'span_events': _data_set(self._span_events),
+            'errors': [list(error) for error in self.__transaction_errors],
+            'transaction_traces': (self.__settings.collect_traces and
+                    self.transaction_trace_data(connections) or []),
+            'slow_sql': (self.__settings.collect_traces and
+                    self.slow_sql_data(connections) or []),
+        }
+
+    def merge_forwarded_data(self, data):
+        """Merges data forwarded from another process, as returned by
+        forwarded_data(), in the same way as for an aggregation shard.
+
+        """
+
+        if not self.__settings:
+            return
+
+        def _data_set(data):
+            capacity, num_seen, samples = data
+            data_set = SampledDataSet(capacity)
+            for priority, sample in samples:
+                data_set.add(sample, priority)
+            data_set.num_seen = num_seen
+            return data_set
+
+        shard = self.create_workarea()
+
+        shard.__stats_table = dict(((name, scope),
+                _create_stats(kind, values))
+                for name, scope, kind, values in data['metrics'])
+
+        shard._transaction_events = _data_set(data['transaction_events'])
+        capacity, num_seen, samples = data['synthetics_events']
+        shard._synthetics_events = LimitedDataSet(capacity)
+        shard._synthetics_events.extend(samples)
+        shard._synthetics_events.num_seen = num_seen
+        shard._error_events = _data_set(data['error_events'])
+        shard._custom_events = _data_set(data['custom_events'])
+        shard._span_events = _data_set(data['span_events'])
+
+        shard.__transaction_errors = [TracedError(*error)
+                for error in data['errors']]
+
+        shard.__forwarded_transaction_traces = data.get(
+                'transaction_traces', [])
+        shard.__forwarded_slow_sql = data.get('slow_sql', [])
+
+        self.merge_shard(shard)
+
     def create_workarea(self):
         """Creates and returns a new empty stats engine object. This would
         be used to distill stats from a single web transaction before then
@@ -1494,6 +2146,17 @@ class StatsEngine(object):
         stats = copy.copy(self)
         stats.reset_stats(self.__settings)
 
+        # Record the lowest priority held by each of the event reservoirs
+        # which are full, so events which could never be merged back into
+        # them need not be created.
+
+        stats._transaction_events_threshold = (
+                self._transaction_events.admission_threshold)
+        stats._error_events_threshold = (
+                self._error_events.admission_threshold)
+        stats._span_events_threshold = (
+                self._span_events.admission_threshold)
+
         return stats
 
     def merge(self, snapshot):
@@ -1514,6 +2177,26 @@ class StatsEngine(object):
         self._merge_sql(snapshot)
         self._merge_traces(snapshot)
 
+    def merge_shard(self, shard):
+        """Merges all data accumulated in an aggregation shard. Shard is
+        an instance of StatsEngine into which data for many transactions
+        has been merged, so unlike merging a single transaction, all
+        events held by the shard are merged using reservoir sampling.
+        """
+
+        if not self.__settings:
+            return
+
+        self.merge_metric_stats(shard)
+        self._merge_transaction_events(shard, rollback=True)
+        self._merge_synthetics_events(shard, rollback=True)
+        self._merge_error_events(shard)
+        self._merge_error_traces(shard)
+        self._merge_custom_events(shard, rollback=True)
+        self._merge_span_events(shard, rollback=True)
+        self._merge_sql(shard)
+        self._merge_traces(shard)
+
     def rollback(self, snapshot):
         """Performs a "rollback" merge after a failed harvest. Snapshot is a
         copy of the main StatsEngine data that we attempted to harvest, but
@@ -1544,6 +2227,11 @@ class StatsEngine(object):
         if not self.__settings:
             return
 
+        if (isinstance(self.__stats_table, CompactStatsTable) and
+                isinstance(snapshot.__stats_table, CompactStatsTable)):
+            self.__stats_table.merge_table(snapshot.__stats_table)
+            return
+
         for key, other in six.iteritems(snapshot.__stats_table):
             stats = self.__stats_table.get(key)
             if not stats:
@@ -1555,7 +2243,9 @@ class StatsEngine(object):
 
         # Merge in transaction events. In the normal case snapshot is a
         # StatsEngine from a single transaction, and should only have one
-        # event. Just to avoid issues, if there is more than one, don't merge.
+        # event, or none if the event was only counted as seen because it
+        # could not have been retained. Just to avoid issues, if there is
+        # more than one, don't merge.
 
         # If this is a rollback, snapshot is a copy of a previous main
         # StatsEngine, and self is still the current main StatsEngine. Then
@@ -1567,7 +2257,7 @@ class StatsEngine(object):
         if rollback:
             self._transaction_events.merge(events)
         else:
-            if events.num_samples == 1:
+            if events.num_samples <= 1:
                 self._transaction_events.merge(events)
 
     def _merge_synthetics_events(self, snapshot, rollback=False):
@@ -1652,6 +2342,30 @@ class StatsEngine(object):
 
             self._update_slow_transaction(transaction)
 
+        # Of the encoded transaction traces forwarded from other
+        # processes, only the slowest is kept, along with those for
+        # Synthetics transactions up to the limit for these. Forwarded
+        # slow SQL is limited to the slowest as for that recorded here.
+
+        forwarded = (self.__forwarded_transaction_traces +
+                snapshot.__forwarded_transaction_traces)
+
+        if forwarded:
+            traces = [trace for trace in forwarded if trace[9]][:maximum]
+            others = [trace for trace in forwarded if not trace[9]]
+
+            if others:
+                traces.insert(0, max(others, key=lambda trace: trace[1]))
+
+            self.__forwarded_transaction_traces = traces
+
+        forwarded = self.__forwarded_slow_sql + snapshot.__forwarded_slow_sql
+
+        if forwarded:
+            self.__forwarded_slow_sql = sorted(forwarded,
+                    key=lambda x: x[8])[-self.__settings.agent_limits.
+                    slow_sql_data:]
+
     def merge_custom_metrics(self, metrics):
         """Merges in a set of custom metrics. The metrics should be
         provide as an iterable where each item is a tuple of the metric
@@ -17,7 +17,6 @@
 """
 
 import sys
-import random
 import threading
 import weakref
 import traceback
@@ -99,6 +98,39 @@ class TraceCache(object):
 
     def __init__(self):
         self._cache = weakref.WeakValueDictionary()
+        self._asyncio = None
+        self._get_running_loop = None
+        self._current_task = None
+
+    def current_task(self):
+        """Returns the asyncio task for the caller, if any.
+
+        """
+
+        asyncio = self.asyncio
+        if not asyncio:
+            return None
+
+        # The functions needed to find the current task are only looked
+        # up once for the asyncio module, as this is called every time a
+        # trace is entered or the current trace is needed. Where possible
+        # the running event loop is checked first, to avoid the cost of
+        # current_task() raising an exception whenever it is called from
+        # outside of an event loop.
+
+        if asyncio is not self._asyncio:
+            self._current_task = getattr(asyncio, "current_task", None)
+            self._get_running_loop = self._current_task and getattr(
+                    asyncio, "_get_running_loop", None)
+            self._asyncio = asyncio
+
+        get_running_loop = self._get_running_loop
+        if get_running_loop is None:
+            return current_task(asyncio)
+
+        loop = get_running_loop()
+        if loop is not None:
+            return self._current_task(loop)
 
     def current_thread_id(self):
         """Returns the thread ID for the caller.
@@ -108,7 +140,8 @@ class TraceCache(object):
 
         """
 
-        if self.greenlet:
+        greenlet = self.greenlet
+        if greenlet:
             # Greenlet objects are maintained in a tree structure with
             # the 'parent' attribute pointing to that which a specific
             # instance is associated with. Only the root node has no
@@ -119,14 +152,13 @@ class TraceCache(object):
             # all other cases where we can obtain a current greenlet,
             # then it should indicate we are running as a greenlet.
 
-            current = self.greenlet.getcurrent()
+            current = greenlet.getcurrent()
             if current is not None and current.parent:
                 return id(current)
 
-        if self.asyncio:
-            task = current_task(self.asyncio)
-            if task is not None:
-                return id(task)
+        task = self.current_task()
+        if task is not None:
+            return id(task)
 
         return thread.get_ident()
 
@@ -217,7 +249,7 @@ class TraceCache(object):
         if not hasattr(trace, "_task"):
             return trace
 
-        task = current_task(self.asyncio)
+        task = self.current_task()
         if task is not None and id(trace._task) != id(task):
             self._cache.pop(thread_id, None)
             return None
@@ -254,24 +286,23 @@ class TraceCache(object):
         self._cache[thread_id] = trace
 
         # We judge whether we are actually running in a coroutine by
-        # seeing if the current thread ID is actually listed in the set
-        # of all current frames for executing threads. If we are
-        # executing within a greenlet, then thread.get_ident() will
-        # return the greenlet identifier. This will not be a key in
-        # dictionary of all current frames because that will still be
-        # the original standard thread which all greenlets are running
-        # within.
+        # comparing the thread ID of the trace, which is always obtained
+        # from current_thread_id() in the thread saving the trace, with
+        # the ID of the actual thread. If we are executing within a
+        # greenlet or an asyncio task, then the thread ID of the trace
+        # will be the ID of the greenlet or task instead. This avoids
+        # taking a snapshot of the frames of all threads for every trace
+        # just to check whether the thread ID is one of them.
 
         trace._greenlet = None
 
-        if hasattr(sys, "_current_frames"):
-            if thread_id not in sys._current_frames():
-                if self.greenlet:
-                    trace._greenlet = weakref.ref(self.greenlet.getcurrent())
+        if thread_id != thread.get_ident():
+            if self.greenlet:
+                trace._greenlet = weakref.ref(self.greenlet.getcurrent())
 
-                if self.asyncio and not hasattr(trace, "_task"):
-                    task = current_task(self.asyncio)
-                    trace._task = task
+            if self.asyncio and not hasattr(trace, "_task"):
+                task = self.current_task()
+                trace._task = task
 
     def thread_start(self, trace):
         current_thread_id = self.current_thread_id()
@@ -393,13 +424,13 @@ class TraceCache(object):
         seen = None
 
         for root in roots:
-            guid = "%016x" % random.getrandbits(64)
+            # The guid is generated if and when a span event is created.
             node = LoopNode(
                 fetch_name=fetch_name,
                 start_time=start_time,
                 end_time=end_time,
                 duration=duration,
-                guid=guid,
+                guid=None,
             )
             transaction = root.transaction
             transaction._process_node(node)
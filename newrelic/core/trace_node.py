@@ -27,4 +27,7 @@ def node_start_time(root, node):
     return (node.start_time - root.start_time) * 1000.0
 
 def node_end_time(root, node):
-    return (node.end_time - root.start_time) * 1000.0
+    # A node which aggregates consecutive identical segments ends with
+    # the last of them.
+    end_time = getattr(node, 'aggregate_end_time', node.end_time)
+    return (end_time - root.start_time) * 1000.0
@@ -41,7 +41,8 @@ _TransactionNode = namedtuple('_TransactionNode',
         'port', 'request_uri', 'queue_start', 'start_time',
         'end_time', 'last_byte_time', 'response_time', 'total_time',
         'duration', 'exclusive', 'root', 'errors', 'slow_sql',
-        'custom_events', 'apdex_t', 'suppress_apdex', 'custom_metrics', 'guid',
+        'custom_events', 'apdex_t', 'suppress_apdex', 'custom_metrics',
+        'folded_metrics', 'guid',
         'cpu_time', 'suppress_transaction_trace', 'client_cross_process_id',
         'referring_transaction_guid', 'record_tt', 'synthetics_resource_id',
         'synthetics_job_id', 'synthetics_monitor_id', 'synthetics_header',
@@ -586,12 +587,16 @@ class TransactionNode(_TransactionNode):
         for i_attrs, u_attrs, a_attrs in self.span_events(
                     settings, attr_class=SpanProtoAttrs):
             yield Span(trace_id=self.trace_id,
-                       intrinsics=i_attrs,
+                       intrinsics=i_attrs.expand(),
                        user_attributes=u_attrs,
                        agent_attributes=a_attrs)
 
+    def span_count(self):
+        return self.root.span_count()
+
     def span_events(self, settings, attr_class=dict):
         base_attrs = attr_class((
+            ('type', 'Span'),
             ('transactionId', self.guid),
             ('traceId', self.trace_id),
             ('sampled', self.sampled),
@@ -0,0 +1,107 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compares the engines for obfuscating SQL, and the cost of parsing a
+statement with and without the statement cache, over the corpus of
+queries from the cross agent tests. Run from the root of the repository:
+
+    python tests/agent_benchmarks/bench_sql_obfuscation.py [repeat]
+
+"""
+
+from __future__ import print_function
+
+import json
+import os
+import sys
+import timeit
+
+from newrelic.core.config import global_settings
+from newrelic.core.database_utils import (SQLStatement, _obfuscate_sql,
+        _obfuscate_sql_tokenized, _sql_parse_cache)
+
+FIXTURES_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__),
+        os.pardir, 'cross_agent', 'fixtures'))
+
+QUOTING_STYLES = ('single', 'single+double', 'single+dollar',
+        'single+oracle')
+
+
+class DummyDB(object):
+    def __init__(self, quoting_style):
+        self.quoting_style = quoting_style
+
+
+def load_corpus():
+    corpus = []
+
+    path = os.path.join(FIXTURES_DIR, 'sql_obfuscation',
+            'sql_obfuscation.json')
+    with open(path) as fh:
+        corpus.extend(test['sql'] for test in json.load(fh)
+                if not test.get('pathological'))
+
+    path = os.path.join(FIXTURES_DIR, 'sql_parsing.json')
+    with open(path) as fh:
+        corpus.extend(test['input'] for test in json.load(fh))
+
+    return [(sql, DummyDB(style)) for sql in corpus
+            for style in QUOTING_STYLES]
+
+
+def parse_statements(corpus):
+    for sql, database in corpus:
+        statement = SQLStatement(sql, database)
+        statement.operation
+        statement.target
+        statement.normalized
+
+
+def report(name, seconds, count):
+    print('%-32s %10.2f usec/statement' % (name, 1e6 * seconds / count))
+
+
+def main(repeat=200):
+    corpus = load_corpus()
+    count = len(corpus) * repeat
+
+    print('%d statements x %d repetitions' % (len(corpus), repeat))
+
+    for name, obfuscate_sql in (('regex', _obfuscate_sql),
+            ('tokenizer', _obfuscate_sql_tokenized)):
+        for sql, database in corpus:
+            assert obfuscate_sql(sql, database) == _obfuscate_sql(sql,
+                    database)
+
+        seconds = min(timeit.repeat(lambda: [obfuscate_sql(sql, database)
+                for sql, database in corpus], number=repeat, repeat=3))
+        report('obfuscate (%s)' % name, seconds, count)
+
+    settings = global_settings()
+    cache_size = settings.agent_limits.sql_statement_cache_size
+
+    for name, size in (('uncached', 0), ('cached', len(corpus))):
+        settings.agent_limits.sql_statement_cache_size = size
+        _sql_parse_cache.clear()
+
+        seconds = min(timeit.repeat(lambda: parse_statements(corpus),
+                number=repeat, repeat=3))
+        report('parse statement (%s)' % name, seconds, count)
+
+    settings.agent_limits.sql_statement_cache_size = cache_size
+    _sql_parse_cache.clear()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
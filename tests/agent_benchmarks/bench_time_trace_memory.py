@@ -0,0 +1,105 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures the memory used by each segment of a transaction. Reports the
+size of a trace object while it is active, and the memory and number of
+allocations retained per segment up until the transaction completes.
+Requires Python 3 for tracemalloc. Run from the root of the repository:
+
+    python tests/agent_benchmarks/bench_time_trace_memory.py [segments]
+
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import tracemalloc
+
+os.environ.setdefault('NEW_RELIC_DEVELOPER_MODE', 'true')
+os.environ.setdefault('NEW_RELIC_APP_NAME', 'Benchmark')
+
+import newrelic.agent  # noqa: E402
+
+from newrelic.api.background_task import BackgroundTask  # noqa: E402
+from newrelic.api.database_trace import DatabaseTrace  # noqa: E402
+from newrelic.api.datastore_trace import DatastoreTrace  # noqa: E402
+from newrelic.api.external_trace import ExternalTrace  # noqa: E402
+from newrelic.api.function_trace import FunctionTrace  # noqa: E402
+
+TRACES = (
+    ('FunctionTrace', lambda: FunctionTrace('function')),
+    ('DatabaseTrace', lambda: DatabaseTrace('SELECT 1')),
+    ('DatastoreTrace', lambda: DatastoreTrace('redis', None, 'get')),
+    ('ExternalTrace', lambda: ExternalTrace('requests',
+            'http://localhost/')),
+)
+
+
+def measure(function):
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        result = function()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    stats = after.compare_to(before, 'filename')
+    size = sum(stat.size_diff for stat in stats)
+    blocks = sum(stat.count_diff for stat in stats)
+
+    return result, size, blocks
+
+
+def trace_objects(factory, count):
+    return [factory() for _ in range(count)]
+
+
+def transaction_segments(application, factory, count):
+    # The trace nodes are held by the transaction until it completes,
+    # so return the transaction before it exits to capture them.
+
+    transaction = BackgroundTask(application, 'segments')
+    transaction.__enter__()
+
+    for _ in range(count):
+        with factory():
+            pass
+
+    return transaction
+
+
+def main(count=10000):
+    newrelic.agent.initialize()
+    application = newrelic.agent.register_application(timeout=10.0)
+
+    print('%d segments per measurement' % count)
+
+    for name, factory in TRACES:
+        objects, size, blocks = measure(lambda: trace_objects(factory,
+                count))
+        print('%-16s trace object  %8.1f bytes %6.2f allocations' % (
+                name, size / count, blocks / count))
+        del objects
+
+        transaction, size, blocks = measure(lambda: transaction_segments(
+                application, factory, count))
+        print('%-16s in transaction %7.1f bytes %6.2f allocations' % (
+                name, size / count, blocks / count))
+        transaction.__exit__(None, None, None)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -410,3 +410,27 @@ def test_transaction_end_on_different_task():
 
     loop = asyncio.get_event_loop()
     loop.run_until_complete(test())
+
+
+def test_trace_task_recorded_only_in_coroutines():
+    import asyncio
+
+    traces = {}
+
+    @background_task(name="test_trace_task_recorded_only_in_coroutines")
+    def in_thread():
+        with FunctionTrace("thread") as trace:
+            traces["thread"] = (trace.thread_id, hasattr(trace, "_task"))
+
+    async def in_task():
+        with BackgroundTask(application(), name="task"):
+            with FunctionTrace("task") as trace:
+                task = trace_cache().current_task()
+                traces["task"] = (trace.thread_id, trace._task is task)
+                return id(task)
+
+    in_thread()
+    task_id = asyncio.get_event_loop().run_until_complete(in_task())
+
+    assert traces["thread"] == (trace_cache().current_thread_id(), False)
+    assert traces["task"] == (task_id, True)
@@ -21,7 +21,10 @@ from newrelic.api.transaction import (add_custom_parameter,
         add_custom_parameters)
 from newrelic.api.wsgi_application import wsgi_application
 from newrelic.core.attribute import (truncate, sanitize, Attribute,
-    CastingFailureException, MAX_64_BIT_INT, _DESTINATIONS_WITH_EVENTS)
+    CastingFailureException, MAX_64_BIT_INT, _DESTINATIONS_WITH_EVENTS,
+    process_user_attributes, filter_attributes)
+from newrelic.core.attribute_filter import (AttributeFilter,
+    DST_SPAN_EVENTS, DST_TRANSACTION_SEGMENTS)
 
 from newrelic.packages import six
 
@@ -513,3 +516,30 @@ class AttributeErrorString(object):
 def test_str_raises_attribute_error():
     with pytest.raises(CastingFailureException):
         sanitize(AttributeErrorString())
+
+
+def test_process_user_attributes():
+    attribute_filter = AttributeFilter({
+        'attributes.enabled': True,
+        'span_events.attributes.enabled': True,
+        'transaction_segments.attributes.enabled': True,
+        'span_events.attributes.exclude': ['segment_only'],
+    })
+
+    attributes = process_user_attributes({
+        'both': 'value',
+        'segment_only': TOO_LONG,
+        'int_too_big': MAX_64_BIT_INT + 1,
+        TOO_LONG: 'value',
+    }, attribute_filter)
+
+    assert sorted(attributes) == [
+        Attribute('both', 'value',
+                DST_SPAN_EVENTS | DST_TRANSACTION_SEGMENTS),
+        Attribute('segment_only', TRUNCATED, DST_TRANSACTION_SEGMENTS),
+    ]
+
+    assert filter_attributes(attributes, DST_SPAN_EVENTS) == {
+            'both': 'value'}
+    assert filter_attributes(attributes, DST_TRANSACTION_SEGMENTS) == {
+            'both': 'value', 'segment_only': TRUNCATED}
@@ -0,0 +1,162 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from newrelic.api.background_task import background_task
+from newrelic.api.datastore_trace import DatastoreTrace
+from newrelic.api.function_trace import FunctionTrace
+from newrelic.api.transaction import current_transaction
+from newrelic.api.web_transaction import web_transaction
+from newrelic.common.object_wrapper import transient_function_wrapper
+
+from testing_support.fixtures import (override_application_settings,
+        validate_transaction_metrics, validate_tt_segment_params)
+
+_lightweight_settings = {
+    'distributed_tracing.enabled': True,
+    'span_events.enabled': True,
+    'transaction_segments.lightweight_unsampled': True,
+    'transaction_segments.aggregate_repeated': False,
+    'transaction_tracer.enabled': False,
+}
+
+_lightweight_metrics = [
+    ('Function/outer', 1),
+    ('Function/inner', 2),
+    ('Datastore/statement/Redis/cache/get', 2),
+]
+
+
+def validate_root_children(count):
+    @transient_function_wrapper('newrelic.core.stats_engine',
+            'StatsEngine.record_transaction')
+    def _validate_root_children(wrapped, instance, args, kwargs):
+        transaction = args[0]
+        assert len(transaction.root.children) == count
+        return wrapped(*args, **kwargs)
+
+    return _validate_root_children
+
+
+def record_segments(sampled):
+    current_transaction()._sampled = sampled
+
+    with FunctionTrace('outer'):
+        for _ in range(2):
+            with FunctionTrace('inner'):
+                with DatastoreTrace('Redis', 'cache', 'get'):
+                    pass
+
+
+@validate_root_children(0)
+@validate_transaction_metrics('test_unsampled_segments_not_kept',
+        background_task=True,
+        scoped_metrics=_lightweight_metrics,
+        rollup_metrics=_lightweight_metrics + [('Datastore/all', 2)],
+        custom_metrics=[
+            ('Supportability/Python/Transaction/LightweightSegments', 5),
+        ])
+@override_application_settings(_lightweight_settings)
+@background_task(name='test_unsampled_segments_not_kept')
+def test_unsampled_segments_not_kept():
+    record_segments(sampled=False)
+
+
+@pytest.mark.parametrize('sampled,settings', (
+    (True, _lightweight_settings),
+    (False, dict(_lightweight_settings,
+            **{'transaction_segments.lightweight_unsampled': False})),
+    (False, dict(_lightweight_settings,
+            **{'transaction_tracer.enabled': True,
+            'transaction_tracer.transaction_threshold': 0.0})),
+))
+def test_segments_kept(sampled, settings):
+
+    @validate_root_children(1)
+    @validate_transaction_metrics('test_segments_kept',
+            background_task=True,
+            scoped_metrics=_lightweight_metrics,
+            custom_metrics=[
+                ('Supportability/Python/Transaction/LightweightSegments',
+                        None),
+            ])
+    @override_application_settings(settings)
+    @background_task(name='test_segments_kept')
+    def _test():
+        record_segments(sampled)
+
+    _test()
+
+
+@validate_root_children(0)
+@validate_transaction_metrics('test_unsampled_segments_under_threshold',
+        background_task=True,
+        scoped_metrics=_lightweight_metrics,
+        custom_metrics=[
+            ('Supportability/Python/Transaction/LightweightSegments', 5),
+        ])
+@override_application_settings(dict(_lightweight_settings,
+        **{'transaction_tracer.enabled': True,
+        'transaction_tracer.transaction_threshold': 10.0}))
+@background_task(name='test_unsampled_segments_under_threshold')
+def test_unsampled_segments_under_threshold():
+    # Whether the transaction is over the transaction trace threshold is
+    # only decided once it completes, at which point it is under it.
+
+    record_segments(sampled=False)
+
+
+@override_application_settings(_lightweight_settings)
+@web_transaction(name='test_sampling_not_decided_early', headers={})
+def test_sampling_not_decided_early():
+    transaction = current_transaction()
+
+    with FunctionTrace('segment'):
+        pass
+
+    # Sampling is still decided when the transaction completes.
+    assert transaction._sampled is None
+
+
+@transient_function_wrapper('newrelic.core.application',
+        'Application.compute_sampled')
+def not_sampled(wrapped, instance, args, kwargs):
+    return False
+
+
+@validate_root_children(0)
+@not_sampled
+@override_application_settings(_lightweight_settings)
+@background_task(name='test_unsampled_background_task')
+def test_unsampled_background_task():
+    # The sampling is decided for a background task when it completes,
+    # with the segments then being folded.
+
+    with FunctionTrace('segment'):
+        pass
+
+    assert current_transaction()._sampled is None
+
+
+@validate_tt_segment_params(exact_params={'folded_segment_count': 2})
+@override_application_settings({
+    'agent_limits.max_transaction_segments': 1,
+    'transaction_tracer.transaction_threshold': 0.0,
+})
+@background_task(name='test_folded_segment_count_on_trace')
+def test_folded_segment_count_on_trace():
+    for name in ('a', 'b', 'c'):
+        with FunctionTrace(name):
+            pass
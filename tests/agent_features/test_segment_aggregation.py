@@ -0,0 +1,150 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from newrelic.api.background_task import background_task
+from newrelic.api.datastore_trace import DatastoreTrace
+from newrelic.api.function_trace import FunctionTrace
+from newrelic.api.transaction import current_transaction
+from newrelic.common.object_wrapper import transient_function_wrapper
+
+from testing_support.fixtures import (override_application_settings,
+        validate_transaction_metrics, validate_tt_segment_params, dt_enabled)
+from testing_support.validators.validate_span_events import (
+        validate_span_events)
+
+
+def validate_root_children(names):
+    @transient_function_wrapper('newrelic.core.stats_engine',
+            'StatsEngine.record_transaction')
+    def _validate_root_children(wrapped, instance, args, kwargs):
+        transaction = args[0]
+        children = [child.name for child in transaction.root.children]
+        assert children == names
+        return wrapped(*args, **kwargs)
+
+    return _validate_root_children
+
+
+aggregation_enabled = override_application_settings({
+    'transaction_segments.aggregate_repeated': True,
+})
+
+
+@validate_root_children(['Datastore/statement/Redis/cache/get'])
+@validate_transaction_metrics('test_consecutive_segments_aggregated',
+        background_task=True,
+        scoped_metrics=[('Datastore/statement/Redis/cache/get', 5)],
+        rollup_metrics=[('Datastore/all', 5)],
+        custom_metrics=[
+            ('Supportability/Python/Transaction/AggregatedSegments', 4),
+            ('Supportability/Python/Transaction/FoldedSegments', None),
+        ])
+@validate_tt_segment_params(exact_params={'call_count': 5})
+@aggregation_enabled
+@background_task(name='test_consecutive_segments_aggregated')
+def test_consecutive_segments_aggregated():
+    for _ in range(5):
+        with DatastoreTrace('Redis', 'cache', 'get'):
+            pass
+
+
+@validate_root_children(['a', 'b', 'a'])
+@validate_transaction_metrics('test_non_consecutive_segments_kept',
+        background_task=True,
+        scoped_metrics=[('Function/a', 2), ('Function/b', 1)],
+        custom_metrics=[
+            ('Supportability/Python/Transaction/AggregatedSegments', None),
+        ])
+@aggregation_enabled
+@background_task(name='test_non_consecutive_segments_kept')
+def test_non_consecutive_segments_kept():
+    for name in ('a', 'b', 'a'):
+        with FunctionTrace(name):
+            pass
+
+
+@pytest.mark.parametrize('trace_args', (
+    (('Redis', 'cache', 'get'), ('Redis', 'cache', 'set')),
+    (('Redis', 'cache', 'get'), ('Redis', 'other', 'get')),
+))
+def test_different_segments_kept(trace_args):
+    names = ['Datastore/statement/%s/%s/%s' % args for args in trace_args]
+
+    @validate_root_children(names)
+    @aggregation_enabled
+    @background_task(name='test_different_segments_kept')
+    def _test():
+        for args in trace_args:
+            with DatastoreTrace(*args):
+                pass
+
+    _test()
+
+
+@validate_root_children(['outer', 'outer'])
+@aggregation_enabled
+@background_task(name='test_segments_with_children_kept')
+def test_segments_with_children_kept():
+    for _ in range(2):
+        with FunctionTrace('outer'):
+            with FunctionTrace('inner'):
+                pass
+
+
+@validate_root_children(['a', 'a', 'a'])
+@override_application_settings({
+    'transaction_segments.aggregate_repeated': False,
+})
+@background_task(name='test_segment_aggregation_disabled')
+def test_segment_aggregation_disabled():
+    for _ in range(3):
+        with FunctionTrace('a'):
+            pass
+
+
+@validate_root_children(['a', 'a', 'a'])
+@background_task(name='test_segment_aggregation_disabled_by_default')
+def test_segment_aggregation_disabled_by_default():
+    for _ in range(3):
+        with FunctionTrace('a'):
+            pass
+
+
+@validate_root_children(['a', 'a', 'a'])
+@aggregation_enabled
+@background_task(name='test_segments_with_guid_kept')
+def test_segments_with_guid_kept():
+    # Once the guid of a segment has been generated, such as for the
+    # headers of an outbound request, it may be referred to elsewhere and
+    # so the segment is not merged away.
+
+    for _ in range(3):
+        with FunctionTrace('a') as trace:
+            assert trace.guid
+
+
+@validate_span_events(count=1, exact_intrinsics={
+    'name': 'Function/a', 'nr.callCount': 3},
+    expected_intrinsics=['nr.minDuration', 'nr.maxDuration'])
+@dt_enabled
+@aggregation_enabled
+@background_task(name='test_aggregated_span_event')
+def test_aggregated_span_event():
+    current_transaction()._sampled = True
+
+    for _ in range(3):
+        with FunctionTrace('a'):
+            pass
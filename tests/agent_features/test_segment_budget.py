@@ -0,0 +1,103 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from newrelic.api.background_task import background_task
+from newrelic.api.datastore_trace import DatastoreTrace
+from newrelic.api.function_trace import FunctionTrace
+from newrelic.api.transaction import set_transaction_name
+from newrelic.common.object_wrapper import transient_function_wrapper
+
+from testing_support.fixtures import (override_application_settings,
+        validate_transaction_metrics)
+
+_segment_budget_metrics = [
+    ('Function/outer', 2),
+    ('Function/inner', 8),
+    ('Datastore/statement/Redis/cache/get', 8),
+]
+
+
+def validate_root_children(count):
+    @transient_function_wrapper('newrelic.core.stats_engine',
+            'StatsEngine.record_transaction')
+    def _validate_root_children(wrapped, instance, args, kwargs):
+        transaction = args[0]
+        assert len(transaction.root.children) == count
+        return wrapped(*args, **kwargs)
+
+    return _validate_root_children
+
+
+@validate_root_children(1)
+@validate_transaction_metrics('renamed',
+        background_task=True,
+        scoped_metrics=_segment_budget_metrics,
+        rollup_metrics=_segment_budget_metrics + [
+            ('Datastore/all', 8),
+            ('Datastore/Redis/allOther', 8),
+        ],
+        custom_metrics=[
+            ('Supportability/Python/Transaction/FoldedSegments', 15),
+        ])
+@override_application_settings({
+    'agent_limits.max_transaction_segments': 3,
+})
+@background_task(name='test_segment_budget')
+def test_segments_over_budget_folded():
+    for _ in range(2):
+        with FunctionTrace('outer'):
+            for _ in range(4):
+                with FunctionTrace('inner'):
+                    with DatastoreTrace('Redis', 'cache', 'get'):
+                        pass
+
+    # Folded segments must be scoped to the final transaction name.
+    set_transaction_name('renamed')
+
+
+@validate_root_children(2)
+@validate_transaction_metrics('test_segment_budget_disabled',
+        background_task=True,
+        scoped_metrics=_segment_budget_metrics,
+        custom_metrics=[
+            ('Supportability/Python/Transaction/FoldedSegments', None),
+        ])
+@override_application_settings({
+    'agent_limits.max_transaction_segments': 0,
+})
+@background_task(name='test_segment_budget_disabled')
+def test_segment_budget_disabled():
+    for _ in range(2):
+        with FunctionTrace('outer'):
+            for _ in range(4):
+                with FunctionTrace('inner'):
+                    with DatastoreTrace('Redis', 'cache', 'get'):
+                        pass
+
+
+@validate_root_children(2)
+@validate_transaction_metrics('test_segment_budget_disabled_by_default',
+        background_task=True,
+        scoped_metrics=_segment_budget_metrics,
+        custom_metrics=[
+            ('Supportability/Python/Transaction/FoldedSegments', None),
+        ])
+@background_task(name='test_segment_budget_disabled_by_default')
+def test_segment_budget_disabled_by_default():
+    for _ in range(2):
+        with FunctionTrace('outer'):
+            for _ in range(4):
+                with FunctionTrace('inner'):
+                    with DatastoreTrace('Redis', 'cache', 'get'):
+                        pass
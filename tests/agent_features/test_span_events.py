@@ -20,6 +20,7 @@ from newrelic.api.time_trace import (current_trace,
         add_custom_span_attribute, record_exception)
 from newrelic.api.background_task import background_task
 from newrelic.common.object_names import callable_name
+from newrelic.common.object_wrapper import transient_function_wrapper
 
 from newrelic.api.database_trace import DatabaseTrace
 from newrelic.api.datastore_trace import DatastoreTrace
@@ -116,6 +117,54 @@ def test_span_events(dt_enabled, span_events_enabled, txn_sampled):
     _test()
 
 
+def test_span_event_guids_generated_lazily():
+    recorded_events = []
+
+    @transient_function_wrapper('newrelic.core.stats_engine',
+            'StatsEngine.record_transaction')
+    def capture_span_events(wrapped, instance, args, kwargs):
+        result = wrapped(*args, **kwargs)
+        recorded_events.extend(event for priority, seen_at, event
+                in instance.span_events.pq)
+        return result
+
+    @capture_span_events
+    @dt_enabled
+    @background_task(name='test_span_event_guids_generated_lazily')
+    def _test():
+        current_transaction()._sampled = True
+
+        with FunctionTrace('parent') as parent:
+            with FunctionTrace('child') as child:
+                pass
+
+        # The guid is only generated once it is requested.
+        assert parent._guid is None
+        assert child._guid is None
+
+    _test()
+
+    intrinsics = dict((event[0]['name'], event[0])
+            for event in recorded_events)
+    parent = intrinsics['Function/parent']
+    child = intrinsics['Function/child']
+
+    assert len(parent['guid']) == 16
+    assert len(child['guid']) == 16
+    assert parent['guid'] != child['guid']
+    assert child['parentId'] == parent['guid']
+
+
+def test_span_guid_stable_once_requested():
+    trace = FunctionTrace('function')
+    guid = trace.guid
+
+    assert len(guid) == 16
+    int(guid, 16)
+    assert trace.guid == guid
+    assert FunctionTrace('function').guid != guid
+
+
 @pytest.mark.parametrize('trace_type,args', (
     (DatabaseTrace, ('select * from foo', )),
     (DatastoreTrace, ('db_product', 'db_target', 'db_operation')),
@@ -14,9 +14,17 @@
 
 import logging
 
+import pytest
+
 from newrelic.api.transaction import end_of_transaction
 from newrelic.api.background_task import background_task
+from newrelic.api.database_trace import DatabaseTrace
+from newrelic.api.datastore_trace import DatastoreTrace
+from newrelic.api.external_trace import ExternalTrace
 from newrelic.api.function_trace import FunctionTrace
+from newrelic.api.memcache_trace import MemcacheTrace
+from newrelic.api.message_trace import MessageTrace
+from newrelic.api.solr_trace import SolrTrace
 
 
 from testing_support.fixtures import validate_transaction_metrics
@@ -36,3 +44,24 @@ def test_trace_after_end_of_transaction(caplog):
     error_messages = [record for record in caplog.records
             if record.levelno >= logging.ERROR]
     assert not error_messages
+
+
+@pytest.mark.parametrize('trace_type,args', (
+    (FunctionTrace, ('name',)),
+    (DatabaseTrace, ('select 1',)),
+    (DatastoreTrace, ('product', 'target', 'operation')),
+    (ExternalTrace, ('library', 'http://localhost/')),
+    (MemcacheTrace, ('get',)),
+    (MessageTrace, ('library', 'Produce', 'Queue', 'name')),
+    (SolrTrace, ('library', 'query')),
+))
+def test_trace_has_no_instance_dict(trace_type, args):
+    # Traces hold their attributes in slots, so no instance dictionary is
+    # created for each segment.
+
+    trace = trace_type(*args)
+
+    assert not hasattr(trace, '__dict__')
+
+    with pytest.raises(AttributeError):
+        trace.undeclared_attribute = None
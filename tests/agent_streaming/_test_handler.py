@@ -15,7 +15,10 @@
 from concurrent import futures
 
 import grpc
-from newrelic.core.infinite_tracing_pb2 import RecordStatus, Span
+from newrelic.core.infinite_tracing_pb2 import RecordStatus, Span, SpanBatch
+
+# Number of spans in each batch received by record_span_batch.
+SPAN_BATCH_SIZES = []
 
 
 def record_span(request, context):
@@ -35,13 +38,37 @@ def record_span(request, context):
         yield RecordStatus(messages_seen=1)
 
 
+def record_span_batch(request, context):
+    metadata = dict(context.invocation_metadata())
+    assert 'agent_run_token' in metadata
+    assert 'license_key' in metadata
+
+    for batch in request:
+        SPAN_BATCH_SIZES.append(len(batch.spans))
+
+        for span in batch.spans:
+            status_code = span.intrinsics.get('status_code', None)
+            status_code = status_code and getattr(
+                grpc.StatusCode, status_code.string_value)
+            if status_code is grpc.StatusCode.OK:
+                return
+            elif status_code:
+                context.abort(status_code, "Abort triggered by client")
+
+        yield RecordStatus(messages_seen=len(batch.spans))
+
+
 HANDLERS = (
     grpc.method_handlers_generic_handler(
         "com.newrelic.trace.v1.IngestService",
         {
             "RecordSpan": grpc.stream_stream_rpc_method_handler(
                 record_span, Span.FromString, RecordStatus.SerializeToString
-            )
+            ),
+            "RecordSpanBatch": grpc.stream_stream_rpc_method_handler(
+                record_span_batch, SpanBatch.FromString,
+                RecordStatus.SerializeToString
+            ),
         },
     ),
 )
@@ -0,0 +1,166 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+
+import pytest
+
+from newrelic.common.streaming_utils import StreamBuffer
+from newrelic.core.infinite_tracing_pb2 import Span, SpanBatch
+
+
+def make_span(index):
+    return Span(trace_id=str(index))
+
+
+def test_dropped_count_exact():
+    stream_buffer = StreamBuffer(2)
+
+    for index in range(5):
+        stream_buffer.put(make_span(index))
+
+    assert stream_buffer.stats() == (5, 3)
+    assert stream_buffer.stats() == (0, 0)
+
+    # The oldest spans are the ones dropped.
+    assert next(stream_buffer).trace_id == '3'
+    assert next(stream_buffer).trace_id == '4'
+
+
+def test_concurrent_put_accounting():
+    stream_buffer = StreamBuffer(100)
+    consumed = []
+
+    def consume():
+        for span in stream_buffer:
+            consumed.append(span)
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+
+    def produce():
+        for index in range(1000):
+            stream_buffer.put(make_span(index))
+
+    producers = [threading.Thread(target=produce) for _ in range(4)]
+    for producer in producers:
+        producer.start()
+    for producer in producers:
+        producer.join()
+
+    deadline = time.time() + 5
+    while stream_buffer._queue and time.time() < deadline:
+        time.sleep(0.01)
+
+    stream_buffer.shutdown()
+    consumer.join(timeout=5)
+
+    seen, dropped = stream_buffer.stats()
+    assert seen == 4000
+    assert seen - dropped == len(consumed)
+
+
+def test_batches_bounded_by_size():
+    stream_buffer = StreamBuffer(10, batching=True, batch_size=2)
+
+    for index in range(4):
+        stream_buffer.put(make_span(index))
+
+    batch = next(stream_buffer)
+    assert isinstance(batch, SpanBatch)
+    assert [span.trace_id for span in batch.spans] == ['0', '1']
+
+    batch = next(stream_buffer)
+    assert [span.trace_id for span in batch.spans] == ['2', '3']
+
+
+def test_partial_batch_sent_after_timeout():
+    stream_buffer = StreamBuffer(10, batching=True, batch_size=100,
+            batch_timeout=0.05)
+
+    stream_buffer.put(make_span(0))
+
+    start = time.time()
+    batch = next(stream_buffer)
+
+    assert len(batch.spans) == 1
+    assert time.time() - start >= 0.05
+
+
+def test_batch_wakes_when_full():
+    stream_buffer = StreamBuffer(10, batching=True, batch_size=2,
+            batch_timeout=30.0)
+
+    stream_buffer.put(make_span(0))
+
+    def put_later():
+        time.sleep(0.05)
+        stream_buffer.put(make_span(1))
+
+    thread = threading.Thread(target=put_later)
+    thread.start()
+
+    start = time.time()
+    batch = next(stream_buffer)
+    thread.join()
+
+    assert len(batch.spans) == 2
+    assert time.time() - start < 5.0
+
+
+def test_shutdown_stops_iteration():
+    stream_buffer = StreamBuffer(10, batching=True)
+
+    def shutdown_later():
+        time.sleep(0.05)
+        stream_buffer.shutdown()
+
+    thread = threading.Thread(target=shutdown_later)
+    thread.start()
+
+    with pytest.raises(StopIteration):
+        next(stream_buffer)
+
+    thread.join()
+
+    # Spans put after shutdown are ignored.
+    stream_buffer.put(make_span(0))
+    assert stream_buffer.stats() == (0, 0)
+
+
+def test_shutdown_sends_partial_batch():
+    stream_buffer = StreamBuffer(10, batching=True, batch_size=100,
+            batch_timeout=30.0)
+
+    stream_buffer.put(make_span(0))
+
+    def shutdown_later():
+        time.sleep(0.05)
+        stream_buffer.shutdown()
+
+    thread = threading.Thread(target=shutdown_later)
+    thread.start()
+
+    start = time.time()
+    batch = next(stream_buffer)
+    thread.join()
+
+    # The spans held in a partial batch when shutdown occurs are sent
+    # before iteration stops.
+    assert [span.trace_id for span in batch.spans] == ['0']
+    assert time.time() - start < 5.0
+
+    with pytest.raises(StopIteration):
+        next(stream_buffer)
@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import threading
+import time
 
 from newrelic.core.agent_streaming import StreamingRpc
 from newrelic.common.streaming_utils import StreamBuffer
@@ -104,3 +105,39 @@ def test_close_while_awaiting_reconnect(mock_grpc_server, monkeypatch):
     rpc.close()
     # Make sure the processing_thread is closed
     assert not rpc.response_processing_thread.is_alive()
+
+
+def test_batched_spans_sent(mock_grpc_server, buffer_empty_event):
+    from _test_handler import SPAN_BATCH_SIZES
+
+    del SPAN_BATCH_SIZES[:]
+
+    endpoint = "localhost:%s" % mock_grpc_server
+    stream_buffer = StreamBuffer(10, batching=True, batch_size=3,
+            batch_timeout=0.05)
+
+    rpc = StreamingRpc(
+        endpoint, stream_buffer, DEFAULT_METADATA, record_metric, ssl=False
+    )
+
+    rpc.connect()
+
+    buffer_empty_event.clear()
+
+    for _ in range(5):
+        span = Span(intrinsics={}, agent_attributes={}, user_attributes={})
+        stream_buffer.put(span)
+
+    # Wait until all the spans have been taken from the buffer and then
+    # for the server to have received them.
+    assert buffer_empty_event.wait(5)
+
+    deadline = time.time() + 5
+    while sum(SPAN_BATCH_SIZES) < 5 and time.time() < deadline:
+        time.sleep(0.01)
+
+    rpc.close()
+
+    assert sum(SPAN_BATCH_SIZES) == 5
+    assert max(SPAN_BATCH_SIZES) <= 3
+    assert stream_buffer.stats() == (5, 0)
@@ -24,7 +24,12 @@ import pytest
 import newrelic.packages.six as six
 from newrelic.common import certs, system_info
 from newrelic.common.agent_http import DeveloperModeClient
-from newrelic.common.encoding_utils import json_decode, serverless_payload_decode
+from newrelic.common.encoding_utils import (
+    json_decode,
+    json_encode,
+    json_encode_chunks,
+    serverless_payload_decode,
+)
 from newrelic.common.utilization import CommonUtilization
 from newrelic.core.agent_protocol import AgentProtocol, ServerlessModeProtocol
 from newrelic.core.config import (
@@ -218,6 +223,47 @@ def test_send(status_code):
     assert protocol.finalize() is None
 
 
+def test_send_streaming_payload():
+    HttpClientRecorder.STATUS_CODE = 202
+    settings = finalize_application_settings(
+        {
+            "agent_run_id": "RUN_TOKEN",
+            "agent_limits.data_compression_streaming": True,
+        }
+    )
+    protocol = AgentProtocol(settings, client_cls=HttpClientRecorder)
+    payload = ("RUN_TOKEN", {"events_seen": 2}, ([{"a": b"\xe9"}, 1], [{}, 2]))
+    response = protocol.send("span_event_data", payload)
+    assert response is None
+
+    request = HttpClientRecorder.SENT[0]
+
+    # The payload is handed to the client as chunks which, when joined,
+    # are identical to the payload encoded in one go.
+    assert not isinstance(request.payload, bytes)
+    assert b"".join(request.payload) == json_encode(payload).encode("utf-8")
+
+
+def test_json_encode_chunks():
+    payload = (
+        "RUN_TOKEN",
+        {"reservoir_size": 2, "events_seen": 2},
+        (e for e in ([{"a": b"\xe9"}, {}, {}], [{"b": 1.5}, {}, {}])),
+    )
+    expected = json_encode(
+        (
+            "RUN_TOKEN",
+            {"reservoir_size": 2, "events_seen": 2},
+            [[{"a": b"\xe9"}, {}, {}], [{"b": 1.5}, {}, {}]],
+        )
+    )
+
+    chunks = list(json_encode_chunks(payload))
+
+    assert len(chunks) > 1
+    assert "".join(chunks) == expected
+
+
 @pytest.mark.parametrize(
     "status_code,expected_exc,log_level",
     (
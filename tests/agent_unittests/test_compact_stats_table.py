@@ -0,0 +1,102 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+
+import pytest
+
+from newrelic.core.stats_engine import (ApdexStats, CompactStatsTable,
+        CountStats, TimeStats)
+
+STATS_TYPES = (TimeStats, CountStats, ApdexStats)
+
+
+def _random_stats(stats_type, rng):
+    stats = stats_type()
+    if stats_type is CountStats:
+        stats[0] = rng.randint(0, 5)
+    elif stats_type is ApdexStats:
+        apdex_t = rng.choice((0.0, 0.5, 1.0))
+        stats[:] = [rng.randint(0, 3), rng.randint(0, 3), rng.randint(0, 3),
+                apdex_t, apdex_t, 0]
+    else:
+        count = rng.randint(0, 3)
+        stats[:] = [count, rng.random(), rng.random(), rng.random(),
+                rng.random(), rng.random()]
+    return stats
+
+
+def _tables(keys, rng):
+    table = CompactStatsTable()
+    expected = {}
+
+    for key in keys:
+        stats_type = STATS_TYPES[int(key[0].split('/')[1]) % 3]
+        stats = _random_stats(stats_type, rng)
+        table[key] = stats
+        expected[key] = stats
+
+    return table, expected
+
+
+@pytest.mark.parametrize('order', ('same', 'shuffled', 'disjoint'))
+def test_merge_table(order):
+    rng = random.Random(order)
+
+    keys = [('Metric/%d' % index, '') for index in range(50)]
+    other_keys = list(keys[10:40])
+
+    if order == 'shuffled':
+        rng.shuffle(other_keys)
+    elif order == 'disjoint':
+        other_keys = [('Other/%d' % index, '') for index in range(30)]
+
+    table, expected = _tables(keys, rng)
+    other, other_expected = _tables(other_keys, rng)
+
+    table.merge_table(other)
+
+    for key, stats in other_expected.items():
+        if key in expected:
+            expected[key].merge_stats(stats)
+        else:
+            expected[key] = stats
+
+    assert sorted(table.keys()) == sorted(expected.keys())
+
+    for key, stats in expected.items():
+        assert list(table[key]) == list(stats)
+        assert table[key].kind == table._kinds[table._index[key]]
+
+
+def test_merge_table_into_empty():
+    rng = random.Random(0)
+    keys = [('Metric/%d' % index, '') for index in range(20)]
+
+    other, expected = _tables(keys, rng)
+    table = CompactStatsTable()
+
+    table.merge_table(other)
+
+    assert table.keys() == keys
+    assert [list(table[key]) for key in keys] == [
+            list(expected[key]) for key in keys]
+
+
+def test_row_not_hashable():
+    table = CompactStatsTable()
+    table[('Metric', '')] = TimeStats()
+
+    with pytest.raises(TypeError):
+        hash(table[('Metric', '')])
@@ -0,0 +1,140 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from newrelic.common.lru_cache import LRUCache
+from newrelic.core.config import global_settings
+from newrelic.core.database_utils import (SQLStatement, _sql_parse_cache,
+        _obfuscation_engines)
+
+from testing_support.fixtures import override_generic_settings
+
+
+class DummyDB(object):
+    def __init__(self, quoting_style):
+        self.quoting_style = quoting_style
+
+
+@pytest.fixture(autouse=True)
+def clear_sql_parse_cache():
+    _sql_parse_cache.clear()
+    yield
+    _sql_parse_cache.clear()
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+
+    cache.put('c', 3)
+
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+    assert len(cache) == 2
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_statement_results_shared():
+    sql = "SELECT * FROM users WHERE name = 'bob' AND id = 1"
+
+    first = SQLStatement(sql, DummyDB('single'))
+    assert first.obfuscated == 'SELECT * FROM users WHERE name = ? AND id = ?'
+    assert first.operation == 'select'
+    assert first.target == 'users'
+
+    second = SQLStatement(sql, DummyDB('single'))
+    assert second._parsed is first._parsed
+    assert second.normalized == first.normalized
+    assert second.identifier == first.identifier
+
+
+def test_statement_cache_keyed_by_quoting_style():
+    sql = 'SELECT * FROM users WHERE name = "bob"'
+
+    single = SQLStatement(sql, DummyDB('single'))
+    double = SQLStatement(sql, DummyDB('single+double'))
+
+    assert single._parsed is not double._parsed
+    assert single.obfuscated == 'SELECT * FROM users WHERE name = "bob"'
+    assert double.obfuscated == 'SELECT * FROM users WHERE name = ?'
+
+
+def test_statement_cache_keyed_by_obfuscation_engine(monkeypatch):
+    monkeypatch.setitem(_obfuscation_engines, 'redact',
+            lambda sql, database: 'REDACTED')
+
+    sql = "SELECT * FROM users WHERE name = 'bob'"
+
+    statement = SQLStatement(sql, DummyDB('single'))
+    assert statement.obfuscated == 'SELECT * FROM users WHERE name = ?'
+
+    @override_generic_settings(global_settings(), {
+        'transaction_tracer.sql_obfuscation_engine': 'redact',
+    })
+    def _test():
+        other = SQLStatement(sql, DummyDB('single'))
+        assert other._parsed is not statement._parsed
+        assert other.obfuscated == 'REDACTED'
+
+        # A statement created before the engine was changed also picks
+        # up the results for the new engine.
+
+        assert statement.obfuscated == 'REDACTED'
+        assert statement.normalized == other.normalized
+        assert statement.identifier == other.identifier
+
+    _test()
+
+    assert statement.obfuscated == 'SELECT * FROM users WHERE name = ?'
+
+
+@override_generic_settings(global_settings(), {
+    'agent_limits.sql_statement_cache_size': 2,
+})
+def test_statement_cache_bounded():
+    for index in range(5):
+        SQLStatement('SELECT %d' % index, DummyDB('single')).obfuscated
+
+    assert len(_sql_parse_cache) == 2
+
+
+@override_generic_settings(global_settings(), {
+    'agent_limits.sql_statement_cache_size': 0,
+})
+def test_statement_cache_disabled():
+    statement = SQLStatement('SELECT 1', DummyDB('single'))
+    assert statement.obfuscated == 'SELECT ?'
+    assert len(_sql_parse_cache) == 0
+
+
+@override_generic_settings(global_settings(), {
+    'agent_limits.sql_query_length_maximum': 10,
+})
+def test_long_statement_not_cached():
+    statement = SQLStatement('SELECT * FROM users', DummyDB('single'))
+    assert statement.target == 'users'
+    assert len(_sql_parse_cache) == 0
+
+
+def test_undecodable_statement():
+    statement = SQLStatement(b'SELECT \xff', DummyDB('single'))
+    assert statement.obfuscated == ''
+    assert statement.operation == ''
+    assert len(_sql_parse_cache) == 0
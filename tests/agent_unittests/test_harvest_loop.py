@@ -12,10 +12,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import random
 import pytest
 import six
+import stat
 import tempfile
+import threading
 import time
 
 from newrelic.common.object_wrapper import (transient_function_wrapper,
@@ -26,14 +29,21 @@ from testing_support.fixtures import (override_generic_settings,
 
 from newrelic.common.agent_http import DeveloperModeClient
 from newrelic.core.application import Application
-from newrelic.core.stats_engine import CustomMetrics, SampledDataSet
+from newrelic.core.data_collector import (DeveloperModeSession,
+        LocalAggregatorSession)
+from newrelic.core.local_aggregator import (LocalAggregator,
+        LocalAggregatorUnavailable)
+from newrelic.core.stats_engine import (CustomMetrics, SampledDataSet,
+        StatsEngine)
 from newrelic.core.transaction_node import TransactionNode
 from newrelic.core.root_node import RootNode
 from newrelic.core.custom_event import create_custom_event
+from newrelic.core.database_utils import SQLConnections
 from newrelic.core.error_node import ErrorNode
 from newrelic.core.function_node import FunctionNode
 
-from newrelic.network.exceptions import RetryDataForRequest, ForceAgentDisconnect
+from newrelic.network.exceptions import (RetryDataForRequest,
+        ForceAgentDisconnect, DiscardDataForRequest, PayloadTooLarge)
 
 settings = global_settings()
 
@@ -91,6 +101,7 @@ def transaction_node(request):
             path='OtherTransaction/Function/main',
             trusted_parent_span=None,
             tracing_vendors=None,
+            folded_segment_count=0,
     )
 
     node = TransactionNode(
@@ -118,6 +129,7 @@ def transaction_node(request):
             apdex_t=0.5,
             suppress_apdex=False,
             custom_metrics=CustomMetrics(),
+            folded_metrics=(),
             guid='4485b89db608aece',
             cpu_time=0.0,
             suppress_transaction_trace=False,
@@ -363,6 +375,91 @@ def test_application_harvest_with_spans(distributed_tracing_enabled,
     _test()
 
 
+@override_generic_settings(settings, {
+    'developer_mode': True,
+    'license_key': '**NOT A LICENSE KEY**',
+    'distributed_tracing.enabled': True,
+    'span_events.enabled': True,
+    'event_harvest_config.harvest_limits.span_event_data': 5,
+})
+def test_span_events_not_created_when_reservoir_full(transaction_node):
+    app = Application('Python Agent Test (Harvest Loop)')
+    app.connect_to_data_collector(None)
+
+    span_count = transaction_node.span_count()
+    created = []
+
+    @transient_function_wrapper('newrelic.core.node_mixin',
+            'GenericNodeMixin.span_event')
+    def _count_span_event(wrapped, instance, args, kwargs):
+        created.append(instance)
+        return wrapped(*args, **kwargs)
+
+    _count_span_event(app.record_transaction)(transaction_node)
+
+    # Span creation stops once the reservoir is full.
+    assert len(created) == 5
+
+    span_events = app._stats_engine.span_events
+    assert span_events.num_samples == 5
+    assert span_events.num_seen == span_count
+
+    # A transaction with the same priority can't displace any of the
+    # stored span events, so no span events are created for it.
+    _count_span_event(app.record_transaction)(transaction_node)
+
+    assert len(created) == 5
+    assert span_events.num_samples == 5
+    assert span_events.num_seen == 2 * span_count
+
+
+@override_generic_settings(settings, {
+    'developer_mode': True,
+    'license_key': '**NOT A LICENSE KEY**',
+    'event_harvest_config.harvest_limits.analytic_event_data': 1,
+    'event_harvest_config.harvest_limits.error_event_data': 1,
+})
+def test_events_not_created_when_reservoir_full(transaction_node):
+    app = Application('Python Agent Test (Harvest Loop)')
+    app.connect_to_data_collector(None)
+
+    num_errors = len(transaction_node.errors)
+    created = []
+
+    @transient_function_wrapper('newrelic.core.transaction_node',
+            'TransactionNode.transaction_event')
+    def _count_transaction_event(wrapped, instance, args, kwargs):
+        created.append('transaction')
+        return wrapped(*args, **kwargs)
+
+    @transient_function_wrapper('newrelic.core.transaction_node',
+            'TransactionNode.error_events')
+    def _count_error_events(wrapped, instance, args, kwargs):
+        created.append('error')
+        return wrapped(*args, **kwargs)
+
+    record_transaction = _count_error_events(_count_transaction_event(
+            app.record_transaction))
+
+    record_transaction(transaction_node)
+
+    assert sorted(created) == ['error', 'transaction']
+
+    # A transaction with the same priority can't displace the stored
+    # events, so its events are only counted as seen.
+    record_transaction(transaction_node)
+
+    assert sorted(created) == ['error', 'transaction']
+
+    transaction_events = app._stats_engine.transaction_events
+    assert transaction_events.num_samples == 1
+    assert transaction_events.num_seen == 2
+
+    error_events = app._stats_engine.error_events
+    assert error_events.num_samples == 1
+    assert error_events.num_seen == 2 * num_errors
+
+
 @pytest.mark.parametrize(
     'span_queue_size, spans_to_send, expected_seen, expected_sent', (
     (0, 1, 1, 0),
@@ -450,6 +547,403 @@ def test_transaction_count(transaction_node):
     assert app._transaction_count == 0
 
 
+@pytest.mark.parametrize('worker_threads', (1, 2))
+@override_generic_settings(settings, {
+    'developer_mode': True,
+    'license_key': '**NOT A LICENSE KEY**',
+    'feature_flag': set(),
+    'collect_custom_events': False,
+    'transaction_recording.background_enabled': True,
+})
+def test_background_transaction_recording(transaction_node, worker_threads):
+    settings.transaction_recording.worker_threads = worker_threads
+
+    app = Application('Python Agent Test (Harvest Loop)')
+    app.connect_to_data_collector(None)
+
+    for _ in range(3):
+        app.record_transaction(transaction_node)
+
+    assert app._recording_queue is not None
+    assert app._recording_queue.flush(timeout=10.0)
+    assert app._transaction_count == 3
+
+    metrics = {}
+
+    @transient_function_wrapper('newrelic.core.application',
+            'StatsEngine.merge_custom_metrics')
+    def _capture_internal_metrics(wrapped, instance, args, kwargs):
+        internal_metrics = list(args[0])
+        metrics.update(internal_metrics)
+        return wrapped(internal_metrics)
+
+    _capture_internal_metrics(app.harvest)()
+
+    assert app._transaction_count == 0
+
+    prefix = 'Supportability/Python/RecordTransaction/Queue/'
+    assert metrics[prefix + 'Enqueued'][0] == 3
+    assert metrics[prefix + 'Dropped'][0] == 0
+
+    app.internal_agent_shutdown(restart=False)
+    assert not any(t.is_alive() for t in app._recording_queue._threads)
+
+
+@pytest.mark.parametrize('overflow_policy,recorded', (
+    ('drop', 0),
+    ('inline', 1),
+))
+@override_generic_settings(settings, {
+    'developer_mode': True,
+    'license_key': '**NOT A LICENSE KEY**',
+    'feature_flag': set(),
+    'collect_custom_events': False,
+    'transaction_recording.background_enabled': True,
+    'transaction_recording.queue_size': 1,
+})
+def test_background_transaction_recording_overflow(transaction_node,
+        overflow_policy, recorded):
+    settings.transaction_recording.overflow_policy = overflow_policy
+
+    app = Application('Python Agent Test (Harvest Loop)')
+    app.connect_to_data_collector(None)
+
+    queue = app._get_recording_queue(app._stats_engine.settings)
+
+    # Block the worker thread so the queue fills up.
+
+    blocked = threading.Event()
+    release = threading.Event()
+
+    def _blocking_record(data):
+        blocked.set()
+        release.wait(10.0)
+
+    queue._record = _blocking_record
+
+    try:
+        app.record_transaction(transaction_node)
+        assert blocked.wait(10.0)
+
+        app.record_transaction(transaction_node)
+        queue._record = app._record_transaction
+        app.record_transaction(transaction_node)
+
+    finally:
+        release.set()
+
+    assert queue.flush(timeout=10.0)
+
+    # One blocked transaction was discarded by the blocking recorder and
+    # one was recorded by the worker once unblocked. The third is either
+    # dropped or recorded on the calling thread.
+
+    assert app._transaction_count == 1 + recorded
+
+    metrics = dict(queue.metrics())
+    prefix = 'Supportability/Python/RecordTransaction/Queue/'
+    assert metrics[prefix + 'Dropped'] == {'count': 1 - recorded}
+    assert metrics[prefix + 'Inline'] == {'count': recorded}
+
+    queue.shutdown(timeout=10.0)
+
+
+class AggregatorAgent(object):
+    def __init__(self, application):
+        self._application = application
+
+    def activate_application(self, app_name, linked_applications=[],
+            timeout=None):
+        pass
+
+    def application(self, app_name):
+        if app_name == self._application.name:
+            return self._application
+
+
+@override_generic_settings(settings, {
+    'developer_mode': True,
+    'license_key': '**NOT A LICENSE KEY**',
+    'feature_flag': set(),
+})
+def test_local_aggregator_harvest(transaction_node, tmpdir):
+    # The directory holding the socket is created private to the user.
+    socket_path = str(tmpdir.join('aggregator', 'aggregator.sock'))
+
+    aggregator_app = Application('Python Agent Test (Harvest Loop)')
+    aggregator_app.connect_to_data_collector(None)
+
+    aggregator = LocalAggregator(socket_path,
+            AggregatorAgent(aggregator_app))
+    aggregator.start()
+
+    @override_generic_settings(settings, {
+        'developer_mode': False,
+        'local_daemon.enabled': True,
+        'local_daemon.socket_path': socket_path,
+        'transaction_tracer.transaction_threshold': 0.0,
+    })
+    def _connect():
+        app = Application('Python Agent Test (Harvest Loop)')
+        app.connect_to_data_collector(None)
+        return app
+
+    class DataSampler(object):
+        name = 'Data Sampler'
+
+        def metrics(self):
+            yield 'Custom/DataSampler', 1
+
+    try:
+        assert stat.S_IMODE(os.stat(str(tmpdir.join('aggregator'))).st_mode) \
+                == 0o700
+        assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+
+        app = _connect()
+
+        assert app._active_session.LOCAL_AGGREGATOR
+        assert (app._active_session.agent_run_id ==
+                aggregator_app._active_session.agent_run_id)
+
+        app._data_samplers.append(DataSampler())
+
+        for _ in range(3):
+            app.record_transaction(transaction_node)
+
+        app.harvest()
+
+        # The data is forwarded to the aggregator and the data held by
+        # this process reset.
+        assert app._transaction_count == 0
+        assert app._stats_engine.transaction_events.num_seen == 0
+
+        assert aggregator_app._transaction_count == 3
+        stats_engine = aggregator_app._stats_engine
+        assert stats_engine.stats_table[
+                ('OtherTransaction/Function/main', '')][0] == 3
+        assert stats_engine.transaction_events.num_seen == 3
+        assert stats_engine.custom_events.num_seen == (
+                3 * transaction_node.custom_events.num_seen)
+        assert len(stats_engine.error_data()) == min(
+                3 * len(transaction_node.errors),
+                settings.agent_limits.errors_per_harvest)
+
+        # The metrics recorded at each harvest, including those from the
+        # data samplers, are forwarded along with the transaction trace.
+        assert stats_engine.stats_table[('Custom/DataSampler', '')][0] == 1
+        assert stats_engine.stats_table[('Instance/Reporting', '')][0] == 1
+
+        with SQLConnections() as connections:
+            traces = stats_engine.transaction_trace_data(connections)
+
+        assert len(traces) == 1
+        assert traces[0][2] == 'OtherTransaction/Function/main'
+
+        aggregator_app.harvest()
+
+        # When the aggregator cannot be reached the data is retained to
+        # be forwarded with the next harvest.
+        aggregator.stop()
+
+        app.record_transaction(transaction_node)
+        app.harvest()
+
+        assert app._transaction_count == 1
+        assert app._stats_engine.transaction_events.num_seen == 1
+
+    finally:
+        aggregator.stop()
+
+
+@override_generic_settings(settings, {
+    'agent_limits.slow_sql_data': 2,
+})
+def test_forwarded_traces_and_slow_sql_limited():
+    stats_engine = StatsEngine()
+    stats_engine.reset_stats(finalize_application_settings())
+
+    def forwarded_data(traces, slow_sql):
+        data_set = [10, 0, []]
+        return {
+            'metrics': [],
+            'transaction_events': data_set,
+            'synthetics_events': [10, 0, []],
+            'error_events': data_set,
+            'custom_events': data_set,
+            'span_events': data_set,
+            'errors': [],
+            'transaction_traces': traces,
+            'slow_sql': slow_sql,
+        }
+
+    def trace(duration, synthetics_resource_id=None):
+        return [0, duration, 'path', None, 'data', 'guid', None, False,
+                None, synthetics_resource_id]
+
+    def slow_sql(max_call_time):
+        return ['path', None, max_call_time, 'SELECT ?', 'metric', 1,
+                max_call_time, max_call_time, max_call_time, 'params']
+
+    stats_engine.merge_forwarded_data(forwarded_data(
+            [trace(1.0), trace(2.0, 'synthetics')],
+            [slow_sql(1.0), slow_sql(3.0)]))
+    stats_engine.merge_forwarded_data(forwarded_data(
+            [trace(3.0)], [slow_sql(2.0)]))
+
+    # Only the slowest forwarded trace is kept, along with those for
+    # Synthetics transactions, and only the slowest slow SQL.
+
+    with SQLConnections() as connections:
+        traces = stats_engine.transaction_trace_data(connections)
+        slow_sql_data = stats_engine.slow_sql_data(connections)
+
+    assert sorted(t[1] for t in traces) == [2.0, 3.0]
+    assert sorted(s[8] for s in slow_sql_data) == [2.0, 3.0]
+
+    # The forwarded data is reset by the harvest.
+
+    stats_engine.harvest_snapshot()
+
+    with SQLConnections() as connections:
+        assert stats_engine.transaction_trace_data(connections) == []
+        assert stats_engine.slow_sql_data(connections) == []
+
+
+@override_generic_settings(settings, {
+    'developer_mode': True,
+    'license_key': '**NOT A LICENSE KEY**',
+    'feature_flag': set(),
+})
+def test_local_aggregator_insecure_directory(tmpdir):
+    directory = tmpdir.mkdir('aggregator')
+    directory.chmod(0o755)
+    socket_path = str(directory.join('aggregator.sock'))
+
+    aggregator_app = Application('Python Agent Test (Harvest Loop)')
+    aggregator_app.connect_to_data_collector(None)
+
+    aggregator = LocalAggregator(socket_path,
+            AggregatorAgent(aggregator_app))
+
+    # The aggregator refuses to listen in a directory accessible to other
+    # users, and processes refuse to connect to a socket in one.
+
+    with pytest.raises(EnvironmentError):
+        aggregator.start()
+
+    directory.chmod(0o700)
+    aggregator.start()
+
+    try:
+        directory.chmod(0o755)
+
+        @override_generic_settings(settings, {
+            'developer_mode': False,
+            'local_daemon.socket_path': socket_path,
+        })
+        def _connect():
+            LocalAggregatorSession('Python Agent Test (Harvest Loop)', [],
+                    [], settings)
+
+        with pytest.raises(LocalAggregatorUnavailable):
+            _connect()
+
+    finally:
+        directory.chmod(0o700)
+        aggregator.stop()
+
+
+@override_generic_settings(settings, {
+    'local_daemon.socket_path': '/nonexistent/aggregator.sock',
+})
+def test_local_aggregator_unavailable():
+    with pytest.raises(LocalAggregatorUnavailable):
+        LocalAggregatorSession('Python Agent Test (Harvest Loop)', [], [],
+                settings)
+
+
+@override_generic_settings(settings, {
+    'developer_mode': True,
+    'license_key': '**NOT A LICENSE KEY**',
+    'feature_flag': set(),
+    'collect_custom_events': False,
+    'transaction_recording.stats_shards': 4,
+})
+def test_sharded_stats_aggregation(transaction_node):
+    app = Application('Python Agent Test (Harvest Loop)')
+    app.connect_to_data_collector(None)
+
+    assert len(app._stats_shards) == 4
+
+    def _record():
+        for _ in range(5):
+            app.record_transaction(transaction_node)
+
+    threads = [threading.Thread(target=_record) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Transactions are held in the shards until harvest.
+    assert app._transaction_count == 0
+    assert sum(s.transaction_count for s in app._stats_shards) == 20
+
+    with app._stats_lock:
+        app._merge_stats_shards()
+
+    assert app._transaction_count == 20
+    assert all(s.transaction_count == 0 for s in app._stats_shards)
+
+    stats_engine = app._stats_engine
+    assert stats_engine.stats_table[
+            ('OtherTransaction/Function/main', '')][0] == 20
+    assert stats_engine.transaction_events.num_seen == 20
+
+    app.harvest()
+
+    assert app._transaction_count == 0
+
+
+@override_generic_settings(settings, {
+    'developer_mode': True,
+    'license_key': '**NOT A LICENSE KEY**',
+    'feature_flag': set(),
+    'collect_custom_events': False,
+})
+def test_compact_stats_table_metric_data(transaction_node):
+    def _metric_data(compact_stats_table):
+        settings.transaction_recording.compact_stats_table = \
+                compact_stats_table
+
+        app = Application('Python Agent Test (Harvest Loop)')
+        app.connect_to_data_collector(None)
+
+        for _ in range(3):
+            app.record_transaction(transaction_node)
+
+        app.record_custom_metric('CustomMetric/Int', 1)
+        app.record_custom_metric('CustomMetric/Count', {'count': 2})
+
+        with app._stats_lock:
+            stats = app._stats_engine.harvest_snapshot()
+
+        stats.merge_metric_stats(app._stats_custom_engine.harvest_snapshot())
+
+        # Supportability metrics include timings which vary between runs.
+
+        return sorted(((key['name'], key['scope']), list(value))
+                for key, value in stats.metric_data()
+                if not key['name'].startswith('Supportability/'))
+
+    expected = _metric_data(False)
+    compact = _metric_data(True)
+
+    assert compact == expected
+    assert dict(compact)[('OtherTransaction/Function/main', '')][0] == 3
+    assert dict(compact)[('CustomMetric/Count', '')][0] == 2
+
+
 @override_generic_settings(settings, {
     'developer_mode': True,
     'license_key': '**NOT A LICENSE KEY**',
@@ -741,6 +1235,312 @@ def test_reset_synthetics_events():
     assert app._stats_engine.transaction_events.num_seen == 1
 
 
+@override_generic_settings(settings, {
+        'developer_mode': True,
+        'license_key': '**NOT A LICENSE KEY**',
+        'distributed_tracing.enabled': True,
+        'span_events.enabled': True,
+        'agent_limits.max_parallel_harvest_requests': 4,
+})
+def test_parallel_harvest_requests():
+    senders = {}
+
+    @transient_function_wrapper('newrelic.core.agent_protocol',
+            'AgentProtocol.send')
+    def record_sender(wrapped, instance, args, kwargs):
+        def _bind_params(method, *args, **kwargs):
+            return method
+
+        method = _bind_params(*args, **kwargs)
+        senders[method] = threading.current_thread().name
+        return wrapped(*args, **kwargs)
+
+    @record_sender
+    def _test():
+        app = Application('Python Agent Test (Harvest Loop)')
+        app.connect_to_data_collector(None)
+
+        app._stats_engine.transaction_events.add('transaction event')
+        app._stats_engine.error_events.add('error event')
+        app._stats_engine.custom_events.add('custom event')
+        app._stats_engine.span_events.add('span event')
+
+        app.harvest()
+
+        assert app._stats_engine.transaction_events.num_seen == 0
+        assert app._stats_engine.error_events.num_seen == 0
+        assert app._stats_engine.custom_events.num_seen == 0
+        assert app._stats_engine.span_events.num_seen == 0
+
+    _test()
+
+    for method in ('analytic_event_data', 'error_event_data',
+            'custom_event_data', 'span_event_data'):
+        assert senders[method].startswith('NR-Harvest-Sender-')
+
+    # Metric data is always sent from the harvest thread after the
+    # other requests have completed.
+    assert senders['metric_data'] == threading.current_thread().name
+
+
+@override_generic_settings(settings, {
+        'developer_mode': True,
+        'license_key': '**NOT A LICENSE KEY**',
+        'agent_limits.max_parallel_harvest_requests': 4,
+})
+def test_parallel_harvest_requests_supportability_metrics():
+    metric_data = []
+
+    # The developer mode client does not record the supportability
+    # metrics for the request body, so these are recorded here as the
+    # client used for a real session would.
+
+    @transient_function_wrapper('newrelic.common.agent_http',
+            'DeveloperModeClient.send_request')
+    def record_supportability_metrics(wrapped, instance, args, kwargs):
+        def _bind_params(method='POST', path=None, params=None,
+                headers=None, payload=None):
+            return params, payload
+
+        params, payload = _bind_params(*args, **kwargs)
+        instance._supportability_request(params, payload, payload, None)
+        return wrapped(*args, **kwargs)
+
+    @transient_function_wrapper('newrelic.core.agent_protocol',
+            'AgentProtocol.send')
+    def record_metric_data(wrapped, instance, args, kwargs):
+        def _bind_params(method, payload=(), *args, **kwargs):
+            return method, payload
+
+        method, payload = _bind_params(*args, **kwargs)
+        if method == 'metric_data':
+            metric_data.extend(payload[3])
+        return wrapped(*args, **kwargs)
+
+    @record_supportability_metrics
+    @record_metric_data
+    def _test():
+        app = Application('Python Agent Test (Harvest Loop)')
+        app.connect_to_data_collector(None)
+
+        app._stats_engine.transaction_events.add('transaction event')
+        app._stats_engine.custom_events.add('custom event')
+
+        app.harvest()
+
+        # The data sent in parallel has been reset.
+        assert app._stats_engine.transaction_events.num_seen == 0
+        assert app._stats_engine.custom_events.num_seen == 0
+
+    _test()
+
+    metrics = dict((key['name'], stats) for key, stats in metric_data)
+
+    for method in ('analytic_event_data', 'custom_event_data'):
+        name = 'Supportability/Python/Collector/Output/Bytes/%s' % method
+        assert metrics[name][0] == 1
+        assert metrics[name][1] > 0
+
+
+@failing_endpoint('error_event_data', raises=DiscardDataForRequest)
+@failing_endpoint('analytic_event_data')
+@override_generic_settings(settings, {
+        'developer_mode': True,
+        'license_key': '**NOT A LICENSE KEY**',
+        'agent_limits.max_parallel_harvest_requests': 4,
+})
+def test_parallel_harvest_requests_failures():
+    methods = set(('analytic_event_data', 'error_event_data',
+            'custom_event_data'))
+    started = set()
+    all_started = threading.Event()
+
+    # No further requests are sent once one fails, so each request is
+    # held until all of them have been sent.
+
+    @transient_function_wrapper('newrelic.core.agent_protocol',
+            'AgentProtocol.send')
+    def wait_for_requests(wrapped, instance, args, kwargs):
+        def _bind_params(method, *args, **kwargs):
+            return method
+
+        method = _bind_params(*args, **kwargs)
+        if method in methods:
+            started.add(method)
+            if started == methods:
+                all_started.set()
+            all_started.wait(5.0)
+        return wrapped(*args, **kwargs)
+
+    app = Application('Python Agent Test (Harvest Loop)')
+    app.connect_to_data_collector(None)
+
+    app._stats_engine.transaction_events.add('transaction event')
+    app._stats_engine.error_events.add('error event')
+    app._stats_engine.custom_events.add('custom event')
+    app._stats_engine.record_custom_metric('CustomMetric/Int', 1)
+
+    wait_for_requests(app.harvest)()
+
+    # The request to be retried is rolled back into the next harvest
+    # along with the metric data, while the data sent successfully or
+    # which was discarded is not.
+    assert app._stats_engine.transaction_events.num_seen == 1
+    assert app._stats_engine.error_events.num_seen == 0
+    assert app._stats_engine.custom_events.num_seen == 0
+    assert app._discard_count == 1
+
+    stats_table = app._stats_engine.stats_table
+    assert stats_table[('CustomMetric/Int', '')][0] == 1
+
+
+@override_generic_settings(settings, {
+        'developer_mode': True,
+        'license_key': '**NOT A LICENSE KEY**',
+        'agent_limits.max_parallel_harvest_requests': 2,
+})
+def test_parallel_harvest_requests_stop_on_failure():
+    senders = []
+
+    @transient_function_wrapper('newrelic.core.agent_protocol',
+            'AgentProtocol.send')
+    def record_sender(wrapped, instance, args, kwargs):
+        def _bind_params(method, *args, **kwargs):
+            return method
+
+        method = _bind_params(*args, **kwargs)
+        senders.append(method)
+
+        if method == 'analytic_event_data':
+            raise ForceAgentDisconnect()
+
+        # Delay the request sent alongside the failing one so that the
+        # failure has been seen before the next request is dispatched.
+
+        if method == 'error_event_data':
+            time.sleep(0.2)
+
+        return wrapped(*args, **kwargs)
+
+    @record_sender
+    def _test():
+        app = Application('Python Agent Test (Harvest Loop)')
+        app.connect_to_data_collector(None)
+
+        app._stats_engine.transaction_events.add('transaction event')
+        app._stats_engine.error_events.add('error event')
+        app._stats_engine.custom_events.add('custom event')
+        app._stats_engine.record_custom_metric('CustomMetric/Int', 1)
+
+        app.harvest()
+
+        # The agent was told to disconnect, so the session is shutdown.
+        assert app._active_session is None
+
+    _test()
+
+    assert 'analytic_event_data' in senders
+    assert 'custom_event_data' not in senders
+    assert 'metric_data' not in senders
+
+
+@pytest.mark.parametrize('spool_enabled', (True, False))
+def test_payload_spool_harvest(tmpdir, spool_enabled):
+    payloads = []
+
+    @transient_function_wrapper('newrelic.core.agent_protocol',
+            'AgentProtocol.send')
+    def record_payloads(wrapped, instance, args, kwargs):
+        def _bind_params(method, payload=(), *args, **kwargs):
+            return method, payload
+
+        method, payload = _bind_params(*args, **kwargs)
+        if method == 'custom_event_data':
+            payloads.append(list(payload))
+        return wrapped(*args, **kwargs)
+
+    @failing_endpoint('custom_event_data')
+    @record_payloads
+    @override_generic_settings(settings, {
+            'developer_mode': True,
+            'license_key': '**NOT A LICENSE KEY**',
+            'payload_spool.enabled': spool_enabled,
+            'payload_spool.directory': str(tmpdir),
+    })
+    def _test():
+        app = Application('Python Agent Test (Harvest Loop)')
+        app.connect_to_data_collector(None)
+
+        app._stats_engine.custom_events.add('custom event')
+        app._stats_engine.record_custom_metric('CustomMetric/Int', 1)
+
+        app.harvest()
+
+        if spool_enabled:
+            # The failed payload was spooled, so the metric data was sent
+            # but the spooled payload was not counted as sent, nor was it
+            # replayed by the same harvest.
+            assert app._stats_engine.custom_events.num_seen == 0
+            assert ('CustomMetric/Int', '') not in \
+                    app._stats_engine.stats_table
+            assert len(payloads) == 1
+
+            app.harvest()
+
+            # The next harvest replays the spooled payload.
+            run_id = app._active_session.agent_run_id
+            assert payloads[1] == [run_id, payloads[0][1],
+                    ['custom event']]
+        else:
+            # The data is rolled back into the next harvest.
+            assert app._stats_engine.custom_events.num_seen == 1
+            assert ('CustomMetric/Int', '') in app._stats_engine.stats_table
+            assert len(payloads) == 1
+
+    _test()
+
+
+@override_generic_settings(settings, {
+        'developer_mode': True,
+        'license_key': '**NOT A LICENSE KEY**',
+})
+def test_payload_spooled_not_counted_as_sent(tmpdir):
+    metric_data = []
+
+    @transient_function_wrapper('newrelic.core.agent_protocol',
+            'AgentProtocol.send')
+    def record_metric_data(wrapped, instance, args, kwargs):
+        def _bind_params(method, payload=(), *args, **kwargs):
+            return method, payload
+
+        method, payload = _bind_params(*args, **kwargs)
+        if method == 'metric_data':
+            metric_data.extend(payload[3])
+        return wrapped(*args, **kwargs)
+
+    @failing_endpoint('custom_event_data')
+    @record_metric_data
+    @override_generic_settings(settings, {
+            'payload_spool.enabled': True,
+            'payload_spool.directory': str(tmpdir),
+    })
+    def _test():
+        app = Application('Python Agent Test (Harvest Loop)')
+        app.connect_to_data_collector(None)
+
+        app._stats_engine.custom_events.add('custom event')
+
+        app.harvest()
+
+    _test()
+
+    metrics = dict((key['name'], stats) for key, stats in metric_data)
+
+    assert metrics['Supportability/Python/PayloadSpool/Stored'][0] == 1
+    assert metrics['Supportability/Python/PayloadSpool/Replayed'][0] == 0
+    assert 'Supportability/Events/Customer/Sent' not in metrics
+
+
 @pytest.mark.parametrize('whitelist_event', ('analytic_event_data',
     'custom_event_data', 'error_event_data', 'span_event_data'))
 @override_generic_settings(settings, {
@@ -900,3 +1700,174 @@ def test_get_agent_commands_raises():
     app.connect_to_data_collector(None)
     with pytest.raises(RetryDataForRequest):
         app.process_agent_commands()
+
+
+def limited_payload_session(max_items, failure=None, fail_after=None):
+    # Creates a session for which payloads with more than the maximum
+    # number of items are rejected as too large, or for which the given
+    # failure is raised once the given number of payloads have been sent.
+
+    session = DeveloperModeSession('Python Agent Test (Harvest Loop)', [],
+            [], settings)
+    session.sent = []
+    session.sampling_info = []
+    session.rejected = []
+    session.payloads = []
+    session.failure = failure
+
+    def send(method, payload=()):
+        items = payload[-1]
+        if len(items) > max_items or 'oversize' in items:
+            session.rejected.append(items)
+            raise PayloadTooLarge()
+        if session.failure is not None and len(session.sent) == fail_after:
+            raise session.failure()
+        session.sent.append(list(items))
+        session.payloads.append(payload)
+        if len(payload) == 3 and isinstance(payload[1], dict):
+            session.sampling_info.append(payload[1])
+
+    session._protocol.send = send
+    return session
+
+
+SPLIT_SAMPLING_INFO = {'events_seen': 25, 'reservoir_size': 12}
+
+
+@pytest.mark.parametrize('send_method,args', (
+    ('send_transaction_events', (SPLIT_SAMPLING_INFO,)),
+    ('send_custom_events', (SPLIT_SAMPLING_INFO,)),
+    ('send_span_events', (SPLIT_SAMPLING_INFO,)),
+    ('send_error_events', (SPLIT_SAMPLING_INFO,)),
+    ('send_metric_data', (0.0, 1.0)),
+))
+@override_generic_settings(settings, {
+    'developer_mode': True,
+    'license_key': '**NOT A LICENSE KEY**',
+})
+def test_oversize_payload_split(send_method, args):
+    session = limited_payload_session(max_items=3)
+    send = getattr(session, send_method)
+    items = list(range(10))
+
+    send(*(args + (items,)))
+
+    assert [i for batch in session.sent for i in batch] == items
+    assert all(len(batch) <= 3 for batch in session.sent)
+    assert session.rejected
+
+    def _assert_sampling_info_shared():
+        # The counts in the sampling info are shared across the requests
+        # rather than being reported in full by each of them.
+
+        if send_method == 'send_metric_data':
+            assert not session.sampling_info
+            return
+
+        assert len(session.sampling_info) == len(session.sent)
+
+        for key, value in SPLIT_SAMPLING_INFO.items():
+            assert sum(info[key] for info in session.sampling_info) == value
+
+    _assert_sampling_info_shared()
+
+    # Later payloads for the same endpoint are split before being sent.
+    del session.sent[:], session.sampling_info[:], session.rejected[:]
+
+    send(*(args + (items,)))
+
+    assert [i for batch in session.sent for i in batch] == items
+    assert not session.rejected
+
+    _assert_sampling_info_shared()
+
+    assert SPLIT_SAMPLING_INFO == {'events_seen': 25, 'reservoir_size': 12}
+
+
+@override_generic_settings(settings, {
+    'developer_mode': True,
+    'license_key': '**NOT A LICENSE KEY**',
+})
+def test_oversize_item_discarded():
+    session = limited_payload_session(max_items=10)
+
+    session.send_span_events({}, [1, 'oversize', 2])
+    assert session.sent == [[1], [2]]
+
+    with pytest.raises(PayloadTooLarge):
+        session.send_span_events({}, ['oversize'])
+
+
+@override_generic_settings(settings, {
+    'developer_mode': True,
+    'license_key': '**NOT A LICENSE KEY**',
+    'max_payload_size_in_bytes': 30,
+})
+def test_payload_split_before_first_send():
+    session = limited_payload_session(max_items=4)
+    items = ['item-%d' % i for i in range(10)]
+
+    session.send_custom_events(SPLIT_SAMPLING_INFO, items)
+
+    # The estimated size of the payload exceeds the maximum payload size,
+    # so it is split without first being rejected as too large.
+    assert not session.rejected
+    assert len(session.sent) > 1
+    assert [i for batch in session.sent for i in batch] == items
+
+
+@override_generic_settings(settings, {
+    'developer_mode': True,
+    'license_key': '**NOT A LICENSE KEY**',
+    'payload_spool.enabled': False,
+})
+def test_split_payload_retry():
+    session = limited_payload_session(max_items=2,
+            failure=RetryDataForRequest, fail_after=0)
+
+    with pytest.raises(RetryDataForRequest):
+        session.send_span_events({}, [1, 2, 3, 4])
+
+    assert not session.sent
+
+
+@pytest.mark.parametrize('send_method,args', (
+    ('send_span_events', (SPLIT_SAMPLING_INFO,)),
+    ('send_metric_data', (0.0, 1.0)),
+))
+@override_generic_settings(settings, {
+    'developer_mode': True,
+    'license_key': '**NOT A LICENSE KEY**',
+    'payload_spool.enabled': False,
+})
+def test_split_payload_retry_remainder(send_method, args):
+    from newrelic.core.data_collector import PAYLOAD_SPOOLED
+
+    session = limited_payload_session(max_items=2,
+            failure=RetryDataForRequest, fail_after=1)
+    send = getattr(session, send_method)
+
+    # Once part of the data has been sent, it is not retried by the
+    # caller, with the remainder instead being held by the session.
+    assert send(*(args + ([1, 2, 3, 4],))) is PAYLOAD_SPOOLED
+    assert session.sent == [[1, 2]]
+
+    session.failure = None
+
+    # The remainder is not sent by the same harvest.
+    session.replay_spooled_payloads()
+    assert session.sent == [[1, 2]]
+
+    session.replay_spooled_payloads()
+    assert session.sent == [[1, 2], [3, 4]]
+
+    if send_method == 'send_metric_data':
+        # The remainder is sent with the same payload, so metric data is
+        # reported for the period it was collected over.
+        assert session.payloads[1][:-1] == session.payloads[0][:-1]
+    else:
+        for key, value in SPLIT_SAMPLING_INFO.items():
+            assert sum(info[key] for info in session.sampling_info) == value
+
+    session.replay_spooled_payloads()
+    assert session.sent == [[1, 2], [3, 4]]
@@ -0,0 +1,77 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from newrelic.core.config import global_settings
+from newrelic.core.harvest_schedule import HarvestSchedule, process_offset
+
+
+def test_process_offset_stable():
+    offset = process_offset()
+
+    assert 0.0 <= offset < 1.0
+    assert process_offset() == offset
+
+
+def test_staggered_schedule():
+    schedule = HarvestSchedule(offset=0.25)
+
+    # Harvests are a whole number of periods from the offset.
+    assert schedule.next_time(60.0, 1000.0) == 1035.0
+
+    # The time spent harvesting does not delay the next harvest, nor does
+    # the harvest thread waking early cause a harvest to be repeated.
+    assert schedule.next_time(60.0, 1035.5) == 1095.0
+    assert schedule.next_time(60.0, 1094.9) == 1155.0
+
+    # A harvest which was missed altogether is skipped.
+    assert schedule.next_time(60.0, 1230.0) == 1275.0
+
+
+def test_processes_staggered():
+    times = set(HarvestSchedule(offset=offset).next_time(60.0, 1000.0)
+            for offset in (0.0, 0.25, 0.5, 0.75))
+
+    assert times == set((1005.0, 1020.0, 1035.0, 1050.0))
+
+
+@pytest.mark.parametrize('jitter,maximum', (
+    (5.0, 5.0),
+    (100.0, 30.0),
+))
+def test_schedule_jitter(jitter, maximum):
+    schedule = HarvestSchedule(jitter=jitter, offset=0.0)
+
+    for index in range(20):
+        now = 1020.0 + index * 60.0
+        due = now + 60.0
+        assert due <= schedule.next_time(60.0, now) <= due + maximum
+
+        # Jitter does not accumulate from one harvest to the next.
+        assert schedule.due == due
+
+
+def test_schedule_not_staggered():
+    schedule = HarvestSchedule(staggered=False, jitter=5.0, offset=0.25)
+
+    assert schedule.next_time(60.0, 1000.0) == 1060.0
+    assert schedule.next_time(60.0, 1061.5) == 1121.5
+
+
+def test_staggering_disabled_by_default():
+    harvest_schedule = global_settings().harvest_schedule
+
+    assert harvest_schedule.staggered is False
+    assert harvest_schedule.jitter == 0.0
@@ -16,6 +16,7 @@ import base64
 import json
 import os.path
 import ssl
+import threading
 import zlib
 
 import pytest
@@ -246,6 +247,37 @@ def test_http_close_connection_in_context_manager():
         client.close_connection()
 
 
+@pytest.mark.parametrize("client_cls", (HttpClient, InsecureHttpClient))
+def test_http_concurrent_requests(server, insecure_server, client_cls):
+    port = insecure_server.port if client_cls is InsecureHttpClient else server.port
+    client = client_cls(
+        "localhost", port, disable_certificate_validation=True, max_connections=4,
+    )
+
+    results = []
+    connections = []
+
+    def _send():
+        for _ in range(2):
+            connections.append(client._connection)
+            status, data = client.send_request(payload=b"x" * 100)
+            results.append((status, data[-100:]))
+
+    threads = [threading.Thread(target=_send) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # All threads share a single connection pool sized for the number
+    # of concurrent requests.
+    assert len(set(id(c) for c in connections)) == 1
+    assert connections[0].pool.maxsize == 4
+    assert results == [(200, b"x" * 100)] * 8
+
+    client.close_connection()
+
+
 @pytest.mark.parametrize(
     "client_cls,method,threshold",
     (
@@ -257,9 +289,15 @@ def test_http_close_connection_in_context_manager():
         (ApplicationModeClient, "deflate", 100),
     ),
 )
-def test_http_payload_compression(server, client_cls, method, threshold):
+@pytest.mark.parametrize("chunked", (False, True))
+def test_http_payload_compression(server, client_cls, method, threshold, chunked):
     payload = b"*" * 20
 
+    if chunked:
+        sent = iter((payload[:7], payload[7:13], payload[13:]))
+    else:
+        sent = payload
+
     internal_metrics = CustomMetrics()
 
     with client_cls(
@@ -271,7 +309,7 @@ def test_http_payload_compression(server, client_cls, method, threshold):
     ) as client:
         with InternalTraceContext(internal_metrics):
             status, data = client.send_request(
-                payload=payload, params={"method": "test"}
+                payload=sent, params={"method": "test"}
             )
 
     assert status == 200
@@ -336,6 +374,76 @@ def test_http_payload_compression(server, client_cls, method, threshold):
     assert sent_payload == payload
 
 
+@pytest.mark.parametrize("chunked", (False, True))
+def test_adaptive_compression_ratio(server, chunked):
+    payload = b"*" * 20
+
+    if chunked:
+        sent = iter((payload[:7], payload[7:13], payload[13:]))
+    else:
+        sent = payload
+
+    internal_metrics = CustomMetrics()
+
+    with ApplicationModeClient(
+        "localhost",
+        server.port,
+        disable_certificate_validation=True,
+        compression_threshold=0,
+        compression_time_budget=0.1,
+    ) as client:
+        with InternalTraceContext(internal_metrics):
+            status, data = client.send_request(
+                payload=sent, params={"method": "test"}
+            )
+
+    assert status == 200
+    payload_byte_len = len(data.split(b"\n")[-1])
+
+    # The compression ratio is only recorded when the level is chosen
+    # adaptively.
+    internal_metrics = dict(internal_metrics.metrics())
+    ratio = internal_metrics["Supportability/Python/Collector/ZLIB/Ratio/test"]
+    assert ratio[:2] == [1, float(len(payload)) / payload_byte_len]
+    assert len(internal_metrics) == 4
+
+
+def test_adaptive_compression_level():
+    client = HttpClient("localhost", compression_time_budget=0.1)
+
+    # Without any measurements, the best level is tried first.
+    assert client._select_compression_level(1000) == 6
+
+    # Levels measured to be too slow for the payload are skipped over.
+    client._record_compression(6, 1000, 1.0)
+    assert client._select_compression_level(1000) == 3
+    assert client._select_compression_level(50) == 6
+
+    client._record_compression(3, 1000, 0.5)
+    client._record_compression(1, 1000, 0.25)
+    assert client._select_compression_level(1000) == 1
+
+    # The throughput is averaged over the measurements for a level.
+    client._record_compression(6, 1000, 0.01)
+    assert client._compression_throughput[6] == (1000.0 + 100000.0) / 2
+    assert client._select_compression_level(1000) == 6
+
+
+@pytest.mark.parametrize(
+    "compression_level,compression_time_budget",
+    ((None, None), (None, 0), (9, 0.1), (0, 0.1)),
+)
+def test_fixed_compression_level(compression_level, compression_time_budget):
+    client = HttpClient(
+        "localhost",
+        compression_level=compression_level,
+        compression_time_budget=compression_time_budget,
+    )
+    client._record_compression(compression_level or 6, 1000, 1.0)
+
+    assert client._select_compression_level(1000) == compression_level
+
+
 def test_cert_path(server):
     with HttpClient("localhost", server.port, ca_bundle_path=SERVER_CERT) as client:
         status, data = client.send_request()
@@ -0,0 +1,77 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from newrelic.common.encoding_utils import json_decode, json_encode
+from newrelic.common.overlay_dict import OverlayDict
+from newrelic.common.streaming_utils import SpanProtoAttrs
+
+
+def test_overlay_lookup():
+    base = {'a': 1, 'b': 2}
+    overlay = OverlayDict(base)
+    overlay['b'] = 3
+    overlay['c'] = 4
+
+    assert overlay['a'] == 1
+    assert overlay['b'] == 3
+    assert 'c' in overlay
+    assert overlay.get('d') is None
+    assert len(overlay) == 3
+    assert sorted(overlay) == ['a', 'b', 'c']
+    assert overlay == {'a': 1, 'b': 3, 'c': 4}
+    assert base == {'a': 1, 'b': 2}
+
+
+def test_overlay_shares_base():
+    base = {'a': 1}
+    first = OverlayDict(base, {'b': 2})
+    second = first.copy()
+    second['b'] = 3
+
+    assert first._base is second._base
+    assert first['b'] == 2
+    assert second['b'] == 3
+
+
+def test_overlay_delete_copies_base():
+    base = {'a': 1, 'b': 2}
+    overlay = OverlayDict(base, {'c': 3})
+
+    del overlay['a']
+    del overlay['c']
+
+    assert overlay == {'b': 2}
+    assert base == {'a': 1, 'b': 2}
+
+    with pytest.raises(KeyError):
+        del overlay['a']
+
+
+def test_overlay_json_encode():
+    overlay = OverlayDict({'a': 1, 'b': 2}, {'b': 3})
+    payload = [[overlay, {}, {}]]
+
+    assert json_decode(json_encode(payload)) == [[{'a': 1, 'b': 3}, {}, {}]]
+
+
+def test_overlay_expand_span_proto_attrs():
+    base = SpanProtoAttrs({'a': 1, 'b': 'x'})
+    data = SpanProtoAttrs({'b': True})
+
+    expanded = OverlayDict(base, data).expand()
+
+    assert type(expanded) is SpanProtoAttrs
+    assert expanded == SpanProtoAttrs({'a': 1, 'b': True})
@@ -0,0 +1,196 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import stat
+import time
+
+import pytest
+
+from newrelic.core.payload_spool import PayloadSpool
+
+
+@pytest.fixture
+def spool_dir(tmpdir):
+    # The spool creates its directory such that it is private to the user,
+    # which the temporary directory itself may not be.
+
+    return tmpdir.join('spool')
+
+
+def _replay_all(spool, limit=100):
+    replayed = []
+
+    def send(method, data):
+        replayed.append((method, data))
+        return True
+
+    spool.replay(send, limit)
+    return replayed
+
+
+def test_store_and_replay(spool_dir):
+    spool = PayloadSpool(str(spool_dir))
+
+    assert spool.store('analytic_event_data', '[1,2,3]')
+    assert spool.store('error_data', b'["error"]')
+
+    assert _replay_all(spool) == [
+        ('analytic_event_data', b'[1,2,3]'),
+        ('error_data', b'["error"]'),
+    ]
+
+    # Replayed payloads are removed from the spool.
+    assert _replay_all(spool) == []
+    assert os.listdir(str(spool_dir)) == []
+
+    metrics = dict(spool.metrics())
+    assert metrics['Supportability/Python/PayloadSpool/Stored'] == {
+            'count': 2}
+    assert metrics['Supportability/Python/PayloadSpool/Replayed'] == {
+            'count': 2}
+
+
+def test_replay_limit_and_failure(spool_dir):
+    spool = PayloadSpool(str(spool_dir), segment_size=1)
+
+    for index in range(5):
+        assert spool.store('custom_event_data', '[%d]' % index)
+
+    # Each payload is in a sealed segment of its own as the segment
+    # size is exceeded on every write.
+    assert len(os.listdir(str(spool_dir))) == 5
+
+    assert [d for _, d in _replay_all(spool, limit=2)] == [b'[0]', b'[1]']
+
+    attempts = []
+
+    def send(method, data):
+        attempts.append(data)
+        return False
+
+    assert spool.replay(send, 10) == 0
+    assert attempts == [b'[2]']
+
+    assert [d for _, d in _replay_all(spool)] == [b'[2]', b'[3]', b'[4]']
+
+
+def test_replay_exception_keeps_payload(spool_dir):
+    spool = PayloadSpool(str(spool_dir))
+    spool.store('span_event_data', '[1]')
+    spool.store('span_event_data', '[2]')
+
+    calls = []
+
+    def send(method, data):
+        calls.append(data)
+        if len(calls) == 2:
+            raise ValueError()
+        return True
+
+    with pytest.raises(ValueError):
+        spool.replay(send, 10)
+
+    assert [d for _, d in _replay_all(spool)] == [b'[2]']
+
+
+def test_size_cap_evicts_oldest(spool_dir):
+    payload = os.urandom(256)
+    spool = PayloadSpool(str(spool_dir), max_size=1024, segment_size=1,
+            compression_level=0)
+
+    for index in range(10):
+        assert spool.store('error_data', payload + str(index).encode())
+
+    total = sum(os.path.getsize(str(path)) for path in spool_dir.listdir())
+    assert total <= 1024
+
+    replayed = [d[-1:] for _, d in _replay_all(spool)]
+    assert replayed == [b'7', b'8', b'9']
+
+    metrics = dict(spool.metrics())
+    assert metrics['Supportability/Python/PayloadSpool/Evicted'] == {
+            'count': 7}
+
+
+def test_payload_larger_than_cap_not_stored(spool_dir):
+    spool = PayloadSpool(str(spool_dir), max_size=10, compression_level=0)
+
+    assert not spool.store('error_data', '[%s]' % ('1' * 100))
+
+    metrics = dict(spool.metrics())
+    assert metrics['Supportability/Python/PayloadSpool/Dropped'] == {
+            'count': 1}
+
+
+def test_age_eviction(spool_dir):
+    spool = PayloadSpool(str(spool_dir), max_age=60.0)
+    spool.store('error_data', '[1]')
+
+    # Age the segment beyond the maximum age.
+    past = time.time() - 120.0
+    for path in spool_dir.listdir():
+        os.utime(str(path), (past, past))
+
+    spool.store('error_data', '[2]')
+
+    assert [d for _, d in _replay_all(spool)] == [b'[2]']
+
+
+def test_truncated_segment(spool_dir):
+    spool = PayloadSpool(str(spool_dir))
+    spool.store('error_data', '[1]')
+    spool.store('error_data', '[2]')
+
+    # Simulate a process being killed part way through a write.
+    path, = spool_dir.listdir()
+    with open(str(path), 'rb+') as fp:
+        fp.truncate(os.path.getsize(str(path)) - 2)
+
+    assert [d for _, d in _replay_all(spool)] == [b'[1]']
+
+
+def test_spool_private_to_user(spool_dir):
+    spool = PayloadSpool(str(spool_dir))
+    assert spool.store('error_data', '[1]')
+
+    assert stat.S_IMODE(os.stat(str(spool_dir)).st_mode) == 0o700
+
+    path, = spool_dir.listdir()
+    assert stat.S_IMODE(os.stat(str(path)).st_mode) == 0o600
+
+
+@pytest.mark.skipif(not hasattr(os, 'getuid'),
+        reason='Spool directory ownership is not checked on this platform.')
+def test_insecure_directory_not_used(spool_dir):
+    spool = PayloadSpool(str(spool_dir))
+    assert spool.store('error_data', '[1]')
+
+    # Payloads are neither stored in nor replayed from a directory which
+    # other users could read from or plant payloads in.
+
+    spool_dir.chmod(0o755)
+
+    try:
+        assert not spool.store('error_data', '[2]')
+        assert _replay_all(spool) == []
+
+        metrics = dict(spool.metrics())
+        assert metrics['Supportability/Python/PayloadSpool/Dropped'] == {
+                'count': 1}
+
+    finally:
+        spool_dir.chmod(0o700)
+
+    assert [d for _, d in _replay_all(spool)] == [b'[1]']
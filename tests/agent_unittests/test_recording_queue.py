@@ -0,0 +1,90 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+
+from newrelic.core.recording_queue import RecordingQueue
+
+
+def test_flush_ignores_later_items():
+    events = {'early': threading.Event(), 'late': threading.Event()}
+    started = {'early': threading.Event(), 'late': threading.Event()}
+    recorded = []
+
+    def _record(item):
+        started[item].set()
+        events[item].wait(10.0)
+        recorded.append(item)
+
+    recording_queue = RecordingQueue(_record, workers=2)
+
+    try:
+        recording_queue.put('early')
+        assert started['early'].wait(10.0)
+
+        assert not recording_queue.flush(timeout=0.1)
+
+        # An item queued after the flush started is not waited on, even
+        # though it is still being recorded when the flush returns.
+
+        result = []
+
+        flush = threading.Thread(target=lambda: result.append(
+                recording_queue.flush(timeout=10.0)))
+        flush.start()
+        time.sleep(0.2)
+
+        recording_queue.put('late')
+        assert started['late'].wait(10.0)
+
+        events['early'].set()
+        flush.join(10.0)
+
+        assert result == [True]
+        assert recorded == ['early']
+
+    finally:
+        events['early'].set()
+        events['late'].set()
+        recording_queue.shutdown(timeout=10.0)
+
+    assert recorded == ['early', 'late']
+
+
+def test_counters_from_many_threads():
+    recording_queue = RecordingQueue(lambda item: None, maxsize=10000)
+
+    def _put():
+        for index in range(500):
+            recording_queue.put(index)
+
+    threads = [threading.Thread(target=_put) for _ in range(8)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert recording_queue.flush(timeout=10.0)
+
+    metrics = dict(recording_queue.metrics())
+    prefix = 'Supportability/Python/RecordTransaction/Queue/'
+
+    assert metrics[prefix + 'Enqueued'] == {'count': 4000}
+    assert metrics[prefix + 'Dropped'] == {'count': 0}
+    assert metrics[prefix + 'Size'] == 0
+
+    recording_queue.shutdown(timeout=10.0)
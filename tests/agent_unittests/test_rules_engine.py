@@ -0,0 +1,58 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from newrelic.core.rules_engine import RulesEngine, SegmentCollapseEngine
+
+RULES = [{
+    'match_expression': '[0-9]+',
+    'replacement': '*',
+    'ignore': False,
+    'eval_order': 0,
+    'terminate_chain': True,
+    'each_segment': True,
+    'replace_all': False,
+}]
+
+SEGMENT_TERMS = [{'prefix': 'WebTransaction/Uri', 'terms': ['users']}]
+
+
+def test_rules_engine_results_cached():
+    engine = RulesEngine(RULES, cache_size=2)
+
+    assert engine.normalize('/users/1') == ('/users/*', False)
+    assert engine.normalize('/users/1') == ('/users/*', False)
+    assert engine.normalize(b'/users/1') == ('/users/*', False)
+    assert engine.cache.reset_counts() == (1, 2)
+    assert engine.cache.reset_counts() == (0, 0)
+
+    engine.normalize('/users/2')
+    engine.normalize('/users/3')
+    assert len(engine.cache) == 2
+
+
+def test_rules_engine_cache_disabled():
+    assert RulesEngine(RULES).cache is None
+    assert RulesEngine(RULES, cache_size=0).cache is None
+    assert RulesEngine([], cache_size=10).cache is None
+
+
+def test_segment_collapse_engine_results_cached():
+    engine = SegmentCollapseEngine(SEGMENT_TERMS, cache_size=10)
+
+    for _ in range(3):
+        assert engine.normalize('WebTransaction/Uri/users/1/edit') == (
+                'WebTransaction/Uri/users/*', False)
+
+    assert engine.cache.reset_counts() == (2, 1)
+    assert SegmentCollapseEngine([], cache_size=10).cache is None
@@ -0,0 +1,102 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+
+import pytest
+
+from newrelic.core.stats_engine import SampledDataSet
+
+
+def sampled_data_set(capacity, count, skipped=0):
+    data_set = SampledDataSet(capacity)
+    for index in range(count):
+        data_set.add(index, random.random())
+    data_set.num_seen += skipped
+    return data_set
+
+
+def merge_one_at_a_time(data_set, other_data_set):
+    # Reference implementation adding each sample of the other data set
+    # in turn, which the bulk merge must agree with.
+
+    for priority, _, sample in other_data_set.pq:
+        data_set.add(sample, priority)
+    data_set.num_seen += (other_data_set.num_seen -
+            other_data_set.num_samples)
+
+
+def copy_data_set(data_set):
+    copy = SampledDataSet(data_set.capacity)
+    copy.pq = list(data_set.pq)
+    copy.heap = data_set.heap
+    copy.num_seen = data_set.num_seen
+    return copy
+
+
+@pytest.mark.parametrize('capacity,count,other_count', (
+    (100, 0, 50),
+    (100, 50, 20),
+    (100, 50, 50),
+    (100, 50, 80),
+    (100, 100, 10),
+    (100, 100, 100),
+    (100, 100, 500),
+    (10, 5, 0),
+    (0, 0, 10),
+))
+def test_merge_retains_highest_priorities(capacity, count, other_count):
+    data_set = sampled_data_set(capacity, count)
+    other_data_set = sampled_data_set(max(other_count, 1), other_count,
+            skipped=7)
+
+    expected = copy_data_set(data_set)
+    merge_one_at_a_time(expected, other_data_set)
+
+    data_set.merge(other_data_set)
+
+    assert sorted(data_set.pq) == sorted(expected.pq)
+    assert data_set.num_seen == expected.num_seen
+    assert data_set.heap == expected.heap
+    assert data_set.num_samples <= max(capacity, 0)
+
+    if data_set.heap:
+        assert data_set.pq[0] == min(data_set.pq)
+
+
+def test_merge_equal_priorities():
+    data_set = SampledDataSet(4)
+    other_data_set = SampledDataSet(4)
+
+    for sample in range(4):
+        data_set.add(('first', sample), 0.5)
+        other_data_set.add(('second', sample), 0.5)
+    other_data_set.add(('second', 4), 0.75)
+
+    data_set.merge(other_data_set)
+
+    assert data_set.num_seen == 9
+    assert data_set.num_samples == 4
+    assert ('second', 4) in data_set.samples
+
+
+def test_add_after_merge_of_unsampled_events():
+    data_set = SampledDataSet(2)
+    data_set.merge(sampled_data_set(2, 0, skipped=10))
+
+    for sample in range(5):
+        data_set.add(sample, sample / 10.0)
+
+    assert data_set.num_seen == 15
+    assert sorted(data_set.samples) == [3, 4]
@@ -68,20 +68,83 @@ def destinations_as_int(destinations):
             result |= af.DST_BROWSER_MONITORING
     return result
 
+def apply_rules(attribute_filter, name, default_destinations):
+
+    # Reference implementation applying every rule in order, which the
+    # compiled rules of the attribute filter must agree with.
+
+    enabled_destinations = attribute_filter.enabled_destinations
+    destinations = enabled_destinations & default_destinations
+
+    for rule in attribute_filter.rules:
+        if rule.name_match(name):
+            if rule.is_include:
+                destinations |= rule.destinations & enabled_destinations
+            else:
+                destinations &= ~rule.destinations
+
+    return destinations
+
+@pytest.mark.parametrize('cache_size', (0, 1000))
 @pytest.mark.parametrize(','.join(_fields), _attributes_tests)
 def test_attributes(testname, config, input_key, input_default_destinations,
-            expected_destinations):
+            expected_destinations, cache_size):
 
     settings = _default_settings()
+    settings['agent_limits.attribute_filter_cache_size'] = cache_size
     for k, v in config.items():
         settings[k] = v
 
     attribute_filter = af.AttributeFilter(settings)
     input_destinations = destinations_as_int(input_default_destinations)
-
-    result = attribute_filter.apply(input_key, input_destinations)
     expected = destinations_as_int(expected_destinations)
-    assert result == expected, attribute_filter
+
+    # Apply twice so that a cached result is also checked.
+
+    for _ in range(2):
+        result = attribute_filter.apply(input_key, input_destinations)
+        assert result == expected, attribute_filter
+
+    assert apply_rules(attribute_filter, input_key,
+            input_destinations) == expected
+
+def test_attributes_match_rule_order():
+    settings = _default_settings()
+    settings.update({
+        'attributes.include': ['a*', 'abc', 'b*'],
+        'attributes.exclude': ['ab*', 'abc*', 'b', '*'],
+        'transaction_events.attributes.include': ['abc*', 'b*', 'x'],
+        'transaction_events.attributes.exclude': ['a', 'abcd'],
+        'transaction_tracer.attributes.include': ['*', 'ab'],
+        'transaction_tracer.attributes.exclude': ['a*', 'abcd*'],
+        'error_collector.attributes.include': ['abcd', 'bc*'],
+        'error_collector.attributes.exclude': ['abc', 'b*'],
+    })
+
+    attribute_filter = af.AttributeFilter(settings)
+
+    names = ['', 'a', 'ab', 'abc', 'abcd', 'abcde', 'ac', 'b', 'bc', 'bcd',
+            'c', 'x', 'xy']
+
+    for name in names:
+        for default_destinations in range(af.DST_ALL + 1):
+            expected = apply_rules(attribute_filter, name,
+                    default_destinations)
+            result = attribute_filter.apply(name, default_destinations)
+            assert result == expected, (name, default_destinations)
+
+def test_attribute_filter_cache_bounded():
+    settings = _default_settings()
+    settings['agent_limits.attribute_filter_cache_size'] = 2
+    settings['attributes.exclude'] = ['user.*']
+
+    attribute_filter = af.AttributeFilter(settings)
+
+    for index in range(5):
+        name = 'user.%d' % index
+        assert attribute_filter.apply(name, af.DST_ALL) == af.DST_NONE
+
+    assert 0 < len(attribute_filter.cache) <= 2
 
 _sorting_tests = [
     ('lexicographic', ('a', 1, True), ('ab', 1, True)),
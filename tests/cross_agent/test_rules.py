@@ -42,17 +42,21 @@ def _make_case_insensitive(rules):
             rule['replacement'] = rule['replacement'].lower()
     return rules
 
+@pytest.mark.parametrize('cache_size', (0, 1000))
 @pytest.mark.parametrize('test_group', _load_tests())
-def test_rules_engine(test_group):
+def test_rules_engine(test_group, cache_size):
 
     # FIXME: The test fixture assumes that matching is case insensitive when it
     # is not. To avoid errors, just lowercase all rules, inputs, and expected
     # values.
     insense_rules = _make_case_insensitive(test_group['rules'])
     test_rules = _prepare_rules(insense_rules)
-    rules_engine = RulesEngine(test_rules)
+    rules_engine = RulesEngine(test_rules, cache_size)
 
-    for test in test_group['tests']:
+    # Run through the tests twice, so that results are also returned
+    # from the cache when enabled.
+
+    for test in test_group['tests'] * 2:
 
         # lowercase each value
         input_str = test['input'].lower()
@@ -16,8 +16,11 @@ import json
 import os
 import pytest
 
+from newrelic.core.config import global_settings
 from newrelic.core.database_utils import SQLStatement
 
+from testing_support.fixtures import override_generic_settings
+
 
 CURRENT_DIR = os.path.dirname(os.path.realpath(__file__))
 JSON_DIR = os.path.normpath(os.path.join(CURRENT_DIR, 'fixtures',
@@ -58,16 +61,24 @@ class DummyDB(object):
         self.quoting_style = quoting_style
 
 
+@pytest.mark.parametrize('engine', ['regex', 'tokenizer'])
 @pytest.mark.parametrize(_parameters, load_tests())
-def test_sql_obfuscation(obfuscated, dialects, sql, pathological):
+def test_sql_obfuscation(obfuscated, dialects, sql, pathological, engine):
 
     if pathological:
         pytest.skip()
 
     quoting_styles = get_quoting_styles(dialects)
 
-    for quoting_style in quoting_styles:
-        database = DummyDB(quoting_style)
-        statement = SQLStatement(sql, database)
-        actual_obfuscated = statement.obfuscated
-        assert actual_obfuscated in obfuscated
+    @override_generic_settings(global_settings(), {
+        'transaction_tracer.sql_obfuscation_engine': engine,
+        'agent_limits.sql_statement_cache_size': 0,
+    })
+    def _test():
+        for quoting_style in quoting_styles:
+            database = DummyDB(quoting_style)
+            statement = SQLStatement(sql, database)
+            actual_obfuscated = statement.obfuscated
+            assert actual_obfuscated in obfuscated
+
+    _test()
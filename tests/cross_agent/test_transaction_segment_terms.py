@@ -45,10 +45,12 @@ def load_tests():
 
 _parameters = ",".join(_parameters_list)
 
+@pytest.mark.parametrize('cache_size', (0, 1000))
 @pytest.mark.parametrize(_parameters, load_tests())
-def test_transaction_segments(testname, transaction_segment_terms, tests):
-    engine = SegmentCollapseEngine(transaction_segment_terms)
-    for test in tests:
+def test_transaction_segments(testname, transaction_segment_terms, tests,
+        cache_size):
+    engine = SegmentCollapseEngine(transaction_segment_terms, cache_size)
+    for test in tests * 2:
         assert engine.normalize(test['input'])[0] == test['expected']
 
 @contextmanager